@@ -16,46 +16,529 @@ Usage:
 - Run 'pip install Flask Flask-SQLAlchemy' to install dependencies.
 - python3 app.py <-- to run the application
 - apt install python3.10-venv
+- Applications are built by create_app(config); WSGI servers can load 'app:create_app()'
 """
-from flask import Flask, render_template, session, redirect, url_for, request, jsonify, flash, abort
-from database.models import db, UsersModel, ChatModel
+from flask import (Flask, Response, current_app, render_template, session, redirect, url_for, request, jsonify, flash,
+                   abort, make_response, send_file)
+from database.models import db, UsersModel, ChatModel, AttachmentModel, SSHKeyModel, upgrade_schema
+from database.attachment_store import AttachmentStore, AttachmentTooLarge
+from database.message_store import MessageStore, create_message_store
+from database.message_admin import messages_cli
+from database.replication import Replication, ReplicationFollower
+from database.user_admin import users_cli
+from database.write_pipeline import MessageWriteQueue
 from utils.encryption_tools import get_password_hash
+from utils.password_verifier import LoginBusy, PasswordVerifier
+from utils import wire_format
+from utils.broadcaster import RESYNC, Broadcaster, SubscriberClosed, TooManySubscribers
+from utils.poll_hints import POLL_INTERVAL_HEADER, suggest_poll_interval
+from utils.presence import HEARTBEAT_INTERVAL, PresenceTracker
+from utils.profiling import DEFAULT_PROFILE_DIR, Profiler
+from utils.snapshot import Snapshot, Snapshotter, read_snapshot, write_snapshot
+from utils.ssh_keys import SIGNATURE_NAMESPACE, SSHKeyError, SSHKeyIndex, parse_public_key, verify_signature
+from utils.static_assets import StaticAssets
+from utils.tracing import DEFAULT_TRACE_FILE, RequestTracer, span
+from utils.session_store import (MemorySessionStore, SessionStore, SQLiteSessionStore, ServerSideSessionInterface,
+                                 load_or_create_secret)
 from config.server_config import ServerConfig
-from flask_sqlalchemy import SQLAlchemy
 from socket import inet_aton
+from werkzeug.serving import is_running_from_reloader
+from typing import Callable, NoReturn, Optional
 import argparse
+import hmac
+import json
+import secrets
+import signal
+import threading
+import time
 import traceback
+import sys
 import os
 
 # Get current working directory
 cwd = os.path.abspath(os.path.dirname(__file__))
 
-app = Flask(__name__)
+# Default database URI
+DEFAULT_DATABASE_URI = 'sqlite:///' + os.path.join(cwd, 'database', 'server.db')
 
-# Set a secret key for your application
-app.secret_key = os.urandom(24)
+# Default locations of the shared session secret and the session database
+DEFAULT_SECRET_KEY_FILE = os.path.join(cwd, 'config', 'secret_key')
+DEFAULT_SESSION_DATABASE = os.path.join(cwd, 'database', 'sessions.db')
 
-# Configure the default database URI
-database_uri = 'sqlite:///' + os.path.join(cwd, 'database', 'server.db')
-app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+# Default location of the warm-restart snapshot
+DEFAULT_SNAPSHOT_FILE = os.path.join(cwd, 'database', 'state.snapshot')
 
-# Initialize SQLAlchemy instance
-db.init_app(app)
-
-with app.app_context():
-    db.create_all()
-
-# Instantiate the server configuration
-server_config = ServerConfig()
+# Default directory of the content-addressed attachment files
+DEFAULT_ATTACHMENT_DIR = os.path.join(cwd, 'database', 'attachments')
 
 # Max users
 MAX_USER_COUNT = 3
 
-# users currently logged in
-active_user_count = 0
+# Most messages accepted by one '/submit_messages' request
+MAX_BATCH_MESSAGES = 1000
+
+# Header carrying a bot's CHAT_BOT_TOKENS token on '/submit_messages'
+BOT_TOKEN_HEADER = 'X-Chat-Bot-Token'
+
+# Content types accepted as newline-delimited JSON by '/submit_messages'
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl')
+
+# Search result page size limits
+DEFAULT_SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+
+# History export formats and their content types
+EXPORT_FORMATS = {'ndjson': wire_format.NDJSON_MIMETYPE, 'csv': wire_format.CSV_MIMETYPE}
+
+# Attachment media types shown in the browser, every other type is served as a download
+INLINE_ATTACHMENT_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'text/plain'}
+
+# Attachments never change under their id, so clients may cache them for a year
+ATTACHMENT_MAX_AGE = 365 * 24 * 3600
+
+# Seconds a user has to sign an SSH key challenge
+SSH_CHALLENGE_TTL = 300
+
+# Seconds a push stream waits for updates before checking the store and sending a keep-alive
+PUSH_WAIT = 5.0
+# Milliseconds a browser waits before reconnecting a dropped push stream
+PUSH_RETRY_MS = 3000
+
+# View functions collected at import time, registered on every application by create_app
+_routes = []
+
+
+def route(rule: str, **options):
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Decorator that records a view function so create_app can register it on each
+        application instance. Takes the same arguments as Flask.route and keeps the
+        endpoint names unchanged.
+
+    Returns:
+        function: The decorator.
+    """
+    def decorator(view_func):
+        _routes.append((rule, view_func, options))
+        return view_func
+    return decorator
+
+
+class ChatServerState:
+    """
+    Per-application state created by create_app. The server configuration and the
+    message store are loaded on first use and the database schema is checked on the
+    first request.
+    """
+
+    def __init__(self, config_filename: Optional[str] = None, presence: Optional[PresenceTracker] = None,
+                 store_factory: Optional[Callable[[ServerConfig], MessageStore]] = None,
+                 write_batch_window: Optional[float] = None,
+                 password_verifier: Optional[PasswordVerifier] = None) -> NoReturn:
+        """
+        Initialize the ChatServerState instance.
+
+        Args:
+            config_filename (str): Optional path of the server configuration file.
+            presence (PresenceTracker): Optional presence tracker, a default one is created otherwise.
+            store_factory (Callable): Builds the message store from the server configuration.
+            write_batch_window (float): Batch window of the group-commit write pipeline, None
+                                        to write each message in its own transaction.
+            password_verifier (PasswordVerifier): Optional login verifier, a default one is
+                                                  created otherwise.
+
+        Returns:
+            NoReturn
+        """
+        self.config_filename = config_filename
+        self.presence = presence if presence is not None else PresenceTracker()
+        self.store_factory = store_factory
+        self.write_batch_window = write_batch_window
+        self.password_verifier = password_verifier if password_verifier is not None else PasswordVerifier()
+        self.snapshotter = None
+        self.last_snapshot = None
+        self.attachment_store = None
+        self.ssh_keys = None
+        self.broadcaster = Broadcaster()
+        self.schema_ready = False
+        self.lock = threading.RLock()
+        self._server_config = None
+        self._message_store = None
+        self._message_writer = None
+
+    @property
+    def server_config(self) -> ServerConfig:
+        """
+        Get the server configuration, loading it on first use.
+
+        Returns:
+            ServerConfig: The server configuration.
+        """
+        if self._server_config is None:
+            with self.lock:
+                if self._server_config is None:
+                    self._server_config = ServerConfig(self.config_filename)
+        return self._server_config
+
+    @property
+    def message_store(self) -> MessageStore:
+        """
+        Get the message store selected by the server configuration, creating it on first use.
+
+        Returns:
+            MessageStore: The message store.
+        """
+        if self._message_store is None:
+            with self.lock:
+                if self._message_store is None:
+                    self._message_store = self.store_factory(self.server_config)
+        return self._message_store
+
+    @property
+    def message_writer(self) -> Optional[MessageWriteQueue]:
+        """
+        Get the group-commit write pipeline, creating it on first use.
+
+        Returns:
+            MessageWriteQueue or None: The write queue, None if write-behind is disabled.
+        """
+        if self._message_writer is None and self.write_batch_window is not None:
+            with self.lock:
+                if self._message_writer is None:
+                    self._message_writer = MessageWriteQueue(self.message_store, batch_window=self.write_batch_window)
+        return self._message_writer
+
+
+def create_app(config: Optional[dict] = None) -> Flask:
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Application factory. Builds and configures a Flask application without touching the
+        database or the configuration file, so creating an application is cheap. The schema
+        is created on the first request (or by calling init_schema), and the ServerConfig is
+        loaded the first time it is needed.
+
+    Args:
+        config (dict): Optional Flask configuration overrides, for example
+                       SQLALCHEMY_DATABASE_URI='sqlite://' for an isolated in-memory database,
+                       SECRET_KEY, or CHAT_SERVER_CONFIG_FILE for the server configuration path.
+                       Sessions are kept server side in CHAT_SESSION_STORE ('sqlite',
+                       'memory' or a SessionStore instance); without an explicit SECRET_KEY
+                       the shared secret is read from CHAT_SECRET_KEY_FILE. Setting
+                       CHAT_WRITE_BEHIND batches message inserts into group commits
+                       collected over CHAT_WRITE_BATCH_WINDOW seconds. Users without a
+                       heartbeat for CHAT_PRESENCE_TTL seconds leave the chat room.
+                       Presence is shared by the workers through the database: heartbeats
+                       are written every CHAT_PRESENCE_FLUSH_INTERVAL seconds, and the
+                       present users are read every CHAT_PRESENCE_CACHE_TTL seconds.
+                       CHAT_MESSAGE_STORE may hold a MessageStore instance, otherwise the
+                       store is chosen by the server configuration.
+                       In-process state is snapshotted to CHAT_SNAPSHOT_FILE every
+                       CHAT_SNAPSHOT_INTERVAL seconds, by the one worker holding a lock on
+                       the snapshot file, which restores it on its first request.
+                       Password hashes are derived by CHAT_LOGIN_WORKERS threads, with at
+                       most CHAT_LOGIN_MAX_PENDING logins in progress. Attachments of up
+                       to CHAT_ATTACHMENT_MAX_SIZE bytes are stored in CHAT_ATTACHMENT_DIR.
+                       SSH key lookups are cached for CHAT_SSH_KEY_CACHE_TTL seconds.
+                       Changes saved to the server configuration file by other processes
+                       are picked up within CHAT_CONFIG_CHECK_INTERVAL seconds.
+                       Setting CHAT_REPLICATION_NODE_ID logs message writes for peer nodes
+                       and follows the CHAT_REPLICATION_PEERS, authenticated with
+                       CHAT_REPLICATION_TOKEN, from the one worker holding
+                       CHAT_REPLICATION_LOCK_FILE (see database/replication.py).
+                       At most CHAT_PUSH_MAX_SUBSCRIBERS clients receive pushed updates,
+                       each with CHAT_PUSH_QUEUE_SIZE queued batches, and clients behind
+                       for CHAT_PUSH_EVICT_AFTER seconds are disconnected. Every stream
+                       holds a request thread, so pushing is only offered by servers
+                       handling requests on threads (CHAT_PUSH None), or always (True,
+                       for async workers) or never (False). Setting CHAT_WORKER_THREADS
+                       to the threads per worker caps the streams at half of them.
+                       Setting CHAT_TRACE_FILE records timing spans for a
+                       CHAT_TRACE_SAMPLE_RATE fraction of requests (see utils/tracing.py).
+                       CHAT_PROFILING enables on-demand profiling, guarded by
+                       CHAT_PROFILE_TOKEN (see utils/profiling.py).
+                       CHAT_BOT_TOKENS maps bot names to the tokens they send to
+                       '/submit_messages' to post under their name without a session.
+
+    Returns:
+        Flask: The configured application.
+    """
+    app = Flask(__name__)
+
+    # Defaults, overridden by the caller's configuration
+    app.config['SQLALCHEMY_DATABASE_URI'] = DEFAULT_DATABASE_URI
+    app.config['SECRET_KEY'] = None
+    app.config['CHAT_SECRET_KEY_FILE'] = DEFAULT_SECRET_KEY_FILE
+    app.config['CHAT_SESSION_STORE'] = 'sqlite'
+    app.config['CHAT_SESSION_DATABASE'] = DEFAULT_SESSION_DATABASE
+    app.config['CHAT_SERVER_CONFIG_FILE'] = None
+    app.config['CHAT_CONFIG_CHECK_INTERVAL'] = ServerConfig.DEFAULT_CHECK_INTERVAL
+    app.config['CHAT_WRITE_BEHIND'] = False
+    app.config['CHAT_WRITE_BATCH_WINDOW'] = MessageWriteQueue.DEFAULT_BATCH_WINDOW
+    app.config['CHAT_PRESENCE_TTL'] = PresenceTracker.DEFAULT_TTL
+    app.config['CHAT_PRESENCE_FLUSH_INTERVAL'] = PresenceTracker.DEFAULT_FLUSH_INTERVAL
+    app.config['CHAT_PRESENCE_CACHE_TTL'] = PresenceTracker.DEFAULT_CACHE_TTL
+    app.config['CHAT_MESSAGE_STORE'] = None
+    app.config['CHAT_SNAPSHOT_FILE'] = DEFAULT_SNAPSHOT_FILE
+    app.config['CHAT_SNAPSHOT_INTERVAL'] = Snapshotter.DEFAULT_INTERVAL
+    app.config['CHAT_LOGIN_WORKERS'] = PasswordVerifier.DEFAULT_WORKERS
+    app.config['CHAT_LOGIN_MAX_PENDING'] = PasswordVerifier.DEFAULT_MAX_PENDING
+    app.config['CHAT_ATTACHMENT_DIR'] = DEFAULT_ATTACHMENT_DIR
+    app.config['CHAT_ATTACHMENT_MAX_SIZE'] = AttachmentStore.DEFAULT_MAX_SIZE
+    app.config['CHAT_SSH_KEY_CACHE_TTL'] = SSHKeyIndex.DEFAULT_TTL
+    app.config['CHAT_REPLICATION_NODE_ID'] = None
+    app.config['CHAT_REPLICATION_TOKEN'] = None
+    app.config['CHAT_REPLICATION_PEERS'] = {}
+    app.config['CHAT_REPLICATION_INTERVAL'] = ReplicationFollower.DEFAULT_INTERVAL
+    app.config['CHAT_REPLICATION_LOCK_FILE'] = None
+    app.config['CHAT_PUSH'] = None
+    app.config['CHAT_WORKER_THREADS'] = None
+    app.config['CHAT_PUSH_MAX_SUBSCRIBERS'] = Broadcaster.DEFAULT_MAX_SUBSCRIBERS
+    app.config['CHAT_PUSH_QUEUE_SIZE'] = Broadcaster.DEFAULT_QUEUE_SIZE
+    app.config['CHAT_PUSH_EVICT_AFTER'] = Broadcaster.DEFAULT_EVICT_AFTER
+    app.config['CHAT_TRACE_FILE'] = None
+    app.config['CHAT_TRACE_SAMPLE_RATE'] = RequestTracer.DEFAULT_SAMPLE_RATE
+    app.config['CHAT_PROFILING'] = False
+    app.config['CHAT_PROFILE_TOKEN'] = None
+    app.config['CHAT_PROFILE_DIR'] = DEFAULT_PROFILE_DIR
+    app.config['CHAT_PROFILE_SECONDS'] = Profiler.DEFAULT_SECONDS
+    app.config['CHAT_BOT_TOKENS'] = {}
+    if config:
+        app.config.update(config)
+
+    # Every worker and node must sign session cookies with the same persisted secret
+    if not app.config['SECRET_KEY']:
+        app.config['SECRET_KEY'] = load_or_create_secret(app.config['CHAT_SECRET_KEY_FILE'])
+
+    # Keep sessions server side so they are shared by workers and survive restarts
+    app.session_interface = ServerSideSessionInterface(_create_session_store(app.config))
+
+    # Initialize SQLAlchemy instance
+    db.init_app(app)
+
+    # Serve fingerprinted, precompressed static assets when they have been built
+    StaticAssets(app)
+
+    message_store = app.config['CHAT_MESSAGE_STORE']
+    state = ChatServerState(app.config['CHAT_SERVER_CONFIG_FILE'],
+                            PresenceTracker(app.config['CHAT_PRESENCE_TTL'], app.config['CHAT_PRESENCE_FLUSH_INTERVAL'],
+                                            app.config['CHAT_PRESENCE_CACHE_TTL']),
+                            store_factory=lambda server_config: message_store or create_message_store(app, server_config),
+                            write_batch_window=app.config['CHAT_WRITE_BATCH_WINDOW'] if app.config['CHAT_WRITE_BEHIND'] else None,
+                            password_verifier=PasswordVerifier(app.config['CHAT_LOGIN_WORKERS'],
+                                                               app.config['CHAT_LOGIN_MAX_PENDING']))
+    if app.config['CHAT_SNAPSHOT_FILE']:
+        state.snapshotter = Snapshotter(lambda: save_snapshot(app), app.config['CHAT_SNAPSHOT_INTERVAL'],
+                                        lock_file=app.config['CHAT_SNAPSHOT_FILE'] + '.lock',
+                                        restore=lambda: restore_snapshot(app))
+    state.attachment_store = AttachmentStore(app.config['CHAT_ATTACHMENT_DIR'])
+    max_subscribers = app.config['CHAT_PUSH_MAX_SUBSCRIBERS']
+    if app.config['CHAT_WORKER_THREADS']:
+        # Keep half of the worker's threads for ordinary requests
+        max_subscribers = min(max_subscribers, app.config['CHAT_WORKER_THREADS'] // 2)
+    state.broadcaster = Broadcaster(max_subscribers, app.config['CHAT_PUSH_QUEUE_SIZE'],
+                                    app.config['CHAT_PUSH_EVICT_AFTER'])
+    state.ssh_keys = SSHKeyIndex(lambda fingerprint: SSHKeyModel.get_key(app, fingerprint),
+                                 app.config['CHAT_SSH_KEY_CACHE_TTL'])
+    app.extensions['chat_server'] = state
+    app.before_request(_ensure_schema)
+    app.before_request(_ensure_snapshotter)
+    app.before_request(_reload_server_config)
+    app.teardown_request(_flush_presence)
+
+    for rule, view_func, options in _routes:
+        app.add_url_rule(rule, view_func=view_func, **options)
+
+    # Replication between nodes, profiling and sampled request tracing, off unless
+    # configured. Tracing wraps the views so it comes after every route.
+    Replication(app)
+    Profiler(app)
+    RequestTracer(app)
+
+    # Bulk user administration and history export, 'flask --app app users --help'
+    app.cli.add_command(users_cli)
+    app.cli.add_command(messages_cli)
+
+    return app
+
+
+def _create_session_store(config) -> SessionStore:
+    """
+    Build the session store selected by the CHAT_SESSION_STORE configuration value.
+
+    Args:
+        config (Config): The application configuration.
+
+    Returns:
+        SessionStore: The session store.
+    """
+    store = config['CHAT_SESSION_STORE']
+    if store == 'sqlite':
+        return SQLiteSessionStore(config['CHAT_SESSION_DATABASE'])
+    if store == 'memory':
+        return MemorySessionStore()
+    return store
+
+
+def init_schema(app: Flask) -> NoReturn:
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Creates the database tables, upgrades existing ones and creates the full-text search
+        index if needed, then logs out users whose presence expired. Runs once per
+        application; later calls return immediately.
+
+    Args:
+        app (Flask): The Flask application instance.
+
+    Returns:
+        NoReturn
+    """
+    state = app.extensions['chat_server']
+    if state.schema_ready:
+        return
+
+    with state.lock:
+        if not state.schema_ready:
+            with app.app_context():
+                db.create_all()
+            upgrade_schema(app)
+
+            # Full-text search index over unencrypted chat messages
+            ChatModel.create_search_index(app)
+
+            # Log out users whose heartbeat expired while no worker was running
+            state.presence.flush(app)
+            state.schema_ready = True
+
+
+def save_snapshot(app: Flask) -> int:
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Writes pending presence changes to the database, then the presence and, for stores
+        that only keep them in memory, the message window of the application to its
+        warm-restart snapshot file. Nothing is written if neither changed since the last
+        snapshot.
+
+    Args:
+        app (Flask): The Flask application instance.
+
+    Returns:
+        int: Size of the snapshot in bytes, 0 if it was unchanged.
+    """
+    state = app.extensions['chat_server']
+    state.presence.flush(app)
+    records, next_message_id = [], 0
+    if state.message_store.supports_warm_restart:
+        records, next_message_id = state.message_store.export_window()
+    presence = state.presence.last_heartbeats(app)
+    content = (next_message_id, records, presence)
+    if content == state.last_snapshot:
+        return 0
+    size = write_snapshot(app.config['CHAT_SNAPSHOT_FILE'], Snapshot(time.time(), next_message_id, records, presence))
+    state.last_snapshot = content
+    return size
+
+
+def restore_snapshot(app: Flask) -> Optional[Snapshot]:
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Loads the warm-restart snapshot, if there is a valid one, into the message store and
+        the presence tracker. Users keep their seat if their last heartbeat, counting the
+        downtime, is still within the presence TTL.
+
+    Args:
+        app (Flask): The Flask application instance.
+
+    Returns:
+        Snapshot or None: The restored snapshot, None if there was none to restore.
+    """
+    if not app.config['CHAT_SNAPSHOT_FILE']:
+        return None
+    start = time.perf_counter()
+    snapshot = read_snapshot(app.config['CHAT_SNAPSHOT_FILE'])
+    if snapshot is None:
+        return None
+
+    state = app.extensions['chat_server']
+    restored = state.message_store.restore_window(snapshot.messages, snapshot.next_message_id)
+    state.presence.restore_last_heartbeats(app, snapshot.presence)
+    print(f"Restored snapshot: {len(snapshot.messages) if restored else 0} messages, "
+          f"{state.presence.count(app)} present users "
+          f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return snapshot
+
+
+def _ensure_schema() -> NoReturn:
+    """
+    before_request hook that makes sure the schema exists before the first request is handled.
+    """
+    init_schema(current_app._get_current_object())
+
+
+def _ensure_snapshotter() -> NoReturn:
+    """
+    before_request hook that restores the snapshot and starts the snapshots in the one
+    worker holding the snapshot lock.
+    """
+    snapshotter = get_state().snapshotter
+    if snapshotter is not None:
+        snapshotter.ensure_started()
+
+
+def _reload_server_config() -> NoReturn:
+    """
+    before_request hook that picks up server configuration changes saved by other workers,
+    looking at the file once per CHAT_CONFIG_CHECK_INTERVAL at most.
+    """
+    app = current_app._get_current_object()
+    app.extensions['chat_server'].server_config.reload_if_changed(app.config['CHAT_CONFIG_CHECK_INTERVAL'])
 
 
-@app.route('/', methods=['GET', 'POST'])
+def _flush_presence(exception: Optional[BaseException] = None) -> NoReturn:
+    """
+    teardown_request hook that writes pending presence changes to the database once the
+    flush interval has passed.
+    """
+    app = current_app._get_current_object()
+    if app.extensions['chat_server'].schema_ready:
+        app.extensions['chat_server'].presence.maybe_flush(app)
+
+
+def get_state() -> ChatServerState:
+    """
+    Get the state of the current application.
+
+    Returns:
+        ChatServerState: The per-application state.
+    """
+    return current_app.extensions['chat_server']
+
+
+def get_server_config() -> ServerConfig:
+    """
+    Get the server configuration of the current application.
+
+    Returns:
+        ServerConfig: The server configuration.
+    """
+    return get_state().server_config
+
+
+@route('/', methods=['GET', 'POST'])
 def home():
     """
     Author: 
@@ -71,16 +554,19 @@ def home():
         render_template: The rendered home page template with relevant user information and server settings.
     """
 
+    state = get_state()
+    server_config = state.server_config
+
     # Set authentication value
     logged_in = False
     ssh_key_uploaded = False
+    ssh_verified = False
     user_entry = False
     if 'username' in session:
-        user_entry = UsersModel.user_exists(app, session['username'])
-        logged_in = UsersModel.is_logged_in(app, session['username'])
-        ssh_key_uploaded = UsersModel.has_uploaded_ssh_key(app, session['username'])
-
-    global active_user_count
+        user_entry = UsersModel.user_exists(current_app, session['username'])
+        logged_in = state.presence.is_present(current_app, session['username'])
+        ssh_key_uploaded = UsersModel.has_uploaded_ssh_key(current_app, session['username'])
+        ssh_verified = state.ssh_keys.owner(session.get('ssh_fingerprint')) == session['username']
 
     # Init function vars
     error_message = ""
@@ -101,14 +587,17 @@ def home():
                     error_message += f"Create a username or login if you have one.<br>"
                 if server_config.ssh_enabled and not ssh_key_uploaded:
                     error_message += "SSH is enabled, but you haven't enabled SSH for your account.<br>"
+                elif server_config.ssh_enabled and not ssh_verified:
+                    error_message += "SSH is enabled, sign in with your SSH key on the SSH key page.<br>"
                 if server_config.encryption_enabled and not logged_in:
                     error_message += "Encryption is enabled, but you haven't authenticated.<br>"
 
     return render_template('home.html', logged_in=logged_in, ssh_key_uploaded=ssh_key_uploaded, server_config=server_config, error_message=error_message,
-                           active_user_count=active_user_count, max_user_count=MAX_USER_COUNT, version=server_config.version)
+                           active_user_count=state.presence.count(current_app), max_user_count=MAX_USER_COUNT, version=server_config.version,
+                           heartbeat_interval=HEARTBEAT_INTERVAL if logged_in else '')
 
 
-@app.route('/user_action', methods=['GET', 'POST'])
+@route('/user_action', methods=['GET', 'POST'])
 def user_action():
     """
     Author:
@@ -124,12 +613,19 @@ def user_action():
         Response: A Flask Response object containing the appropriate HTML
         template to render based on the user action.
 
-    Global Variables:
-        - active_user_count (int): Tracks the number of active users.
-          Incremented on user login and decrements on logout.
+    Presence:
+        - Logging in takes a seat in the chat room if one is free, logging out or
+          deleting the user frees it. Seats also free up when heartbeats stop.
+
+    Passwords:
+        - Users given their own password ('users set-password') are checked against
+          their salted record, on the bounded login pool; when it is saturated the
+          request is answered with 429 Too Many Requests. Everyone else is checked
+          against the server password, so changing it revokes their access.
     """
 
-    global active_user_count
+    state = get_state()
+    server_config = state.server_config
 
     # Get necessary server configuration values
     max_username_length = server_config.max_username_length()
@@ -142,10 +638,19 @@ def user_action():
         action = request.form.get('action')
 
         # Check if the username exists in the database
-        user = None
-        if (UsersModel.user_exists(app, username)):
-            user = UsersModel.get_user_entry(app, username)
-        password_match = (get_password_hash(password) == server_config.password_hash)
+        user = UsersModel.get_user_entry(current_app, username)
+        try:
+            if user is not None and user.password_record:
+                with span('encryption_tools.verify_password'):
+                    password_match = state.password_verifier.verify(password, user.password_record)
+            else:
+                with span('encryption_tools.get_password_hash'):
+                    password_match = (get_password_hash(password) == server_config.password_hash)
+        except LoginBusy:
+            flash('Too many logins in progress. Please try again shortly', 'error')
+            response = make_response(render_template('user_action.html', max_username_length=max_username_length), 429)
+            response.headers['Retry-After'] = str(PasswordVerifier.RETRY_AFTER)
+            return response
 
         # If validated
         if not password_match:  # username limits controlled by html
@@ -154,20 +659,22 @@ def user_action():
         # If logging in
         elif action == 'login':
 
+            # If user exist
+            if not user:
+                flash(f'Username: {username} does not exist. Please add user.')
+
             # If chat not full
-            if MAX_USER_COUNT <= active_user_count:
+            elif not state.presence.join(current_app, username, MAX_USER_COUNT):
                 flash('Chat room is full. Please try again later', 'error')
 
-            # If user exist
-            elif user:
-                if 'username' not in session:
-                    session['username'] = username
-                    UsersModel.set_logged_in(app, username, True)
-                    active_user_count += 1
-                return redirect(url_for('home'))
-
             else:
-                flash(f'Username: {username} does not exist. Please add user.')
+                previous_username = session.get('username')
+                if previous_username and previous_username != username:
+                    state.presence.leave(current_app, previous_username)
+                    session.pop('ssh_fingerprint', None)
+                session['username'] = username
+                session.regenerate()
+                return redirect(url_for('home'))
 
         # If adding user
         elif action == 'add_user':
@@ -176,15 +683,14 @@ def user_action():
 
             else:
                 new_user = UsersModel(username=username)
-                UsersModel.add_user(app, new_user)
+                UsersModel.add_user(current_app, new_user)
                 flash(f'User account created for: {username}. You may now login!')
 
         # User logout
         elif action == 'logout':
             if 'username' in session:
-                session.pop('username', None)
-                UsersModel.set_logged_in(app, username, False)
-                active_user_count -= 1
+                state.presence.leave(current_app, session.pop('username'))
+                session.pop('ssh_fingerprint', None)
                 flash(f'User {username} has been logged out.', 'success')
 
             else:
@@ -192,15 +698,18 @@ def user_action():
 
         # Delete user
         elif action == 'delete_user':
-            if UsersModel.user_exists(app, username):
+            if UsersModel.user_exists(current_app, username):
 
-                # Remove database entry for user
-                UsersModel.remove_user(app, username)
+                # Remove database entry for user, with their SSH keys
+                for key in SSHKeyModel.get_user_keys(current_app, username):
+                    state.ssh_keys.discard(key.fingerprint)
+                UsersModel.remove_user(current_app, username)
 
-                # Pop if in an active flask session
-                if 'username' in session:
+                # Free the seat and pop if in an active flask session
+                state.presence.leave(current_app, username)
+                if session.get('username') == username:
                     session.pop('username', None)
-                    active_user_count -= 1
+                    session.pop('ssh_fingerprint', None)
 
                 flash(f'User account {username} has been deleted.', 'success')
 
@@ -210,20 +719,128 @@ def user_action():
     return render_template('user_action.html', max_username_length=max_username_length)
 
 
-@app.route('/ssh_key_loader')
+@route('/ssh_key_loader')
 def ssh_key_loader():
-    """ 
-    Renders the SSH key uploading interface. This endpoint enables users to
-    upload their SSH keys.
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Renders the SSH key interface. Users upload OpenSSH public keys, see their stored
+        keys, and sign in with a key by signing the challenge shown on the page with
+        'ssh-keygen -Y sign'. A new challenge is issued each time the page is rendered.
+
+    Returns:
+        render_template: The rendered SSH key page template.
+    """
+    if 'username' not in session:
+        flash('Login before managing SSH keys.')
+        return redirect(url_for('user_action'))
+
+    challenge = secrets.token_urlsafe(24)
+    session['ssh_challenge'] = {'value': challenge, 'issued': time.time()}
+    username = session['username']
+    return render_template('ssh_key_loader.html', keys=SSHKeyModel.get_user_keys(current_app, username),
+                           challenge=challenge, namespace=SIGNATURE_NAMESPACE,
+                           active_fingerprint=session.get('ssh_fingerprint'),
+                           ssh_enabled=get_server_config().ssh_enabled)
+
+
+@route('/ssh_keys', methods=['POST'])
+def add_ssh_key():
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Validates and stores a public key uploaded from the SSH key page, in the
+        'public_key' form field. The key must be signed in with before it counts.
 
     Returns:
-        render_template: The rendered SSH key uploader page template.
+        redirect: Back to the SSH key page, with the outcome flashed.
     """
+    if 'username' not in session:
+        abort(403)
+    try:
+        key = parse_public_key(request.form.get('public_key', ''))
+    except SSHKeyError as e:
+        flash(f'Invalid SSH key: {e}', 'error')
+        return redirect(url_for('ssh_key_loader'))
+
+    if SSHKeyModel.add_key(current_app, session['username'], key.key_type, key.fingerprint, key.public_key,
+                           key.comment):
+        flash(f'SSH key {key.fingerprint} added. Sign the challenge to verify it.', 'success')
+    else:
+        flash(f'SSH key {key.fingerprint} is already registered.', 'error')
+    return redirect(url_for('ssh_key_loader'))
 
-    return render_template('ssh_key_loader.html')
 
+@route('/ssh_keys/verify', methods=['POST'])
+def verify_ssh_key():
+    """
+    Author:
+        Eric Thomas
 
-@app.route('/chat')
+    Description:
+        Checks the signature of the session's challenge made with one of the user's keys
+        ('fingerprint' and 'signature' form fields). On success the key is marked verified
+        and its fingerprint is kept in the session, which is all verify_permissions() looks
+        at afterwards. Each challenge can be answered once.
+
+    Returns:
+        redirect: To the home page when verified, otherwise back to the SSH key page.
+    """
+    if 'username' not in session:
+        abort(403)
+    challenge = session.pop('ssh_challenge', None)
+    if challenge is None or time.time() - challenge['issued'] > SSH_CHALLENGE_TTL:
+        flash('The challenge expired, sign the new one.', 'error')
+        return redirect(url_for('ssh_key_loader'))
+
+    username = session['username']
+    fingerprint = request.form.get('fingerprint', '')
+    if get_state().ssh_keys.owner(fingerprint) != username:
+        flash('Unknown SSH key.', 'error')
+        return redirect(url_for('ssh_key_loader'))
+    try:
+        verify_signature(get_state().ssh_keys.key(fingerprint), request.form.get('signature', ''),
+                         challenge['value'].encode('ascii'))
+    except SSHKeyError as e:
+        flash(f'SSH verification failed: {e}', 'error')
+        return redirect(url_for('ssh_key_loader'))
+
+    SSHKeyModel.set_verified(current_app, username, fingerprint)
+    session['ssh_fingerprint'] = fingerprint
+    session.regenerate()
+    flash(f'Signed in with SSH key {fingerprint}.', 'success')
+    return redirect(url_for('home'))
+
+
+@route('/ssh_keys/delete', methods=['POST'])
+def delete_ssh_key():
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Removes one of the user's keys ('fingerprint' form field). A session signed in
+        with the key loses its SSH sign-in.
+
+    Returns:
+        redirect: Back to the SSH key page.
+    """
+    if 'username' not in session:
+        abort(403)
+    fingerprint = request.form.get('fingerprint', '')
+    if SSHKeyModel.remove_key(current_app, session['username'], fingerprint):
+        get_state().ssh_keys.discard(fingerprint)
+        if session.get('ssh_fingerprint') == fingerprint:
+            session.pop('ssh_fingerprint')
+        flash(f'SSH key {fingerprint} removed.', 'success')
+    return redirect(url_for('ssh_key_loader'))
+
+
+@route('/chat')
 def chat():
     """
     Author:
@@ -244,14 +861,47 @@ def chat():
     if 'username' in session:
         username = session['username']
 
+    server_config = get_server_config()
+
     if verify_permissions():
         return render_template('chat.html', username=username, max_message_length=server_config.max_message_length(),
-                               encryption_enabled=server_config.encryption_enabled)
+                               encryption_enabled=server_config.encryption_enabled, heartbeat_interval=HEARTBEAT_INTERVAL,
+                               events_url=url_for('events') if push_available() else '')
     else:
         return redirect(url_for('home'))
 
 
-@app.route('/update_ssh', methods=['POST'])
+@route('/presence', methods=['GET', 'POST'])
+def presence():
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Reports who is in the chat room. A POST is also a heartbeat: it keeps the session's
+        user present, or takes a seat again if theirs expired and one is free. The presence
+        tracker reads the database at most once per CHAT_PRESENCE_CACHE_TTL.
+
+    Returns:
+        Response: JSON with 'present' (whether the session's user holds a seat), 'users',
+                  'active_user_count', 'max_user_count' and 'heartbeat_interval' in seconds.
+    """
+    state = get_state()
+    username = session.get('username')
+
+    present = False
+    if username:
+        if request.method == 'POST':
+            present = state.presence.join(current_app, username, MAX_USER_COUNT)
+        else:
+            present = state.presence.is_present(current_app, username)
+
+    users = state.presence.usernames(current_app)
+    return jsonify({"present": present, "users": users, "active_user_count": len(users),
+                    "max_user_count": MAX_USER_COUNT, "heartbeat_interval": HEARTBEAT_INTERVAL})
+
+
+@route('/update_ssh', methods=['POST'])
 def update_ssh():
     """
     Author: 
@@ -268,13 +918,13 @@ def update_ssh():
 
     if request.method == 'POST':
         new_ssh_enabled = request.json.get('ssh_enabled', False)
+        server_config = get_server_config()
         server_config.ssh_enabled = new_ssh_enabled
-        server_config.save_config()
         return jsonify(success=True)
     return jsonify(success=False), 400
 
 
-@app.route('/update_encryption', methods=['POST'])
+@route('/update_encryption', methods=['POST'])
 def update_encryption():
     """
     Author: 
@@ -290,64 +940,571 @@ def update_encryption():
     """
     if request.method == 'POST':
         new_encryption_enabled = request.json.get('encryption_enabled', False)
+        server_config = get_server_config()
         server_config.encryption_enabled = new_encryption_enabled
-        server_config.save_config()
         return jsonify(success=True)
     return jsonify(success=False), 400
 
 
-@app.route('/submit_message', methods=['POST'])
+@route('/submit_message', methods=['POST'])
 def submit_message():
     """
     Author:
         Eric Thomas
 
     Description:
-        Handles the submission of new chat messages sent from the client.
+        Handles the submission of new chat messages sent from the client. The response
+        carries the message as persisted, so the client can show it without fetching the
+        message list again. An optional 'Idempotency-Key' header (or 'idempotency_key'
+        field) makes retries safe: a key that was already stored returns the original
+        message instead of adding a duplicate. The message is checked against the
+        username and message length limits like every item of '/submit_messages'.
 
     Returns:
-        jsonify: A JSON object indicating the success status of the message submission.
+        jsonify: A JSON object indicating the success status of the message submission,
+                 with the stored message and the id of the newest message ('head').
     """
     if not request.is_json:
         # If the request does not contain JSON, return an error
         return jsonify({"success": False, "error": "Invalid JSON format"}), 400
 
     data = request.get_json()
-    user_id = data.get('user_id')
-    message_content = data.get('message_content')
-    message_encrypted = data.get('message_encrypted') == True  # will be false unless the string is 'True'
-
-    if not user_id or not message_content:
-        # If user_id or message_content is missing, return an error
-        return jsonify({"success": False, "error": "Missing user_id or message_content"}), 400
+    if isinstance(data, dict) and request.headers.get('Idempotency-Key'):
+        data = {**data, 'idempotency_key': request.headers.get('Idempotency-Key')}
+    message, error = _validate_message(data)
+    if error:
+        return jsonify({"success": False, "error": error}), 400
 
     try:
-        ChatModel.add_new_message(app, user_id, message_content, message_encrypted)
-        return jsonify({"success": True})
+        state = get_state()
+        message_writer = state.message_writer
+        if message_writer:
+            # Acknowledged once the group commit containing this message completes
+            record, head = message_writer.submit(message['user_id'], message['message'], message['encrypted'],
+                                                 message['idempotency_key'])
+        else:
+            records, head = state.message_store.append([message])
+            record = records[0]
+        state.broadcaster.publish([record])
+        return jsonify({"success": True, "message": wire_format.message_to_dict(record), "head": head})
     except Exception as e:
         # Log the exception and return an error message
         print(f"Error adding message: {e}")
         return jsonify({"success": False, "error": "Internal Server Error"}), 500
 
 
-@app.route('/get_messages', methods=['GET'])
+def _parse_message_batch() -> list:
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Reads the items of a '/submit_messages' request body, either a JSON array or an
+        NDJSON stream with one JSON object per line. NDJSON is read line by line from the
+        request stream, stopping once the batch is over the size limit. A line that is not
+        valid JSON becomes an item of None so it is reported as invalid along with the rest
+        of the batch.
+
+    Returns:
+        list: The decoded items, or None if the body is not a JSON array or NDJSON.
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        items = []
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+
+            # Already too large, stop reading instead of buffering the rest of the stream
+            if len(items) > MAX_BATCH_MESSAGES:
+                break
+        return items
+
+    data = request.get_json(silent=True)
+    return data if isinstance(data, list) else None
+
+
+def _batch_principal() -> Optional[str]:
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Authenticates a '/submit_messages' request, by bot token if the request carries
+        one and by the session otherwise.
+
+    Returns:
+        str or None: The bot or user name messages may be posted under, None if the
+                     request is not authenticated.
+    """
+    supplied = request.headers.get(BOT_TOKEN_HEADER)
+    if supplied is not None:
+        for bot, token in current_app.config['CHAT_BOT_TOKENS'].items():
+            if token and hmac.compare_digest(supplied, token):
+                return bot
+        return None
+    if verify_permissions():
+        return session['username']
+    return None
+
+
+def _validate_message(item) -> tuple:
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Validates one submitted message against the server's username and message limits,
+        for '/submit_message' and every item of '/submit_messages'.
+
+    Args:
+        item: The decoded message object.
+
+    Returns:
+        tuple: (message dictionary for MessageStore.append, None) if valid,
+               otherwise (None, error string).
+    """
+    if not isinstance(item, dict):
+        return None, "Invalid JSON object"
+
+    user_id = item.get('user_id')
+    message_content = item.get('message_content')
+    if not isinstance(user_id, str) or not user_id or not isinstance(message_content, str) or not message_content:
+        return None, "Missing user_id or message_content"
+    if len(user_id) > ServerConfig.max_username_length():
+        return None, "user_id exceeds the maximum username length"
+    encrypted = item.get('message_encrypted') == True  # will be false unless the value is true
+    if len(message_content) > max_content_length(encrypted):
+        return None, "message_content exceeds the maximum message length"
+
+    idempotency_key = item.get('idempotency_key')
+    if idempotency_key is not None and not ChatModel.is_valid_idempotency_key(idempotency_key):
+        return None, "Invalid idempotency key"
+
+    return {'user_id': user_id, 'message': message_content,
+            'encrypted': encrypted, 'idempotency_key': idempotency_key}, None
+
+
+def max_content_length(encrypted: bool) -> int:
+    """
+    Get the longest message_content accepted. Encrypted messages arrive as CryptoJS AES
+    ciphertext, the base64 of a 16 byte salt header and the padded UTF-8 text, so their
+    limit is that of a maximum length message of four byte characters.
+
+    Args:
+        encrypted (bool): Whether the content is ciphertext.
+
+    Returns:
+        int: The limit in characters.
+    """
+    limit = ServerConfig.max_message_length()
+    if not encrypted:
+        return limit
+    ciphertext_bytes = 16 + (4 * limit // 16 + 1) * 16
+    return 4 * -(-ciphertext_bytes // 3)
+
+
+@route('/submit_messages', methods=['POST'])
+def submit_messages():
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Bulk message ingestion for bots and bridges. Accepts a JSON array, or an NDJSON
+        stream (Content-Type: application/x-ndjson), of objects shaped like the
+        '/submit_message' body. Every valid message is inserted in a single transaction with
+        one retention pass; invalid messages are skipped and reported. Items may carry an
+        'idempotency_key' so replaying a backlog does not duplicate messages.
+
+        The caller is either a signed-in user passing verify_permissions(), or a bot
+        sending its CHAT_BOT_TOKENS token in the 'X-Chat-Bot-Token' header. Only items
+        whose user_id is the caller's name are accepted.
+
+    Returns:
+        jsonify: A JSON object with the accepted and rejected counts and a result per item,
+                 in submission order, holding either the new message id or the error. 403
+                 if the caller is not authenticated.
+    """
+    principal = _batch_principal()
+    if principal is None:
+        return jsonify({"success": False, "error": "Permission denied"}), 403
+
+    items = _parse_message_batch()
+    if items is None:
+        return jsonify({"success": False, "error": "Expected a JSON array or NDJSON stream"}), 400
+    if len(items) > MAX_BATCH_MESSAGES:
+        return jsonify({"success": False, "error": f"At most {MAX_BATCH_MESSAGES} messages per request"}), 413
+
+    results = []
+    valid_messages, valid_results = [], []
+    for index, item in enumerate(items):
+        message, error = _validate_message(item)
+        if not error and message['user_id'] != principal:
+            error = "user_id does not match the authenticated user"
+        if error:
+            results.append({"index": index, "success": False, "error": error})
+        else:
+            result = {"index": index, "success": True}
+            valid_messages.append(message)
+            valid_results.append(result)
+            results.append(result)
+
+    try:
+        records, _ = get_state().message_store.append(valid_messages)
+        get_state().broadcaster.publish(records)
+    except Exception as e:
+        # Log the exception and return an error message
+        print(f"Error adding messages: {e}")
+        return jsonify({"success": False, "error": "Internal Server Error"}), 500
+
+    for result, record in zip(valid_results, records):
+        result["id"] = record.id
+
+    return jsonify({"success": True, "accepted": len(valid_messages),
+                    "rejected": len(items) - len(valid_messages), "results": results})
+
+
+@route('/get_messages', methods=['GET'])
 def get_messages():
     """
     Author:
         Eric Thomas
 
     Description:
-        Fetches and returns all chat messages from the database chat table.
+        Fetches and returns all chat messages from the message store, including
+        each message's stable id so clients can render incrementally. Clients that
+        send 'Accept: application/vnd.securechat.columnar+json' receive the compact
+        columnar encoding described in utils/wire_format.py. The 'X-Poll-Interval' header
+        suggests when to poll next, from the recent write rate and the server load (see
+        utils/poll_hints.py).
 
     Returns:
-        jsonify: A JSON list of dictionaries, each representing a chat message.
+        Response: A JSON list of dictionaries, each representing a chat message, or the
+                  columnar encoding of the same messages.
     """
 
-    messages = ChatModel.query.order_by(ChatModel.timestamp.asc()).all()
-    messages_list = [{'user_id': message.user_id, 'message': message.message,
-                      'timestamp': message.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                      'encrypted': message.encrypted} for message in messages]
-    return jsonify(messages_list)
+    messages = get_state().message_store.range_read()
+
+    if wire_format.wants_columnar(request.accept_mimetypes):
+        response = Response(wire_format.encode_columnar(messages), mimetype=wire_format.COLUMNAR_MIMETYPE)
+    else:
+        response = jsonify(wire_format.messages_to_list(messages))
+
+    # Caches must key on the negotiated encoding
+    response.vary.add('Accept')
+    response.headers[POLL_INTERVAL_HEADER] = str(suggest_poll_interval(messages))
+    return response
+
+
+def _event(event: str, data: str = '', event_id: Optional[int] = None) -> str:
+    """
+    Formats one server-sent event.
+    """
+    lines = f"id: {event_id}\n" if event_id is not None else ''
+    return lines + f"event: {event}\ndata: {data}\n\n"
+
+
+def push_stream(state: 'ChatServerState', subscriber, cursor: int):
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Generates the server-sent events of one push subscriber, see '/events'. The
+        subscriber is disconnected when the generator is closed.
+
+    Args:
+        state (ChatServerState): The application state.
+        subscriber (Subscriber): The subscriber, from the broadcaster.
+        cursor (int): Id of the newest message the client has.
+
+    Returns:
+        generator: The events, as text.
+    """
+    # A reconnecting client missed what was written while it was away
+    resync = (state.message_store.head() or 0) > cursor
+    try:
+        yield f"retry: {PUSH_RETRY_MS}\n\n"
+        while True:
+            try:
+                if subscriber.closed:
+                    raise SubscriberClosed()
+                updates = RESYNC if resync else subscriber.get(PUSH_WAIT)
+            except SubscriberClosed:
+                yield _event('evicted')
+                return
+            resync = False
+
+            if updates is None:
+                # Quiet, unless another worker or node wrote: then resynchronize from the store
+                head = state.message_store.head()
+                if head is not None and head > cursor:
+                    updates = RESYNC
+                else:
+                    yield ": keep-alive\n\n"
+                    continue
+
+            if updates == RESYNC:
+                cursor = max(cursor, state.message_store.head() or 0)
+                yield _event('resync', event_id=cursor)
+                continue
+
+            messages = [message for batch in updates for message in batch if message.id > cursor]
+            if messages:
+                cursor = max(message.id for message in messages)
+                yield _event('messages', json.dumps(wire_format.messages_to_list(messages), separators=(',', ':')),
+                             cursor)
+    finally:
+        state.broadcaster.unsubscribe(subscriber)
+
+
+def push_available() -> bool:
+    """
+    Check whether this server can hold push streams open. A stream occupies a request
+    thread for its whole life, so a server handling one request at a time per worker
+    would be taken over by a single chat page; its clients poll instead.
+
+    Returns:
+        bool: True if CHAT_PUSH is set, or it is None and the server handles requests on
+              threads, and CHAT_WORKER_THREADS leaves room for a stream.
+    """
+    push = current_app.config['CHAT_PUSH']
+    if push is None:
+        push = request.environ.get('wsgi.multithread')
+    return bool(push) and get_state().broadcaster.max_subscribers > 0
+
+
+@route('/events', methods=['GET'])
+def events():
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Pushes new chat messages to the browser as server-sent events, so the page does
+        not have to poll. Events:
+
+        - 'messages': a JSON list of new messages, in the '/get_messages' format.
+        - 'resync':   the client fell behind and its backlog was dropped, or messages were
+                      written by another worker or node; reload the message list once.
+        - 'evicted':  the client stayed behind too long and is disconnected.
+
+        Each client has a bounded queue and the number of clients is capped (see
+        utils/broadcaster.py), so a slow client cannot hold up the others or grow memory.
+
+    Returns:
+        Response: The event stream, 403 without permission, 503 if the server cannot hold
+                  streams (see push_available), or 503 with Retry-After once
+                  CHAT_PUSH_MAX_SUBSCRIBERS clients are connected (clients then poll).
+    """
+    if not verify_permissions():
+        return jsonify({"success": False, "error": "Permission denied"}), 403
+    if not push_available():
+        return jsonify({"success": False, "error": "Push updates need a threaded or async worker"}), 503
+
+    state = get_state()
+    try:
+        subscriber = state.broadcaster.subscribe(session['username'])
+    except TooManySubscribers:
+        response = jsonify({"success": False, "error": "Too many push subscribers"})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(PUSH_RETRY_MS // 1000)
+        return response
+
+    # A reconnecting browser sends the id of the last event it received
+    cursor = request.headers.get('Last-Event-ID', type=int)
+    if cursor is None:
+        cursor = state.message_store.head() or 0
+    response = Response(push_stream(state, subscriber, cursor), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Ask buffering proxies such as nginx to pass events through immediately
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@route('/search', methods=['GET'])
+def search():
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Full-text search over the unencrypted chat messages. Takes the search text in
+        the 'q' query parameter, along with optional 'page' and 'per_page' parameters.
+        Encrypted messages are never searchable.
+
+    Returns:
+        jsonify: A JSON object with the ranked results for the requested page and
+                 whether more pages are available.
+    """
+
+    if not verify_permissions():
+        return jsonify({"success": False, "error": "Permission denied"}), 403
+
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', DEFAULT_SEARCH_PAGE_SIZE, type=int)
+    per_page = min(max(per_page, 1), MAX_SEARCH_PAGE_SIZE)
+
+    message_store = get_state().message_store
+    if not message_store.supports_search:
+        return jsonify({"success": False, "error": "Search is not supported by the configured message store"}), 501
+
+    try:
+        results, has_more = message_store.search_messages(query, page, per_page)
+    except Exception as e:
+        print(f"Error searching messages: {e}")
+        return jsonify({"success": False, "error": "Internal Server Error"}), 500
+
+    return jsonify({"success": True, "query": query, "page": page, "per_page": per_page,
+                    "has_more": has_more, "results": results})
+
+
+@route('/attachments', methods=['POST'])
+def upload_attachment():
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Shares a file in the chat. The request body is the raw file content, streamed to
+        disk in chunks so it is never held in memory, with its media type in 'Content-Type'
+        and its name in the 'filename' query parameter. Identical files are stored once.
+        A chat message naming the file is added and refers to the attachment.
+
+    Returns:
+        jsonify: A JSON object like the '/submit_message' response, with the stored
+                 message carrying the 'attachment_id', or a JSON error (413 when the file
+                 is over CHAT_ATTACHMENT_MAX_SIZE).
+    """
+    if not verify_permissions():
+        return jsonify({"success": False, "error": "Permission denied"}), 403
+
+    state = get_state()
+    if not state.message_store.supports_attachments:
+        return jsonify({"success": False, "error": "Attachments are not supported by the configured message store"}), 501
+    if state.server_config.encryption_enabled:
+        return jsonify({"success": False, "error": "Attachments are not end-to-end encrypted"}), 403
+
+    filename = os.path.basename(request.args.get('filename', '').replace('\\', '/')).strip()
+    if not filename:
+        return jsonify({"success": False, "error": "Missing filename"}), 400
+
+    max_size = current_app.config['CHAT_ATTACHMENT_MAX_SIZE']
+    too_large = jsonify({"success": False, "error": f"Attachments are limited to {max_size} bytes"}), 413
+    if request.content_length is not None and request.content_length > max_size:
+        return too_large
+    try:
+        digest, size = state.attachment_store.save(request.stream, max_size)
+    except AttachmentTooLarge:
+        return too_large
+    if size == 0:
+        return jsonify({"success": False, "error": "Empty attachment"}), 400
+
+    try:
+        username = session['username']
+        content_type = (request.mimetype or 'application/octet-stream')[:127]
+        attachment_id = AttachmentModel.add_attachment(current_app, digest, filename, content_type, size, username)
+        records, head = state.message_store.append([{'user_id': username,
+                                                     'message': filename[:state.server_config.max_message_length()],
+                                                     'encrypted': False, 'attachment_id': attachment_id}])
+        state.broadcaster.publish(records)
+        return jsonify({"success": True, "message": wire_format.message_to_dict(records[0]), "head": head})
+    except Exception as e:
+        print(f"Error adding attachment: {e}")
+        return jsonify({"success": False, "error": "Internal Server Error"}), 500
+
+
+@route('/attachments/<int:attachment_id>', methods=['GET'])
+def download_attachment(attachment_id: int):
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Serves a shared file with send_file, which hands the open file to the WSGI
+        server's file wrapper (sendfile under gunicorn, X-Sendfile with USE_X_SENDFILE)
+        and answers conditional and Range requests from the file on disk. Images and
+        plain text are shown inline, any other type is downloaded.
+
+    Args:
+        attachment_id (int): The attachment id.
+
+    Returns:
+        Response: The file, or 403/404.
+    """
+    if not verify_permissions():
+        abort(403)
+    attachment = AttachmentModel.get_attachment(current_app, attachment_id)
+    if attachment is None:
+        abort(404)
+
+    inline = attachment.content_type in INLINE_ATTACHMENT_TYPES
+    response = send_file(get_state().attachment_store.path(attachment.digest), mimetype=attachment.content_type,
+                         as_attachment=not inline, download_name=attachment.filename, conditional=True,
+                         etag=attachment.digest, max_age=ATTACHMENT_MAX_AGE)
+    # Only for the signed-in user's browser, and never sniffed into an active type
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+
+def export_stream(message_store: MessageStore, export_format: str, compress: bool):
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Builds the byte stream of a history export, shared by '/export' and the
+        'flask messages export' command.
+
+    Args:
+        message_store (MessageStore): The store to export.
+        export_format (str): 'ndjson' or 'csv'.
+        compress (bool): Whether to gzip the stream.
+
+    Returns:
+        Iterator[bytes]: The export stream.
+    """
+    encode = wire_format.iter_csv if export_format == 'csv' else wire_format.iter_ndjson
+    stream = encode(message_store.iter_messages())
+    return wire_format.iter_gzip(stream) if compress else stream
+
+
+@route('/export', methods=['GET'])
+def export():
+    """
+    Author:
+        Eric Thomas
+
+    Description:
+        Streams the chat history as a download. 'format' selects 'ndjson' (default) or
+        'csv', and 'compress=gzip' compresses the stream on the fly. Rows are read from the
+        message store in batches and encoded in chunks, so memory use does not depend on
+        the size of the history.
+
+    Returns:
+        Response: The streamed export, or a JSON error.
+    """
+    if not verify_permissions():
+        return jsonify({"success": False, "error": "Permission denied"}), 403
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"success": False, "error": f"Unknown format, use one of {', '.join(EXPORT_FORMATS)}"}), 400
+    compress = request.args.get('compress') == 'gzip'
+
+    filename = f"chat-history.{export_format}" + ('.gz' if compress else '')
+    mimetype = wire_format.GZIP_MIMETYPE if compress else EXPORT_FORMATS[export_format]
+    response = Response(export_stream(get_state().message_store, export_format, compress), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 
 def verify_permissions():
@@ -358,26 +1515,29 @@ def verify_permissions():
     Description:
         Verifies user permissions by assessing session status and server configurations.
         It checks if the user is in the session, and then, based on the server's SSH and
-        encryption settings, verifies if the user has uploaded an SSH key and authenticated.
+        encryption settings, verifies if the user has signed in with one of their SSH keys
+        and authenticated.
 
     Returns:
         bool: True if required permissions are satisfied, False otherwise.
     """
 
+    server_config = get_server_config()
+
     # Check if the user session has been established
     if 'username' not in session:
         return False
     else:
         # If server config has ssh enabled
         if server_config.ssh_enabled:
-            # Check if user has entered the encryption password
-            if not UsersModel.has_uploaded_ssh_key(app, session['username']):
+            # Check the session signed in with a key of this user, a cached fingerprint lookup
+            if get_state().ssh_keys.owner(session.get('ssh_fingerprint')) != session['username']:
                 return False
 
         # If the server config has encryption enabled
         if server_config.encryption_enabled:
             # Check if encryption is enabled and if the user is authenticated
-            if not UsersModel.is_logged_in(app, session['username']):
+            if not get_state().presence.is_present(current_app, session['username']):
                 return False
 
     # If function made it to this point, permissions are satisfied
@@ -385,15 +1545,54 @@ def verify_permissions():
 
 
 if __name__ == '__main__':
-    # Log all users out on startup
-    UsersModel.set_all_users_logged_out(app)
-
     # Setup argument parser
     parser = argparse.ArgumentParser(description="Run the web application.")
     parser.add_argument('--ip', type=str, help='The IP address to bind to.', default='127.0.0.1')
     parser.add_argument('--port', type=int, help='The port to listen on.', default=5000)
+    parser.add_argument('--trace-sample-rate', type=float,
+                        help=f'Trace this fraction of requests to {os.path.relpath(DEFAULT_TRACE_FILE, cwd)}.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Enable on-demand profiling: SIGUSR2, and /admin/profile with CHAT_PROFILE_TOKEN set.')
+    parser.add_argument('--node-id', type=str,
+                        help='Replicate messages as this node, with CHAT_REPLICATION_TOKEN set.')
+    parser.add_argument('--peer', action='append', default=[], metavar='NODE_ID=URL',
+                        help='Follow the replication log of a peer node, repeat for each peer.')
     args = parser.parse_args()
 
+    config = {}
+    if args.trace_sample_rate:
+        config.update(CHAT_TRACE_FILE=DEFAULT_TRACE_FILE, CHAT_TRACE_SAMPLE_RATE=args.trace_sample_rate)
+    if args.profile:
+        # The token comes from the environment so it does not show in the process list
+        config.update(CHAT_PROFILING=True, CHAT_PROFILE_TOKEN=os.environ.get('CHAT_PROFILE_TOKEN'))
+    if args.node_id:
+        peers = dict(peer.split('=', 1) for peer in args.peer)
+        config.update(CHAT_REPLICATION_NODE_ID=args.node_id, CHAT_REPLICATION_PEERS=peers,
+                      CHAT_REPLICATION_TOKEN=os.environ.get('CHAT_REPLICATION_TOKEN'))
+    if os.environ.get('CHAT_BOT_TOKENS'):
+        # 'name=token,name=token', from the environment like the other secrets
+        config.update(CHAT_BOT_TOKENS=dict(bot.split('=', 1) for bot in os.environ['CHAT_BOT_TOKENS'].split(',')))
+    app = create_app(config)
+    state = app.extensions['chat_server']
+    debug = True
+
+    # Create the schema up front, then warm start from the snapshot if there is one
+    init_schema(app)
+
+    # The debug reloader serves from a child process, only it holds state worth saving
+    if state.snapshotter and (not debug or is_running_from_reloader()):
+        state.snapshotter.ensure_started()
+        # Exit normally on SIGTERM (e.g. gitlab-server-start.sh), so the final snapshot is taken
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Follow the peer nodes from the serving process only, WSGI workers start on their first request
+    if 'chat_replication' in app.extensions and (not debug or is_running_from_reloader()):
+        app.extensions['chat_replication'].ensure_started()
+
+    # 'kill -USR2 <pid>' profiles the serving process, the reloader child when debugging
+    if args.profile:
+        app.extensions['chat_profiler'].install_signal_handler()
+
     # Validate IP address
     try:
         inet_aton(args.ip)
@@ -407,4 +1606,4 @@ if __name__ == '__main__':
         sys.exit(1)
 
     # Run the application
-    app.run(host=args.ip, port=args.port, debug=True)
+    app.run(host=args.ip, port=args.port, debug=debug)
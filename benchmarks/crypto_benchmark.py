@@ -0,0 +1,157 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Crypto Microbenchmark Suite
+
+Times the operations in utils/encryption_tools.py and compares them against stored
+baseline results:
+
+- get_password_hash, and the salted per-user password records (hash_password)
+- PBKDF2 key derivation (_fernet_cipher_from_password)
+- Fernet encrypt and decrypt at several message sizes, with an already derived key
+- encrypt_data_with_password, derivation included
+- the CryptoJS-compatible AES path used by the browser client, at several message sizes
+
+Every operation is timed with timeit, best of --repeat runs, and reported in operations
+per second. Without --save-baseline the results are compared with the baseline file, and
+the run fails if an operation is still slower than the baseline by more than --threshold
+when measured again. Baselines depend on the machine, save them on the host that runs
+the comparison.
+
+Usage:
+    python benchmarks/crypto_benchmark.py --save-baseline      # record the baseline
+    python benchmarks/crypto_benchmark.py [--threshold 0.2]    # compare, exit 1 on regression
+=======================================================
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# autopep8: off
+from utils import encryption_tools
+# autopep8: on
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crypto_baseline.json')
+DEFAULT_THRESHOLD = 0.2
+
+PASSWORD = 'enter1the2chat3room4'
+MESSAGE_SIZES = [128, 4096, 65536]
+
+
+def operations() -> dict:
+    """
+    Build the benchmarked operations.
+
+    Returns:
+        dict: Operation name to (callable, bytes processed per call or None).
+    """
+    cipher = encryption_tools._fernet_cipher_from_password(PASSWORD)
+    benchmarks = {
+        'get_password_hash': (lambda: encryption_tools.get_password_hash(PASSWORD), None),
+        'hash_password': (lambda: encryption_tools.hash_password(PASSWORD), None),
+        'pbkdf2_derive': (lambda: encryption_tools._fernet_cipher_from_password(PASSWORD), None),
+        'encrypt_data_with_password 128B': (lambda: encryption_tools.encrypt_data_with_password(b'x' * 128, PASSWORD),
+                                            128),
+    }
+    for size in MESSAGE_SIZES:
+        data = os.urandom(size)
+        token = cipher.encrypt(data)
+        text = 'x' * size
+        encrypted = encryption_tools.cryptojs_encrypt(text, PASSWORD)
+        benchmarks[f'fernet_encrypt {size}B'] = (lambda data=data: cipher.encrypt(data), size)
+        benchmarks[f'fernet_decrypt {size}B'] = (lambda token=token: cipher.decrypt(token), size)
+        benchmarks[f'cryptojs_encrypt {size}B'] = (lambda text=text: encryption_tools.cryptojs_encrypt(text, PASSWORD),
+                                                   size)
+        benchmarks[f'cryptojs_decrypt {size}B'] = (
+            lambda encrypted=encrypted: encryption_tools.cryptojs_decrypt(encrypted, PASSWORD), size)
+    return benchmarks
+
+
+def measure(func, repeat: int) -> float:
+    """
+    Time an operation.
+
+    Args:
+        func: The operation.
+        repeat (int): Timed runs, the best is kept.
+
+    Returns:
+        float: Operations per second.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return number / min(timer.repeat(repeat, number))
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Find the operations that regressed against the baseline.
+
+    Args:
+        results (dict): Operation name to operations per second.
+        baseline (dict): Operation name to baseline operations per second.
+        threshold (float): Allowed slowdown, as a fraction of the baseline.
+
+    Returns:
+        list: (name, operations per second, baseline) for each regressed operation.
+    """
+    return [(name, rate, baseline[name]) for name, rate in results.items()
+            if name in baseline and rate < baseline[name] * (1 - threshold)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the encryption tools against a baseline.")
+    parser.add_argument('--baseline', help='Baseline results file.', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Record the results as the baseline.')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Allowed slowdown against the baseline, as a fraction (0.2 is 20%%).')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per operation, the best is kept.')
+    args = parser.parse_args()
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    results = {}
+    print(f"{'operation':<34}{'ops/s':>14}{'MB/s':>10}{'baseline':>14}{'change':>9}")
+    for name, (func, size) in operations().items():
+        rate = results[name] = measure(func, args.repeat)
+        throughput = f"{rate * size / 1e6:>10.1f}" if size else f"{'':>10}"
+        reference = baseline.get(name)
+        change = f"{reference:>14.0f}{(rate / reference - 1) * 100:>+8.1f}%" if reference else ''
+        print(f"{name:<34}{rate:>14.0f}{throughput}{change}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'results': results},
+                      baseline_file, indent=4)
+            baseline_file.write('\n')
+        print(f"\nBaseline saved to {args.baseline}")
+        sys.exit(0)
+
+    if not baseline:
+        print(f"\nNo baseline at {args.baseline}, record one with --save-baseline")
+        sys.exit(0)
+
+    # Re-measure the regressed operations once, so a noisy run alone does not fail
+    benchmarks = operations()
+    for name, _, _ in compare(results, baseline, args.threshold):
+        results[name] = max(results[name], measure(benchmarks[name][0], args.repeat))
+    regressions = compare(results, baseline, args.threshold)
+    for name, rate, reference in regressions:
+        print(f"REGRESSION {name}: {rate:.0f} ops/s, baseline {reference:.0f} ops/s")
+    print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
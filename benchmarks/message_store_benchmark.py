@@ -0,0 +1,211 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Message Store Conformance and Benchmark Suite
+
+Runs the same conformance checks and the same workload against every MessageStore
+implementation (see database/message_store.py), so the backend for a deployment can be
+picked from measurements. Each store is checked for:
+
+- increasing ids, the returned head and the message round trip
+- idempotency keys, across batches and within a batch, scoped per user
+- retention at max_message_count and explicit trims, without reusing ids
+- inclusive id ranges and since-cursor reads
+- durability across a reopen, for the stores that persist
+
+The benchmark then reports operations per second for single appends, batched appends,
+full window reads and since-cursor reads, all against on-disk files where the store
+persists.
+
+Usage:
+    python benchmarks/message_store_benchmark.py [--stores sqlalchemy memory logfile] [--messages N]
+=======================================================
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# autopep8: off
+from app import create_app, init_schema
+from database.message_store import LogFileMessageStore, MemoryMessageStore, SQLAlchemyMessageStore
+# autopep8: on
+
+WINDOW = 100
+BATCH_SIZE = 100
+READS = 500
+
+
+def make_store_factory(name: str, temp_dir: str):
+    """
+    Build a factory that opens the named store on files inside temp_dir. Calling the
+    factory again reopens the same data, which is how durability is checked.
+
+    Args:
+        name (str): 'sqlalchemy', 'memory' or 'logfile'.
+        temp_dir (str): Directory for the store's files.
+
+    Returns:
+        tuple: (factory returning a MessageStore, bool indicating whether the store persists)
+    """
+    if name == 'sqlalchemy':
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(temp_dir, 'bench.db'),
+                          'SECRET_KEY': 'benchmark', 'CHAT_SESSION_STORE': 'memory',
+                          'CHAT_SERVER_CONFIG_FILE': os.path.join(temp_dir, 'config.json')})
+        init_schema(app)
+        return (lambda: SQLAlchemyMessageStore(app, max_messages=WINDOW)), True
+    if name == 'memory':
+        return (lambda: MemoryMessageStore(max_messages=WINDOW)), False
+    if name == 'logfile':
+        path = os.path.join(temp_dir, 'messages.log')
+        return (lambda: LogFileMessageStore(path, max_messages=WINDOW)), True
+    raise ValueError(f"Unknown message store: {name}")
+
+
+def message(number: int, key=None) -> dict:
+    return {'user_id': f'user{number % 7}', 'message': f'message {number}', 'encrypted': number % 2 == 0,
+            'idempotency_key': key}
+
+
+def check_conformance(factory, durable: bool) -> list:
+    """
+    Run the conformance checks against a fresh store.
+
+    Args:
+        factory: Returns the store, reopened on the same data when called again.
+        durable (bool): Whether the store must keep its messages across a reopen.
+
+    Returns:
+        list: Descriptions of the failed checks, empty if the store conforms.
+    """
+    failures = []
+
+    def check(condition: bool, description: str):
+        if not condition:
+            failures.append(description)
+
+    store = factory()
+    check(store.head() is None and store.range_read() == [], "new store is empty")
+
+    records, head = store.append([message(1), message(2)])
+    check([record.id for record in records] == [records[0].id, records[0].id + 1], "batch gets consecutive ids")
+    check(head == records[-1].id, "append returns the newest id as head")
+    check(store.head() == head, "head matches the newest id")
+    stored = store.range_read()
+    check([(r.user_id, r.message, r.encrypted) for r in stored] ==
+          [('user1', 'message 1', False), ('user2', 'message 2', True)], "messages round trip")
+
+    # message(n) and message(n + 7) are sent by the same user
+    first, _ = store.append([message(3, key='k3')])
+    again, _ = store.append([message(10, key='k3')])
+    check(again[0] == first[0], "repeated idempotency key returns the stored message")
+    batch, _ = store.append([message(4, key='k4'), message(11, key='k4')])
+    check(batch[0].id == batch[1].id, "idempotency key repeated within a batch is stored once")
+    check(len(store.range_read()) == 4, "deduplicated messages are not stored")
+    other, _ = store.append([message(5, key='k3')])
+    check(other[0].id != first[0].id, "idempotency keys are scoped to their user")
+
+    ids = [record.id for record in store.range_read()]
+    check([r.id for r in store.range_read(ids[1], ids[2])] == ids[1:3], "range_read is inclusive")
+    check([r.id for r in store.since(ids[1])] == ids[2:], "since returns messages after the cursor")
+    check([r.id for r in store.since(ids[0], limit=2)] == ids[1:3], "since honours the limit, oldest first")
+    check([r.id for r in store.since(None)] == ids, "since without a cursor returns everything")
+
+    records, head = store.append([message(n) for n in range(WINDOW + 20)])
+    window = store.range_read()
+    check(len(window) == WINDOW, "retention keeps max_messages messages")
+    check(window[-1].id == head and window[0].id == head - WINDOW + 1, "retention drops the oldest messages")
+
+    check(store.trim(10) == WINDOW - 10, "trim returns the number deleted")
+    check([r.id for r in store.range_read()] == list(range(head - 9, head + 1)), "trim keeps the newest messages")
+    records, _ = store.append([message(0)])
+    check(records[0].id > head, "ids are not reused after a trim")
+
+    if durable:
+        reopened = factory()
+        check([r.id for r in reopened.range_read()] == [r.id for r in store.range_read()],
+              "messages survive a reopen")
+        again, _ = reopened.append([message(4, key='k4')])
+        check(again[0].id > records[0].id, "trimmed idempotency keys are forgotten")
+
+    return failures
+
+
+def benchmark(factory, messages: int) -> dict:
+    """
+    Time the workload against a fresh store.
+
+    Args:
+        factory: Returns the store.
+        messages (int): Number of messages appended one at a time, and in batches.
+
+    Returns:
+        dict: Operation name to operations per second.
+    """
+    store = factory()
+    results = {}
+
+    start = time.perf_counter()
+    for number in range(messages):
+        store.append([message(number)])
+    results['append x1'] = messages / (time.perf_counter() - start)
+
+    batches = max(messages // BATCH_SIZE, 1)
+    start = time.perf_counter()
+    for batch in range(batches):
+        store.append([message(number) for number in range(batch * BATCH_SIZE, (batch + 1) * BATCH_SIZE)])
+    results[f'append x{BATCH_SIZE}'] = batches * BATCH_SIZE / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(READS):
+        store.range_read()
+    results['range_read'] = READS / (time.perf_counter() - start)
+
+    cursor = store.head() - 5
+    start = time.perf_counter()
+    for _ in range(READS):
+        store.since(cursor)
+    results['since'] = READS / (time.perf_counter() - start)
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check and benchmark the chat message stores.")
+    parser.add_argument('--stores', nargs='+', choices=['sqlalchemy', 'memory', 'logfile'],
+                        default=['sqlalchemy', 'memory', 'logfile'], help='Stores to run.')
+    parser.add_argument('--messages', type=int, help='Messages appended per append benchmark.', default=1000)
+    args = parser.parse_args()
+
+    all_results = {}
+    conformant = True
+    for name in args.stores:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            factory, durable = make_store_factory(name, temp_dir)
+            failures = check_conformance(factory, durable)
+        conformant = conformant and not failures
+        print(f"{name}: {'conforms' if not failures else 'FAILED'}")
+        for failure in failures:
+            print(f"    failed: {failure}")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            factory, _ = make_store_factory(name, temp_dir)
+            all_results[name] = benchmark(factory, args.messages)
+
+    operations = list(next(iter(all_results.values())))
+    print(f"\nOperations per second (window of {WINDOW} messages):")
+    print(f"{'store':<12}" + ''.join(f"{operation:>14}" for operation in operations))
+    for name, results in all_results.items():
+        print(f"{name:<12}" + ''.join(f"{results[operation]:>14.0f}" for operation in operations))
+
+    sys.exit(0 if conformant else 1)
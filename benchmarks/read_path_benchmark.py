@@ -0,0 +1,126 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Message Read Path Benchmark
+
+Measures the work behind one '/get_messages' poll, reading the full message window and
+serializing it, for three ways of reading the ChatModel table:
+
+- orm:        ChatModel.query, building ORM instances in the session identity map
+- core:       a Core select of plain tuples through the session
+- store:      SQLAlchemyMessageStore.range_read, the path the application uses
+
+Each path is reported in rows per second, and in bytes allocated at the peak of a single
+request as traced by tracemalloc.
+
+Usage:
+    python benchmarks/read_path_benchmark.py [--messages N] [--requests N]
+=======================================================
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# autopep8: off
+from sqlalchemy import select
+from app import create_app, init_schema
+from database.models import db, ChatModel, MessageRecord
+from database.message_store import SQLAlchemyMessageStore
+from utils import wire_format
+# autopep8: on
+
+
+def make_readers(app, store: SQLAlchemyMessageStore) -> dict:
+    """
+    Build one callable per read path, each returning the serialized message window.
+
+    Args:
+        app (Flask): The application, its database holds the messages.
+        store (SQLAlchemyMessageStore): The store over the same database.
+
+    Returns:
+        dict: Read path name to callable.
+    """
+    order = (ChatModel.timestamp.asc(), ChatModel.id.asc())
+    columns = (ChatModel.id, ChatModel.user_id, ChatModel.message, ChatModel.timestamp, ChatModel.encrypted)
+
+    def orm() -> list:
+        with app.app_context():
+            return wire_format.messages_to_list(ChatModel.query.order_by(*order).all())
+
+    def core() -> list:
+        with app.app_context():
+            rows = db.session.execute(select(*columns).order_by(*order))
+            return wire_format.messages_to_list([MessageRecord(*row) for row in rows])
+
+    def store_read() -> list:
+        return wire_format.messages_to_list(store.range_read())
+
+    return {'orm': orm, 'core': core, 'store': store_read}
+
+
+def measure(read, requests: int) -> tuple:
+    """
+    Time and trace one read path.
+
+    Args:
+        read: Callable performing one request.
+        requests (int): Number of timed requests.
+
+    Returns:
+        tuple: (requests per second, peak bytes allocated by one request)
+    """
+    for _ in range(min(requests, 50)):
+        read()
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        read()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    read()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return requests / elapsed, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the message read path.")
+    parser.add_argument('--messages', type=int, help='Messages in the window.', default=100)
+    parser.add_argument('--requests', type=int, help='Timed requests per read path.', default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(temp_dir, 'bench.db'),
+                          'SECRET_KEY': 'benchmark', 'CHAT_SESSION_STORE': 'memory',
+                          'CHAT_SERVER_CONFIG_FILE': os.path.join(temp_dir, 'config.json')})
+        init_schema(app)
+        store = SQLAlchemyMessageStore(app, max_messages=args.messages)
+        store.append([{'user_id': f'user{number % 7}', 'message': f'message {number} ' * 8,
+                       'encrypted': number % 2 == 0} for number in range(args.messages)])
+
+        readers = make_readers(app, store)
+        expected = readers['orm']()
+        for name, read in readers.items():
+            if read() != expected:
+                print(f"{name}: output differs from the ORM query")
+                sys.exit(1)
+
+        print(f"Full window read and serialized, {args.messages} messages:")
+        print(f"{'path':<8}{'requests/s':>14}{'rows/s':>14}{'peak KiB':>12}")
+        for name, read in readers.items():
+            rate, peak = measure(read, args.requests)
+            print(f"{name:<8}{rate:>14.0f}{rate * args.messages:>14.0f}{peak / 1024:>12.1f}")
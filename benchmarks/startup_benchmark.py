@@ -0,0 +1,79 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Startup Time Benchmark
+
+Measures how long a fresh worker process takes to become ready. Each run starts a new
+Python interpreter and times three phases:
+
+- import:        importing the 'app' module
+- create_app:    building an application with an isolated in-memory database
+- first request: handling GET '/', which includes the lazy schema creation
+
+Usage:
+    python benchmarks/startup_benchmark.py [--runs N]
+=======================================================
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Runs inside the child interpreter and prints the phase timings as JSON
+CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'SECRET_KEY': 'benchmark',
+                              'CHAT_SESSION_STORE': 'memory', 'CHAT_SERVER_CONFIG_FILE': sys.argv[1]})
+created = time.perf_counter()
+application.test_client().get('/')
+served = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'first request': served - created}))
+"""
+
+
+def run_once(config_filename: str) -> dict:
+    """
+    Start one child interpreter and collect its phase timings.
+
+    Args:
+        config_filename (str): Server configuration file for the child to use.
+
+    Returns:
+        dict: Phase name to duration in seconds.
+    """
+    output = subprocess.run([sys.executable, '-c', CHILD_SCRIPT, config_filename], cwd=PROJECT_ROOT,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark worker startup time.")
+    parser.add_argument('--runs', type=int, help='Number of fresh processes to time.', default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_filename = os.path.join(temp_dir, 'config.json')
+        results = [run_once(config_filename) for _ in range(args.runs)]
+
+    print(f"Startup time over {args.runs} runs (milliseconds):")
+    print(f"{'phase':<16}{'median':>10}{'min':>10}{'max':>10}")
+    for phase in ['import', 'create_app', 'first request']:
+        samples = [result[phase] * 1000 for result in results]
+        print(f"{phase:<16}{statistics.median(samples):>10.2f}{min(samples):>10.2f}{max(samples):>10.2f}")
@@ -0,0 +1,84 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Message Write Throughput Benchmark
+
+Posts bursts of messages to '/submit_message' from concurrent client threads against an
+on-disk SQLite database, with and without the group-commit write pipeline
+(CHAT_WRITE_BEHIND), and reports the sustained messages per second of each.
+
+Usage:
+    python benchmarks/write_pipeline_benchmark.py [--threads N] [--messages N]
+=======================================================
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# autopep8: off
+from app import create_app, init_schema
+# autopep8: on
+
+
+def run(write_behind: bool, threads: int, messages_per_thread: int) -> float:
+    """
+    Post messages concurrently and measure the throughput.
+
+    Args:
+        write_behind (bool): Whether the group-commit write pipeline is enabled.
+        threads (int): Number of concurrent posting threads.
+        messages_per_thread (int): Messages posted by each thread.
+
+    Returns:
+        float: Messages per second.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(temp_dir, 'bench.db'),
+                          'SECRET_KEY': 'benchmark', 'CHAT_SESSION_STORE': 'memory',
+                          'CHAT_SERVER_CONFIG_FILE': os.path.join(temp_dir, 'config.json'),
+                          'CHAT_WRITE_BEHIND': write_behind})
+        init_schema(app)
+        start_barrier = threading.Barrier(threads + 1)
+
+        def post_messages(thread_number):
+            client = app.test_client()
+            start_barrier.wait()
+            for i in range(messages_per_thread):
+                response = client.post('/submit_message', json={'user_id': f'bench{thread_number}',
+                                                                'message_content': f'message {i}',
+                                                                'message_encrypted': False})
+                assert response.status_code == 200, response.get_data(as_text=True)
+
+        workers = [threading.Thread(target=post_messages, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        start_barrier.wait()
+        start = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+    return threads * messages_per_thread / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark chat message write throughput.")
+    parser.add_argument('--threads', type=int, help='Concurrent posting threads.', default=16)
+    parser.add_argument('--messages', type=int, help='Messages posted by each thread.', default=50)
+    args = parser.parse_args()
+
+    for label, write_behind in [('per-request commit', False), ('group commit', True)]:
+        rate = run(write_behind, args.threads, args.messages)
+        print(f"{label:<20}{rate:>10.0f} messages/s")
@@ -12,13 +12,23 @@ Server Configuration Module
 
 This module defines a server configuration class used by various functions in the Secure Chat Server project.
 The `ServerConfig` class encapsulates configuration settings such as SSH and encryption settings.
+
+The configuration is held in memory, so reading a setting never touches the file. Saving
+writes a temporary file next to 'config.json' and renames it over the old one, so readers
+see either the old or the new file, never a partial one. Every process sharing the file
+calls reload_if_changed(), which compares the file's inode, modification time and size
+with the ones it last loaded at most once per check interval, and reloads on a change.
+Setters update the file under an exclusive lock on 'config.json.lock', so workers toggling
+different settings at the same moment do not undo each other's change.
 =======================================================
 """
 
+import fcntl
 import json
 import os
-import unittest
-from typing import NoReturn
+import tempfile
+import time
+from typing import NoReturn, Optional
 
 
 class ServerConfig:
@@ -35,21 +45,32 @@ class ServerConfig:
     PASSWORD_HASH_KEY = 'password_hash'
     SSH_ENABLED_KEY = 'ssh_enabled'
     ENCRYPTION_ENABLED_KEY = 'encryption_enabled'
-
-    def __init__(self) -> NoReturn:
+    DEFAULT_MESSAGE_STORE = 'sqlalchemy'
+    MESSAGE_STORES = ('sqlalchemy', 'memory', 'logfile')
+    DEFAULT_MESSAGE_LOG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'database', 'messages.log'))
+    MESSAGE_STORE_KEY = 'message_store'
+    MESSAGE_LOG_PATH_KEY = 'message_log_path'
+    # Seconds between checks of the file for changes made by other processes
+    DEFAULT_CHECK_INTERVAL = 1.0
+
+    def __init__(self, config_filename: Optional[str] = None) -> NoReturn:
         """
         Initialize the ServerConfig instance and load the configuration from a JSON file.
 
         Args:
-            None
+            config_filename (str): Optional path of the configuration file. Defaults to
+                                   'config.json' next to this module.
 
         Returns:
             NoReturn
         """
-        self.config_filename = os.path.join(os.path.dirname(__file__), "config.json")
+        self.config_filename = config_filename or os.path.join(os.path.dirname(__file__), "config.json")
         self.version_filename = os.path.join(os.path.dirname(__file__), "version.txt")
         self._version = self._load_version()
         self.config = {}
+        # (inode, modification time, size) of the file the configuration was loaded from
+        self._file_identity = None
+        self._last_check = time.monotonic()
         self.load_config()
 
     def _load_version(self) -> str:
@@ -78,7 +99,9 @@ class ServerConfig:
         """
         try:
             with open(self.config_filename, "r") as config_file:
+                identity = self._identity(os.fstat(config_file.fileno()))
                 self.config = json.load(config_file)
+                self._file_identity = identity
         except FileNotFoundError:
             # If no config established, set default values and save the config
             self.config = {
@@ -125,12 +148,12 @@ class ServerConfig:
         Returns:
             NoReturn
         """
-        self.config[self.PASSWORD_HASH_KEY] = new_hash
-        self.save_config()
+        self._update(self.PASSWORD_HASH_KEY, new_hash)
 
     def save_config(self) -> NoReturn:
         """
-        Save the current configuration to the 'config.json' file.
+        Save the current configuration to the 'config.json' file, atomically: the new file
+        is written and synced under a temporary name, then renamed over the old one.
 
         Args:
             None
@@ -138,8 +161,76 @@ class ServerConfig:
         Returns:
             NoReturn
         """
-        with open(self.config_filename, "w") as config_file:
-            json.dump(self.config, config_file, indent=4)
+        directory = os.path.dirname(os.path.abspath(self.config_filename))
+        temp_fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.config-', suffix='.json')
+        try:
+            with os.fdopen(temp_fd, "w") as config_file:
+                json.dump(self.config, config_file, indent=4)
+                config_file.flush()
+                os.fsync(config_file.fileno())
+                identity = self._identity(os.fstat(config_file.fileno()))
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.config_filename)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self._file_identity = identity
+
+    @staticmethod
+    def _identity(stat: os.stat_result) -> tuple:
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def reload_if_changed(self, check_interval: float = DEFAULT_CHECK_INTERVAL) -> bool:
+        """
+        Reload the configuration if another process saved a new file. The file is looked
+        at once per check interval at most, otherwise this returns at once.
+
+        Args:
+            check_interval (float): Seconds between checks of the file, 0 to check now.
+
+        Returns:
+            bool: True if the configuration was reloaded.
+        """
+        now = time.monotonic()
+        if now - self._last_check < check_interval:
+            return False
+        self._last_check = now
+        try:
+            if self._identity(os.stat(self.config_filename)) == self._file_identity:
+                return False
+            with open(self.config_filename, "r") as config_file:
+                identity = self._identity(os.fstat(config_file.fileno()))
+                try:
+                    config = json.load(config_file)
+                except ValueError as e:
+                    # Hand-edited into invalid JSON, keep the last good configuration until it changes again
+                    self._file_identity = identity
+                    print(f"Configuration {self.config_filename} not reloaded: {e}")
+                    return False
+        except OSError:
+            # Missing for now, keep serving the last good configuration
+            return False
+        self.config = config
+        self._file_identity = identity
+        return True
+
+    def _update(self, key: str, value) -> NoReturn:
+        """
+        Set one setting and save the file, on top of the latest saved configuration.
+
+        Args:
+            key (str): The setting.
+            value: Its new value.
+
+        Returns:
+            NoReturn
+        """
+        with open(self.config_filename + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.reload_if_changed(0)
+            # Replace the dictionary rather than change it, readers see the old or the new one
+            self.config = {**self.config, key: value}
+            self.save_config()
 
     @property
     def ssh_enabled(self) -> bool:
@@ -165,8 +256,7 @@ class ServerConfig:
         Returns:
             NoReturn
         """
-        self.config[self.SSH_ENABLED_KEY] = value
-        self.save_config()
+        self._update(self.SSH_ENABLED_KEY, value)
 
     @property
     def encryption_enabled(self) -> bool:
@@ -192,8 +282,52 @@ class ServerConfig:
         Returns:
             NoReturn
         """
-        self.config[self.ENCRYPTION_ENABLED_KEY] = value
-        self.save_config()
+        self._update(self.ENCRYPTION_ENABLED_KEY, value)
+
+    @property
+    def message_store(self) -> str:
+        """
+        Get the chat message storage backend, one of MESSAGE_STORES.
+
+        Args:
+            None
+
+        Returns:
+            str: The message store name. Default 'sqlalchemy' if config file DNE.
+        """
+        return self.config.get(self.MESSAGE_STORE_KEY, self.DEFAULT_MESSAGE_STORE)
+
+    @message_store.setter
+    def message_store(self, value: str) -> NoReturn:
+        """
+        Set the chat message storage backend and save it to the configuration file. Takes
+        effect when the server restarts.
+
+        Args:
+            value (str): One of MESSAGE_STORES.
+
+        Returns:
+            NoReturn
+
+        Raises:
+            ValueError: If the value is not a known message store.
+        """
+        if value not in self.MESSAGE_STORES:
+            raise ValueError(f"Unknown message store: {value}")
+        self._update(self.MESSAGE_STORE_KEY, value)
+
+    @property
+    def message_log_path(self) -> str:
+        """
+        Get the path of the log file used by the 'logfile' message store.
+
+        Args:
+            None
+
+        Returns:
+            str: The log file path.
+        """
+        return self.config.get(self.MESSAGE_LOG_PATH_KEY, self.DEFAULT_MESSAGE_LOG_PATH)
 
     @staticmethod
     def max_message_count() -> int:
@@ -247,6 +381,7 @@ class ServerConfig:
         print("Current Server Configuration:")
         print(f"SSH Enabled: {self.ssh_enabled}")
         print(f"Encryption Enabled: {self.encryption_enabled}")
+        print(f"Message Store: {self.message_store}")
         print(f"Max Username Length: {ServerConfig.__MAX_USERNAME_LENGTH}")
         print(f"Max Message Length: {ServerConfig.__MAX_MESSAGE_LENGTH}")
         print(f"Password Hash: {self.password_hash}")
@@ -288,9 +423,15 @@ if __name__ == '__main__':
     print(f"Password hash: {server_config.password_hash}")
     print(f"Version: {server_config.version}")
 
+    # A change saved by one instance is picked up by another on its next check
+    server_config_2.encryption_enabled = False
+    print(f"Reloaded: {server_config.reload_if_changed(0)}, "
+          f"Encryption Enabled: {server_config.encryption_enabled}")
+
     # Delete the test config file
     try:
         os.remove(server_config.config_filename)
+        os.remove(server_config.config_filename + '.lock')
         print(f"Config file '{server_config.config_filename}' deleted.")
     except OSError as e:
         print(f"Error: {e.strerror}")
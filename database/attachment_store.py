@@ -0,0 +1,151 @@
+"""
+Author: Eric Thomas
+Project: Secure Chat Server
+Group: A
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Content-Addressed Attachment Storage
+
+This module stores the files shared in the chat on disk under the SHA-256 digest of their
+content, in a two-level layout (ab/abcdef...). Uploads are streamed to a temporary file in
+fixed-size chunks while they are hashed, so memory use does not depend on the file size,
+then renamed into place. An upload whose content is already stored is discarded and the
+existing file is reused. Metadata (file name, media type, uploader) lives in
+AttachmentModel rows that refer to the files by digest.
+=======================================================
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+from typing import BinaryIO, NoReturn
+
+CHUNK_SIZE = 64 * 1024
+
+
+class AttachmentTooLarge(Exception):
+    """
+    Raised when an upload is larger than the allowed size.
+    """
+
+
+class AttachmentStore:
+    """
+    Stores attachment content on disk under its SHA-256 digest.
+    """
+
+    DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+
+    def __init__(self, root: str) -> NoReturn:
+        """
+        Initialize the AttachmentStore instance.
+
+        Args:
+            root (str): Directory holding the files.
+
+        Returns:
+            NoReturn
+        """
+        self.root = root
+
+    def path(self, digest: str) -> str:
+        """
+        Get the path of a stored file.
+
+        Args:
+            digest (str): SHA-256 hex digest of the content.
+
+        Returns:
+            str: The path.
+        """
+        return os.path.join(self.root, digest[:2], digest)
+
+    def save(self, stream: BinaryIO, max_size: int = DEFAULT_MAX_SIZE) -> tuple:
+        """
+        Stores the content read from a stream.
+
+        Args:
+            stream (BinaryIO): The content, read in chunks until exhausted.
+            max_size (int): Largest accepted size in bytes.
+
+        Returns:
+            tuple: (SHA-256 hex digest, size in bytes). Empty content is not stored.
+
+        Raises:
+            AttachmentTooLarge: If the stream holds more than max_size bytes, nothing is stored.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        temp_fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(temp_fd, 'wb') as temp_file:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_size:
+                        raise AttachmentTooLarge()
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+
+            hex_digest = digest.hexdigest()
+            path = self.path(hex_digest)
+            if size == 0:
+                # Nothing to share, the caller rejects empty uploads
+                pass
+            elif os.path.exists(path):
+                # Already stored, refresh the time so a concurrent prune keeps the file
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, path)
+            return hex_digest, size
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def remove(self, digests, older_than: float) -> int:
+        """
+        Deletes stored files that are no longer referenced.
+
+        Args:
+            digests: Digests of the files to delete.
+            older_than (float): Files modified after this time (seconds since the epoch) are
+                                kept, they may have just been uploaded again.
+
+        Returns:
+            int: Number of files deleted.
+        """
+        removed = 0
+        for digest in digests:
+            path = self.path(digest)
+            try:
+                if os.stat(path).st_mtime < older_than:
+                    os.unlink(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+if __name__ == '__main__':
+    # Example usage: the same content uploaded twice is stored once
+    import io
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = AttachmentStore(temp_dir)
+        first = store.save(io.BytesIO(b'log line\n' * 100000))
+        second = store.save(io.BytesIO(b'log line\n' * 100000))
+        print(f"Stored {first[1]} bytes as {first[0][:12]}..., second upload deduplicated: {first == second}")
+        try:
+            store.save(io.BytesIO(b'x' * 2048), max_size=1024)
+        except AttachmentTooLarge:
+            print("Upload over the size limit rejected")
+        print(f"Pruned {store.remove([first[0]], older_than=time.time() + 1)} file(s)")
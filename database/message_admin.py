@@ -0,0 +1,78 @@
+"""
+Author: Eric Thomas
+Project: Secure Chat Server
+Group: A
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Message Administration Commands
+
+This module adds a 'messages' command group to the Flask CLI.
+
+Usage:
+    flask --app app messages export history.ndjson            # NDJSON export
+    flask --app app messages export history.csv.gz --gzip     # gzip-compressed CSV export
+    flask --app app messages export - | head                  # NDJSON to standard output
+    flask --app app messages prune-attachments --grace 3600    # delete unshared attachment files
+
+The export streams the message store in batches, the same way as the '/export'
+endpoint, so it runs in constant memory however long the history is. The format defaults
+to CSV for '.csv' and '.csv.gz' files and to NDJSON otherwise.
+
+prune-attachments deletes the attachments no stored message refers to any more, and their
+files once no other attachment shares the content. Attachments and files newer than the
+grace period are kept, an upload may still be adding its message.
+=======================================================
+"""
+
+import sys
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+
+
+@click.group('messages', cls=AppGroup)
+@with_appcontext
+def messages_cli():
+    """Chat message administration."""
+    # Imported here, the application module registers this group when it is imported
+    from app import init_schema
+    init_schema(current_app)
+
+
+@messages_cli.command('export')
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'export_format', type=click.Choice(['ndjson', 'csv']),
+              help='Output format, chosen from the file name by default.')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip-compress the output.')
+def export_messages(path: str, export_format: str, compress: bool):
+    """Stream the chat history to a file, or to standard output for '-'."""
+    from app import export_stream
+
+    if export_format is None:
+        export_format = 'csv' if path.removesuffix('.gz').endswith('.csv') else 'ndjson'
+
+    stream = export_stream(current_app.extensions['chat_server'].message_store, export_format, compress)
+    output = sys.stdout.buffer if path == '-' else open(path, 'wb')
+    try:
+        for chunk in stream:
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+
+
+@messages_cli.command('prune-attachments')
+@click.option('--grace', type=int, default=3600, show_default=True,
+              help='Seconds an attachment is kept before it may be pruned.')
+def prune_attachments(grace: int):
+    """Delete attachments no chat message refers to any more."""
+    from database.models import AttachmentModel
+
+    digests = AttachmentModel.remove_unreferenced(current_app, datetime.utcnow() - timedelta(seconds=grace))
+    removed = current_app.extensions['chat_server'].attachment_store.remove(digests, time.time() - grace)
+    click.echo(f"Removed {removed} unreferenced attachment file(s)")
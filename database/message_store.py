@@ -0,0 +1,626 @@
+"""
+Author: Eric Thomas
+Project: Secure Chat Server
+Group: A
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Chat Message Storage Backends
+
+This module defines the MessageStore interface used by the application for chat messages,
+and three implementations that can be selected with the 'message_store' key of the
+ServerConfig:
+
+- 'sqlalchemy': the ChatModel table, shared by every worker, with full-text search.
+- 'memory':     a process-local window, for single-process deployments and tests.
+- 'logfile':    an append-only JSON-lines file replayed on startup and compacted as it
+                grows. Workers on the same host share it through a file lock.
+
+Every store keeps the newest max_message_count messages, assigns increasing ids, and
+honours idempotency keys the same way ChatModel.add_new_messages does. The shared
+conformance checks and benchmark live in benchmarks/message_store_benchmark.py.
+=======================================================
+"""
+
+import bisect
+import fcntl
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from flask import Flask
+from sqlalchemy import Engine, bindparam, func, select
+from typing import Iterator, NoReturn, Optional
+from config.server_config import ServerConfig
+from database.models import db, ChatModel, MessageRecord
+
+# Columns read into MessageRecord, in field order
+_RECORD_COLUMNS = (ChatModel.id, ChatModel.user_id, ChatModel.message, ChatModel.timestamp, ChatModel.encrypted,
+                   ChatModel.attachment_id)
+
+# Window read of the polling path, with bound ids so the statement is only compiled once
+_RANGE_READ = (select(*_RECORD_COLUMNS)
+               .where(ChatModel.id.between(bindparam('start_id'), bindparam('end_id')))
+               .order_by(ChatModel.timestamp.asc(), ChatModel.id.asc()))
+_MIN_ID = -2 ** 63
+_MAX_ID = 2 ** 63 - 1
+
+
+class MessageStore(ABC):
+    """
+    Interface for chat message storage backends. Messages are returned as MessageRecord
+    tuples, oldest first.
+    """
+
+    # Whether the store implements search_messages(query, page, per_page), full-text search
+    # over the unencrypted messages returning (list of result dictionaries, more pages exist)
+    supports_search = False
+    # Whether the store keeps the 'attachment_id' of appended messages
+    supports_attachments = False
+    # Whether the store can log its writes for, and apply writes from, peer nodes
+    supports_replication = False
+    # Whether the messages only live in memory, so warm-restart snapshots must carry them
+    supports_warm_restart = False
+
+    @abstractmethod
+    def append(self, messages: list) -> tuple:
+        """
+        Store a batch of messages and trim the store to its retention limit.
+
+        Args:
+            messages (list): Dictionaries with 'user_id', 'message' and 'encrypted' keys, an
+                             optional 'idempotency_key' and, for stores that support
+                             attachments, an optional 'attachment_id'. A message whose key is
+                             already stored for the same user, or repeated by that user
+                             earlier in the batch, is not stored again.
+
+        Returns:
+            tuple: (list of MessageRecord in the same order as messages, id of the newest
+                    stored message)
+        """
+
+    @abstractmethod
+    def trim(self, limit: int) -> int:
+        """
+        Delete every message beyond the newest limit messages.
+
+        Args:
+            limit (int): Number of messages to keep.
+
+        Returns:
+            int: Number of messages deleted.
+        """
+
+    @abstractmethod
+    def range_read(self, start_id: Optional[int] = None, end_id: Optional[int] = None) -> list:
+        """
+        Read the stored messages with ids in an inclusive range.
+
+        Args:
+            start_id (int): Lowest id to return, unbounded if None.
+            end_id (int): Highest id to return, unbounded if None.
+
+        Returns:
+            list: MessageRecord tuples, oldest first.
+        """
+
+    @abstractmethod
+    def since(self, cursor: Optional[int], limit: Optional[int] = None) -> list:
+        """
+        Read the messages stored after a cursor, for incremental polling.
+
+        Args:
+            cursor (int): Id of the newest message the caller has, None for everything.
+            limit (int): Most messages to return, the oldest ones after the cursor first.
+
+        Returns:
+            list: MessageRecord tuples, oldest first.
+        """
+
+    @abstractmethod
+    def head(self) -> Optional[int]:
+        """
+        Id of the newest stored message.
+
+        Returns:
+            int or None: The id, None if the store is empty.
+        """
+
+    def iter_messages(self, batch_size: int = 500) -> Iterator[MessageRecord]:
+        """
+        Iterate over every stored message without holding them all in memory, for exports.
+        Reads pages of batch_size messages through since().
+
+        Args:
+            batch_size (int): Messages read per page.
+
+        Returns:
+            Iterator[MessageRecord]: The messages, oldest first.
+        """
+        cursor = None
+        while True:
+            page = self.since(cursor, batch_size)
+            yield from page
+            if len(page) < batch_size:
+                return
+            cursor = page[-1].id
+
+    def export_window(self) -> tuple:
+        """
+        Copy of the retained messages, for warm-restart snapshots.
+
+        Returns:
+            tuple: (list of MessageRecord, id the next stored message will get)
+        """
+        records = self.range_read()
+        return records, (max((record.id for record in records), default=0)) + 1
+
+    def restore_window(self, records: list, next_id: int) -> bool:
+        """
+        Load the retained messages from a warm-restart snapshot. Stores that keep their
+        messages durably ignore the snapshot.
+
+        Args:
+            records (list): MessageRecord tuples, oldest first.
+            next_id (int): Id the next stored message gets.
+
+        Returns:
+            bool: True if the messages were loaded.
+        """
+        return False
+
+
+class SQLAlchemyMessageStore(MessageStore):
+    """
+    Message store backed by the ChatModel table.
+    """
+
+    supports_search = True
+    supports_attachments = True
+    supports_replication = True
+
+    def __init__(self, app: Flask, max_messages: Optional[int] = None, replicate: bool = False) -> NoReturn:
+        """
+        Initialize the SQLAlchemyMessageStore instance.
+
+        Args:
+            app (Flask): The Flask application instance, its database holds the messages.
+            max_messages (int): Number of messages to keep, max_message_count by default.
+            replicate (bool): Append every write to the replication log for peer nodes.
+
+        Returns:
+            NoReturn
+        """
+        self.app = app
+        self.max_messages = ServerConfig.max_message_count() if max_messages is None else max_messages
+        self.replicate = replicate
+        self._engine = None
+        self._prepared_read = None
+
+    @property
+    def engine(self) -> Engine:
+        """
+        The database engine, looked up once. On SQLite the window read is also compiled
+        here, with the dialect's own converters for the timestamp and encrypted columns.
+        """
+        if self._engine is None:
+            with self.app.app_context():
+                engine = db.engine
+            if engine.dialect.name == 'sqlite':
+                compiled = _RANGE_READ.compile(dialect=engine.dialect)
+                converters = tuple(column.type.dialect_impl(engine.dialect).result_processor(engine.dialect, None)
+                                   for column in (ChatModel.timestamp, ChatModel.encrypted))
+                self._prepared_read = (str(compiled), compiled.positiontup) + converters
+            self._engine = engine
+        return self._engine
+
+    def append(self, messages: list) -> tuple:
+        return ChatModel.add_new_messages(self.app, messages, self.max_messages, self.replicate)
+
+    def trim(self, limit: int) -> int:
+        with self.app.app_context():
+            deleted = ChatModel.trim_to_limit(limit)
+            db.session.commit()
+        return deleted
+
+    def range_read(self, start_id: Optional[int] = None, end_id: Optional[int] = None) -> list:
+        # Every poll lands here, so the read skips the session and the ORM entirely. On
+        # SQLite the compiled statement runs on the pooled DB-API connection, which keeps
+        # it prepared between calls, and the rows go straight into MessageRecord.
+        bounds = {'start_id': _MIN_ID if start_id is None else start_id,
+                  'end_id': _MAX_ID if end_id is None else end_id}
+        engine = self.engine
+        if self._prepared_read is None:
+            with engine.connect() as connection:
+                return [MessageRecord(*row) for row in connection.execute(_RANGE_READ, bounds)]
+
+        sql, parameter_names, to_datetime, to_bool = self._prepared_read
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(sql, [bounds[name] for name in parameter_names])
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            connection.close()
+        return [MessageRecord(message_id, user_id, message, to_datetime(timestamp), to_bool(encrypted), attachment_id)
+                for message_id, user_id, message, timestamp, encrypted, attachment_id in rows]
+
+    def since(self, cursor: Optional[int], limit: Optional[int] = None) -> list:
+        statement = select(*_RECORD_COLUMNS).order_by(ChatModel.id.asc()).limit(limit)
+        if cursor is not None:
+            statement = statement.where(ChatModel.id > cursor)
+        with self.app.app_context():
+            return [MessageRecord(*row) for row in db.session.execute(statement)]
+
+    def head(self) -> Optional[int]:
+        with self.app.app_context():
+            return db.session.execute(select(func.max(ChatModel.id))).scalar()
+
+    def search_messages(self, query: str, page: int = 1, per_page: int = 20) -> tuple:
+        return ChatModel.search_messages(self.app, query, page, per_page)
+
+    def iter_messages(self, batch_size: int = 500) -> Iterator[MessageRecord]:
+        # One query streamed in batches of rows, outside any application context so the
+        # generator can be consumed after the request that created it has returned
+        statement = select(*_RECORD_COLUMNS).order_by(ChatModel.id.asc())
+        with self.engine.connect() as connection:
+            result = connection.execution_options(yield_per=batch_size).execute(statement)
+            for rows in result.partitions():
+                yield from (MessageRecord(*row) for row in rows)
+
+
+class MemoryMessageStore(MessageStore):
+    """
+    Process-local message store. Messages are not shared between workers, and are kept
+    across restarts only through warm-restart snapshots.
+    """
+
+    supports_warm_restart = True
+
+    def __init__(self, max_messages: Optional[int] = None) -> NoReturn:
+        """
+        Initialize the MemoryMessageStore instance.
+
+        Args:
+            max_messages (int): Number of messages to keep, max_message_count by default.
+
+        Returns:
+            NoReturn
+        """
+        self.max_messages = ServerConfig.max_message_count() if max_messages is None else max_messages
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> NoReturn:
+        """
+        Empty the in-memory window.
+        """
+        # Records in id order, and the (user_id, idempotency key) of each retained record that has one
+        self._records = []
+        self._keys = {}
+        self._key_by_id = {}
+        self._next_id = 1
+
+    def _apply(self, record: MessageRecord, key: Optional[str]) -> NoReturn:
+        """
+        Add a record to the window. Caller holds the lock.
+        """
+        self._records.append(record)
+        self._next_id = max(self._next_id, record.id + 1)
+        if key is not None:
+            self._keys[(record.user_id, key)] = record
+            self._key_by_id[record.id] = key
+
+    def _trim_locked(self, limit: int) -> int:
+        """
+        Drop every record beyond the newest limit records. Caller holds the lock.
+        """
+        excess = len(self._records) - max(limit, 0)
+        if excess <= 0:
+            return 0
+        for record in self._records[:excess]:
+            key = self._key_by_id.pop(record.id, None)
+            if key is not None:
+                del self._keys[(record.user_id, key)]
+        del self._records[:excess]
+        return excess
+
+    def _prepare(self, messages: list, now: datetime) -> tuple:
+        """
+        Assign ids to the messages of a batch that are not stored yet. Caller holds the lock.
+
+        Returns:
+            tuple: (list of MessageRecord in the same order as messages,
+                    list of (MessageRecord, idempotency key) pairs to store)
+        """
+        records, new_entries, batch_keys = [], [], {}
+        next_id = self._next_id
+        for message in messages:
+            key = message.get('idempotency_key')
+            user_key = None if key is None else (message['user_id'], key)
+            if user_key in self._keys:
+                records.append(self._keys[user_key])
+            elif user_key is not None and user_key in batch_keys:
+                records.append(batch_keys[user_key])
+            else:
+                record = MessageRecord(next_id, message['user_id'], message['message'],
+                                       message.get('timestamp') or now, bool(message['encrypted']))
+                next_id += 1
+                if user_key is not None:
+                    batch_keys[user_key] = record
+                new_entries.append((record, key))
+                records.append(record)
+        return records, new_entries
+
+    def append(self, messages: list) -> tuple:
+        if not messages:
+            return [], None
+        with self._lock:
+            records, new_entries = self._prepare(messages, datetime.utcnow())
+            for record, key in new_entries:
+                self._apply(record, key)
+            self._trim_locked(self.max_messages)
+            return records, self._head_locked()
+
+    def trim(self, limit: int) -> int:
+        with self._lock:
+            return self._trim_locked(limit)
+
+    def range_read(self, start_id: Optional[int] = None, end_id: Optional[int] = None) -> list:
+        with self._lock:
+            start = 0 if start_id is None else bisect.bisect_left(self._records, start_id, key=lambda r: r.id)
+            end = len(self._records) if end_id is None else bisect.bisect_right(self._records, end_id,
+                                                                                  key=lambda r: r.id)
+            return self._records[start:end]
+
+    def since(self, cursor: Optional[int], limit: Optional[int] = None) -> list:
+        with self._lock:
+            start = 0 if cursor is None else bisect.bisect_right(self._records, cursor, key=lambda r: r.id)
+            end = len(self._records) if limit is None else start + limit
+            return self._records[start:end]
+
+    def _head_locked(self) -> Optional[int]:
+        return self._records[-1].id if self._records else None
+
+    def head(self) -> Optional[int]:
+        with self._lock:
+            return self._head_locked()
+
+    def export_window(self) -> tuple:
+        with self._lock:
+            return list(self._records), self._next_id
+
+    def restore_window(self, records: list, next_id: int) -> bool:
+        with self._lock:
+            # Messages stored since startup are newer than the snapshot, keep them
+            if self._records:
+                return False
+            for record in records[-self.max_messages:] if self.max_messages else []:
+                self._apply(record, None)
+            self._next_id = max(self._next_id, next_id)
+        return True
+
+
+class LogFileMessageStore(MemoryMessageStore):
+    """
+    Message store kept in an append-only JSON-lines log, with the retained window cached in
+    memory. Each line is a message, a trim marker, or the header written by compaction.
+    Before every operation the store reads lines appended by other processes, under an
+    exclusive lock for writes and a shared lock for reads. Once the log holds
+    COMPACTION_FACTOR times the retained messages it is rewritten with only the window and
+    atomically renamed into place; other processes notice the new file and reload it.
+    """
+
+    # Kept in the log, snapshots need not carry it
+    supports_warm_restart = False
+
+    COMPACTION_FACTOR = 4
+
+    def __init__(self, path: str, max_messages: Optional[int] = None, fsync: bool = False) -> NoReturn:
+        """
+        Initialize the LogFileMessageStore instance. The log is opened on first use.
+
+        Args:
+            path (str): Path of the log file.
+            max_messages (int): Number of messages to keep, max_message_count by default.
+            fsync (bool): Whether every append is flushed to disk before it is acknowledged.
+
+        Returns:
+            NoReturn
+        """
+        super().__init__(max_messages)
+        self.path = path
+        self.fsync = fsync
+        self._file = None
+        self._offset = 0
+        self._owner_pid = None
+        self._log_lines = 0
+
+    def _open(self) -> NoReturn:
+        """
+        (Re)open the log file and replay it from the start. Caller holds the lock.
+        """
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, 'a+b')
+        self._owner_pid = os.getpid()
+        self._offset = 0
+        self._log_lines = 0
+        self._reset()
+
+    def _is_stale(self) -> bool:
+        """
+        Check whether the open file was replaced by a compaction, or was inherited through a
+        fork. Caller holds the lock.
+        """
+        if self._file is None or self._owner_pid != os.getpid():
+            return True
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _acquire(self, exclusive: bool) -> NoReturn:
+        """
+        Lock the current log file and read any lines appended since the last call. Caller
+        holds the thread lock.
+        """
+        while True:
+            if self._is_stale():
+                self._open()
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            if not self._is_stale():
+                break
+            # Compacted while waiting for the lock, the old file is no longer the log
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+        self._file.seek(self._offset)
+        data = self._file.read()
+        # A line without its newline is still being written by another process
+        complete = data[:data.rfind(b'\n') + 1]
+        for line in complete.splitlines():
+            self._replay(json.loads(line))
+        self._offset += len(complete)
+        self._trim_locked(self.max_messages)
+
+    def _release(self) -> NoReturn:
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _replay(self, entry: dict) -> NoReturn:
+        """
+        Apply one log entry to the in-memory window. Caller holds the lock.
+        """
+        self._log_lines += 1
+        if 'trim' in entry:
+            self._trim_locked(entry['trim'])
+        elif 'next_id' in entry:
+            self._next_id = max(self._next_id, entry['next_id'])
+        else:
+            record = MessageRecord(entry['i'], entry['u'], entry['m'], datetime.fromisoformat(entry['t']), entry['e'])
+            self._apply(record, entry.get('k'))
+            # Bound memory while replaying a long log, the result is the same as trimming at the end
+            if len(self._records) > 2 * self.max_messages:
+                self._trim_locked(self.max_messages)
+
+    @staticmethod
+    def _encode(record: MessageRecord, key: Optional[str]) -> bytes:
+        entry = {'i': record.id, 'u': record.user_id, 'm': record.message, 't': record.timestamp.isoformat(),
+                 'e': record.encrypted}
+        if key is not None:
+            entry['k'] = key
+        return json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n'
+
+    def _write(self, data: bytes) -> NoReturn:
+        """
+        Append encoded lines to the log. Caller holds the exclusive lock.
+        """
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._offset = self._file.tell()
+
+    def _maybe_compact(self) -> NoReturn:
+        """
+        Rewrite the log with only the retained window once it has grown enough. Caller holds
+        the exclusive lock.
+        """
+        if self._log_lines <= self.COMPACTION_FACTOR * max(self.max_messages, 1):
+            return
+
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as temp_file:
+            temp_file.write(json.dumps({'next_id': self._next_id}).encode('utf-8') + b'\n')
+            for record in self._records:
+                temp_file.write(self._encode(record, self._key_by_id.get(record.id)))
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, self.path)
+        # The next operation reopens and replays the compacted file
+
+    def append(self, messages: list) -> tuple:
+        if not messages:
+            return [], None
+        with self._lock:
+            self._acquire(exclusive=True)
+            try:
+                records, new_entries = self._prepare(messages, datetime.utcnow())
+                if new_entries:
+                    self._write(b''.join(self._encode(record, key) for record, key in new_entries))
+                    self._log_lines += len(new_entries)
+                for record, key in new_entries:
+                    self._apply(record, key)
+                self._trim_locked(self.max_messages)
+                head = self._head_locked()
+                self._maybe_compact()
+            finally:
+                self._release()
+        return records, head
+
+    def trim(self, limit: int) -> int:
+        with self._lock:
+            self._acquire(exclusive=True)
+            try:
+                self._write(json.dumps({'trim': limit}).encode('utf-8') + b'\n')
+                self._log_lines += 1
+                return self._trim_locked(limit)
+            finally:
+                self._release()
+
+    def range_read(self, start_id: Optional[int] = None, end_id: Optional[int] = None) -> list:
+        with self._lock:
+            self._acquire(exclusive=False)
+            self._release()
+            return super().range_read(start_id, end_id)
+
+    def since(self, cursor: Optional[int], limit: Optional[int] = None) -> list:
+        with self._lock:
+            self._acquire(exclusive=False)
+            self._release()
+            return super().since(cursor, limit)
+
+    def head(self) -> Optional[int]:
+        with self._lock:
+            self._acquire(exclusive=False)
+            self._release()
+            return self._head_locked()
+
+    def export_window(self) -> tuple:
+        with self._lock:
+            self._acquire(exclusive=False)
+            self._release()
+            return super().export_window()
+
+    def restore_window(self, records: list, next_id: int) -> bool:
+        # The log is the durable copy, it is replayed instead
+        return False
+
+
+def create_message_store(app: Flask, server_config: ServerConfig) -> MessageStore:
+    """
+    Build the message store selected by the server configuration.
+
+    Args:
+        app (Flask): The Flask application instance.
+        server_config (ServerConfig): The server configuration.
+
+    Returns:
+        MessageStore: The message store.
+
+    Raises:
+        ValueError: If the configured store is unknown.
+    """
+    store = server_config.message_store
+    if store == 'sqlalchemy':
+        return SQLAlchemyMessageStore(app, replicate=bool(app.config.get('CHAT_REPLICATION_NODE_ID')))
+    if store == 'memory':
+        return MemoryMessageStore()
+    if store == 'logfile':
+        return LogFileMessageStore(server_config.message_log_path)
+    raise ValueError(f"Unknown message store: {store}")
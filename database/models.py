@@ -10,7 +10,9 @@ Description:
 Secure Chat Server Database Models
 
 This module defines the SQLAlchemy models (tables) for the Secure Chat Server application.
-It includes the UsersModel and ChatModel classes for storing user and chat information.
+It includes the UsersModel, ChatModel, AttachmentModel and SSHKeyModel classes for storing
+user, chat, attachment and SSH public key information, and the ReplicationLogModel and
+ReplicationPeerModel tables used to replicate chat messages between nodes.
 
 TODO:
 - Getters for ChatModel
@@ -19,20 +21,26 @@ TODO:
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Integer, String, Boolean
-from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import (Boolean, DateTime, Integer, Select, String, and_, bindparam, delete, func, insert, inspect,
+                        literal, or_, select, text, true, update)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Mapped, aliased, mapped_column
 import traceback
+import hashlib
+import json
 import sys
 import os
-from typing import NoReturn
+from typing import NamedTuple, NoReturn, Optional
 from sqlalchemy.orm import DeclarativeBase
 from datetime import datetime
 
-# append system path and import utils
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# append system path when run as a script, the application already has the project root on it
+if __package__ in (None, ''):
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 # autopep8: off
-from utils.encryption_tools import get_password_hash
 from config.server_config import ServerConfig
+from utils.tracing import trace_static_methods
 # autopep8: on
 
 #############################################################################
@@ -47,6 +55,7 @@ class Base(DeclarativeBase):
 db = SQLAlchemy(model_class=Base)
 
 
+@trace_static_methods
 class UsersModel(db.Model):
     """
     SQLAlchemy Model for storing user information.
@@ -57,6 +66,10 @@ class UsersModel(db.Model):
     username: Mapped[str] = mapped_column(String(ServerConfig.max_username_length()), unique=True, nullable=False)
     logged_in: Mapped[bool] = mapped_column(Boolean, default=False)
     ssh_key_setup: Mapped[bool] = mapped_column(Boolean, default=False)
+    # Salted password record from encryption_tools.hash_password, None until the user has one
+    password_record: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    # Naive UTC time of the last heartbeat written for the user, see utils/presence.py
+    last_seen: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
     def __repr__(self) -> str:
         """
@@ -110,6 +123,7 @@ class UsersModel(db.Model):
                 user = UsersModel.query.filter_by(username=username).first()
                 if user:
                     db.session.delete(user)
+                    db.session.execute(delete(SSHKeyModel).where(SSHKeyModel.user_id == username))
                     db.session.commit()
         except Exception as e:
             db.session.rollback()
@@ -188,6 +202,28 @@ class UsersModel(db.Model):
             user = UsersModel.query.filter_by(username=username).first()
         return True if user is not None else False
 
+    @staticmethod
+    def set_password_record(app: Flask, username: str, password_record: Optional[str]) -> bool:
+        """
+        Description:
+            Static method to store a user's salted password record.
+
+        Args:
+            app (Flask): The Flask application instance.
+            username (str): The username of the user.
+            password_record (str): The record from encryption_tools.hash_password, or None to
+                                   go back to the server password.
+
+        Returns:
+            bool: True if the user exists.
+        """
+        statement = (update(UsersModel).where(UsersModel.username == username)
+                     .values(password_record=password_record))
+        with app.app_context():
+            result = db.session.execute(statement)
+            db.session.commit()
+        return result.rowcount > 0
+
     @staticmethod
     def set_ssh_key_setup(app: Flask, username: str, ssh_key_setup: bool) -> None:
         """
@@ -238,12 +274,29 @@ class UsersModel(db.Model):
             # TODO: Handle exception
             traceback.print_exc()
 
+    @staticmethod
+    def _username_list(usernames) -> Select:
+        """
+        Description:
+            Builds a subquery yielding the given usernames. The names are bound as a single
+            JSON array parameter expanded by SQLite's json_each, so a statement can target
+            tens of thousands of users without hitting the bound parameter limit.
+
+        Args:
+            usernames: Iterable of usernames.
+
+        Returns:
+            Select: A select of one 'value' column holding the usernames.
+        """
+        names = func.json_each(json.dumps(list(usernames))).table_valued('value')
+        return select(names.c.value)
+
     @staticmethod
     def set_all_users_logged_out(app: Flask) -> NoReturn:
         """
         Description:
             Static method to set the logged_in status to False for all
-            users in the database.
+            users in the database, with a single UPDATE statement.
 
         Args:
             app (Flask): The Flask application instance.
@@ -252,26 +305,266 @@ class UsersModel(db.Model):
             NoReturn
         """
         with app.app_context():
-            # Get all users from the database
-            users = UsersModel.query.all()
+            db.session.execute(update(UsersModel).where(UsersModel.logged_in == True).values(logged_in=False))
+            db.session.commit()
+
+    @staticmethod
+    def set_users_logged_in(app: Flask, usernames, logged_in: bool) -> int:
+        """
+        Description:
+            Static method to set the logged-in status of many users with a single UPDATE
+            statement.
+
+        Args:
+            app (Flask): The Flask application instance.
+            usernames: Iterable of usernames to update.
+            logged_in (bool): The new logged-in status.
 
-            # Update the logged_in status for each user to False
-            for user in users:
-                user.logged_in = False
+        Returns:
+            int: Number of users updated.
+        """
+        with app.app_context():
+            result = db.session.execute(update(UsersModel)
+                                        .where(UsersModel.username.in_(UsersModel._username_list(usernames)))
+                                        .values(logged_in=logged_in))
             db.session.commit()
+        return result.rowcount
+
+    @staticmethod
+    def _is_present(users, cutoff: datetime):
+        """
+        Description:
+            Builds the condition for a user holding a seat: logged in with a heartbeat
+            no older than the cutoff.
+        """
+        return and_(users.logged_in == True, users.last_seen >= cutoff)
+
+    @staticmethod
+    def claim_seat(app: Flask, username: str, capacity: int, now: datetime, cutoff: datetime) -> bool:
+        """
+        Description:
+            Static method to give a user a seat in the chat room if they already hold one or
+            fewer than capacity users do. A single UPDATE checks the seat count and takes the
+            seat, so workers logging users in at the same time cannot overfill the room.
 
+        Args:
+            app (Flask): The Flask application instance.
+            username (str): The username.
+            capacity (int): Maximum number of present users.
+            now (datetime): Heartbeat time to record, naive UTC.
+            cutoff (datetime): Users with an older heartbeat no longer hold a seat.
 
+        Returns:
+            bool: True if the user holds a seat, False if the room is full or the user does not exist.
+        """
+        seated = aliased(UsersModel)
+        seat_count = (select(func.count()).select_from(seated)
+                      .where(UsersModel._is_present(seated, cutoff)).scalar_subquery())
+        with app.app_context():
+            result = db.session.execute(update(UsersModel)
+                                        .where(UsersModel.username == username,
+                                               or_(UsersModel._is_present(UsersModel, cutoff), seat_count < capacity))
+                                        .values(logged_in=True, last_seen=now))
+            db.session.commit()
+        return result.rowcount == 1
+
+    @staticmethod
+    def get_present_users(app: Flask, cutoff: datetime) -> dict:
+        """
+        Description:
+            Static method to get the users holding a seat.
+
+        Args:
+            app (Flask): The Flask application instance.
+            cutoff (datetime): Users with an older heartbeat no longer hold a seat.
+
+        Returns:
+            dict: Username to last heartbeat, naive UTC.
+        """
+        with app.app_context():
+            rows = db.session.execute(select(UsersModel.username, UsersModel.last_seen)
+                                      .where(UsersModel._is_present(UsersModel, cutoff)))
+            return {row.username: row.last_seen for row in rows}
+
+    @staticmethod
+    def set_users_last_seen(app: Flask, last_seen: dict) -> NoReturn:
+        """
+        Description:
+            Static method to record heartbeats of logged-in users in one executemany. A
+            heartbeat never moves a user's time back, and users logged out meanwhile stay
+            logged out.
+
+        Args:
+            app (Flask): The Flask application instance.
+            last_seen (dict): Username to heartbeat time, naive UTC.
+
+        Returns:
+            NoReturn
+        """
+        users = UsersModel.__table__
+        statement = (users.update()
+                     .where(users.c.username == bindparam('b_username'), users.c.logged_in == True,
+                            or_(users.c.last_seen.is_(None), users.c.last_seen < bindparam('b_last_seen')))
+                     .values(last_seen=bindparam('b_last_seen')))
+        with app.app_context():
+            db.session.execute(statement, [{'b_username': username, 'b_last_seen': seen}
+                                           for username, seen in last_seen.items()])
+            db.session.commit()
+
+    @staticmethod
+    def expire_logged_in(app: Flask, cutoff: datetime) -> int:
+        """
+        Description:
+            Static method to log out every user whose last heartbeat is older than the cutoff.
+            Users recorded as logged in without a heartbeat, by a version that did not record
+            them, get one now and so a full TTL to come back.
+
+        Args:
+            app (Flask): The Flask application instance.
+            cutoff (datetime): Users with an older heartbeat are logged out.
+
+        Returns:
+            int: Number of users logged out.
+        """
+        with app.app_context():
+            db.session.execute(update(UsersModel)
+                               .where(UsersModel.logged_in == True, UsersModel.last_seen.is_(None))
+                               .values(last_seen=datetime.utcnow()))
+            result = db.session.execute(update(UsersModel)
+                                        .where(UsersModel.logged_in == True, UsersModel.last_seen < cutoff)
+                                        .values(logged_in=False))
+            db.session.commit()
+        return result.rowcount
+
+    @staticmethod
+    def add_users(app: Flask, usernames) -> int:
+        """
+        Description:
+            Static method to create many users with a single INSERT statement. Usernames that
+            already exist, or repeat within the list, are skipped.
+
+        Args:
+            app (Flask): The Flask application instance.
+            usernames: Iterable of usernames to create.
+
+        Returns:
+            int: Number of users created.
+        """
+        names = UsersModel._username_list(usernames).subquery()
+        # SQLite needs a WHERE clause to parse INSERT ... SELECT ... ON CONFLICT
+        statement = (sqlite_insert(UsersModel)
+                     .from_select(['username', 'logged_in', 'ssh_key_setup'],
+                                  select(names.c.value, literal(False), literal(False)).where(true()))
+                     .on_conflict_do_nothing(index_elements=['username']))
+        with app.app_context():
+            result = db.session.execute(statement)
+            db.session.commit()
+        return result.rowcount
+
+    @staticmethod
+    def remove_users(app: Flask, usernames) -> int:
+        """
+        Description:
+            Static method to delete many users with a single DELETE statement.
+
+        Args:
+            app (Flask): The Flask application instance.
+            usernames: Iterable of usernames to delete.
+
+        Returns:
+            int: Number of users deleted.
+        """
+        usernames = list(usernames)
+        with app.app_context():
+            result = db.session.execute(delete(UsersModel)
+                                        .where(UsersModel.username.in_(UsersModel._username_list(usernames)))
+                                        .execution_options(synchronize_session=False))
+            db.session.execute(delete(SSHKeyModel)
+                               .where(SSHKeyModel.user_id.in_(UsersModel._username_list(usernames)))
+                               .execution_options(synchronize_session=False))
+            db.session.commit()
+        return result.rowcount
+
+    @staticmethod
+    def export_users(app: Flask) -> list:
+        """
+        Description:
+            Static method to export every user with a single SELECT statement.
+
+        Args:
+            app (Flask): The Flask application instance.
+
+        Returns:
+            list: Dictionaries with username, logged_in and ssh_key_setup, ordered by username.
+        """
+        with app.app_context():
+            rows = db.session.execute(select(UsersModel.username, UsersModel.logged_in, UsersModel.ssh_key_setup)
+                                      .order_by(UsersModel.username)).all()
+        return [{'username': row.username, 'logged_in': bool(row.logged_in),
+                 'ssh_key_setup': bool(row.ssh_key_setup)} for row in rows]
+
+
+class MessageRecord(NamedTuple):
+    """
+    Plain copy of a stored chat message, independent of any database session.
+    """
+    id: int
+    user_id: str
+    message: str
+    timestamp: datetime
+    encrypted: bool
+    attachment_id: Optional[int] = None
+
+
+class AttachmentRecord(NamedTuple):
+    """
+    Plain copy of a stored attachment's metadata.
+    """
+    id: int
+    digest: str
+    filename: str
+    content_type: str
+    size: int
+
+
+class SSHKeyRecord(NamedTuple):
+    """
+    Plain copy of an uploaded SSH public key's details.
+    """
+    fingerprint: str
+    key_type: str
+    comment: str
+    verified: bool
+    created: datetime
+
+
+@trace_static_methods
 class ChatModel(db.Model):
     """
     SQLAlchemy model for storing chat information.
     """
     __tablename__ = "chat"
+    SEARCH_TABLE_NAME = "chat_fts"
+    MAX_IDEMPOTENCY_KEY_LENGTH = 64
+    # Idempotency keys of replicated messages start with this, clients may not use it
+    REPLICATED_KEY_PREFIX = 'replicated:'
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(ServerConfig.max_username_length()),
                         nullable=False)
     message = db.Column(db.String(ServerConfig.max_message_length()), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     encrypted = db.Column(db.Boolean, default=False)
+    # Client-supplied key so retried submissions never create duplicate rows
+    idempotency_key = db.Column(db.String(MAX_IDEMPOTENCY_KEY_LENGTH), nullable=True)
+    # AttachmentModel id of a file shared with this message
+    attachment_id = db.Column(db.Integer, nullable=True)
+
+    # Keys are unique per user, two users may pick the same key. Ids are never reused, even
+    # after retention deletes the row with the highest id, since clients and peers use them
+    # as cursors.
+    __table_args__ = (db.Index('ix_chat_user_idempotency_key', 'user_id', 'idempotency_key', unique=True),
+                      db.Index('ix_chat_attachment_id', 'attachment_id'),
+                      {'sqlite_autoincrement': True})
 
     def __repr__(self):
         """
@@ -287,6 +580,22 @@ class ChatModel(db.Model):
         msg_snippet = "encrypted" if self.encrypted else msg_snippet
         return f'<Chat {self.id} - User {self.user_id} - {self.timestamp}: "{msg_snippet}">'
 
+    @staticmethod
+    def is_valid_idempotency_key(key) -> bool:
+        """
+        Description:
+            Checks an idempotency key sent by a client: a string that fits the column and
+            is outside the namespace reserved for replicated messages.
+
+        Args:
+            key: The key.
+
+        Returns:
+            bool: True if the key may be stored.
+        """
+        return (isinstance(key, str) and len(key) <= ChatModel.MAX_IDEMPOTENCY_KEY_LENGTH and
+                not key.startswith(ChatModel.REPLICATED_KEY_PREFIX))
+
     @staticmethod
     def check_and_remove_oldest_message(app: Flask):
         """
@@ -317,11 +626,674 @@ class ChatModel(db.Model):
             encrypted_flag (bool): Indicates whether the message is encrypted.
         """
         with app.app_context():
-            ChatModel.check_and_remove_oldest_message(app)
             new_message = ChatModel(user_id=user_id, message=message_content, encrypted=encrypted_flag)
             db.session.add(new_message)
+            db.session.flush()
+
+            # Trim in the same transaction so concurrent writers never delete the same row twice
+            ChatModel.trim_to_limit()
+            db.session.commit()
+
+    @staticmethod
+    def trim_to_limit(limit: Optional[int] = None) -> int:
+        """
+        Description:
+            Deletes every message beyond the newest limit messages in a single statement.
+            Must be called inside an application context; the caller commits.
+
+        Args:
+            limit (int): Number of messages to keep, max_message_count by default.
+
+        Returns:
+            int: Number of messages deleted.
+        """
+        stale_ids = (select(ChatModel.id)
+                     .order_by(ChatModel.timestamp.desc(), ChatModel.id.desc())
+                     .offset(ServerConfig.max_message_count() if limit is None else limit))
+        result = db.session.execute(delete(ChatModel).where(ChatModel.id.in_(stale_ids))
+                                    .execution_options(synchronize_session=False))
+        return result.rowcount
+
+    @staticmethod
+    def add_new_messages(app: Flask, messages: list, limit: Optional[int] = None, replicate: bool = False) -> tuple:
+        """
+        Description:
+            Adds several messages in one transaction with a single executemany insert and a
+            single retention pass, so the batch pays for one commit instead of one per message.
+            A message whose idempotency key is already stored for the same user, or repeated
+            by that user earlier in the same batch, is not inserted again; the stored message
+            is returned for it instead.
+
+        Args:
+            app (Flask): The Flask application instance.
+            messages (list): Dictionaries with 'user_id', 'message' and 'encrypted' keys and
+                             optional 'timestamp' (naive UTC datetime, defaults to now) and
+                             'idempotency_key' keys.
+            limit (int): Number of messages to keep, max_message_count by default.
+            replicate (bool): Also append the inserted messages to the replication log, in
+                              the same transaction.
+
+        Returns:
+            tuple: (list of MessageRecord in the same order as messages, id of the newest
+                    message in the table after the commit)
+        """
+        if not messages:
+            return [], None
+
+        now = datetime.utcnow()
+        for attempt in range(2):
+            with app.app_context():
+                try:
+                    records, head = ChatModel._insert_batch(messages, now, limit, replicate)
+                    db.session.commit()
+                    return records, head
+                except IntegrityError:
+                    # Another request committed one of the idempotency keys first, the retry finds it
+                    db.session.rollback()
+                    if attempt:
+                        raise
+                except Exception:
+                    db.session.rollback()
+                    raise
+
+    @staticmethod
+    def _insert_batch(messages: list, now: datetime, limit: Optional[int] = None, replicate: bool = False) -> tuple:
+        """
+        Description:
+            Inserts a batch inside the caller's transaction. See add_new_messages.
+
+        Args:
+            messages (list): The messages to add.
+            now (datetime): Timestamp for messages that do not carry one.
+            limit (int): Number of messages to keep, max_message_count by default.
+            replicate (bool): Also append the inserted messages to the replication log.
+
+        Returns:
+            tuple: (list of MessageRecord, id of the newest message in the table)
+        """
+        # Idempotency keys are scoped to the user who sent them
+        keys = {message.get('idempotency_key') for message in messages} - {None}
+        stored = {}
+        if keys:
+            rows = db.session.execute(select(ChatModel.id, ChatModel.user_id, ChatModel.message, ChatModel.timestamp,
+                                             ChatModel.encrypted, ChatModel.attachment_id, ChatModel.idempotency_key)
+                                      .where(ChatModel.idempotency_key.in_(keys)))
+            stored = {(row.user_id, row.idempotency_key): MessageRecord(*row[:6]) for row in rows}
+
+        # Each message maps to a stored record or to the position of its row in new_rows
+        new_rows, targets, batch_keys = [], [], {}
+        for message in messages:
+            idempotency_key = message.get('idempotency_key')
+            key = None if idempotency_key is None else (message['user_id'], idempotency_key)
+            if key in stored:
+                targets.append(stored[key])
+            elif key is not None and key in batch_keys:
+                targets.append(batch_keys[key])
+            else:
+                if key is not None:
+                    batch_keys[key] = len(new_rows)
+                targets.append(len(new_rows))
+                new_rows.append({'user_id': message['user_id'], 'message': message['message'],
+                                 'encrypted': bool(message['encrypted']),
+                                 'timestamp': message.get('timestamp') or now, 'idempotency_key': idempotency_key,
+                                 'attachment_id': message.get('attachment_id')})
+
+        new_ids = []
+        if new_rows:
+            new_ids = db.session.scalars(insert(ChatModel).returning(ChatModel.id, sort_by_parameter_order=True),
+                                         new_rows).all()
+            if replicate:
+                ReplicationLogModel.append_entries(new_rows, limit)
+
+        head = db.session.execute(select(func.max(ChatModel.id))).scalar()
+        if new_rows:
+            ChatModel.trim_to_limit(limit)
+
+        records = []
+        for target in targets:
+            if isinstance(target, MessageRecord):
+                records.append(target)
+            else:
+                row = new_rows[target]
+                records.append(MessageRecord(new_ids[target], row['user_id'], row['message'],
+                                             row['timestamp'], row['encrypted'], row['attachment_id']))
+        return records, head
+
+    @staticmethod
+    def apply_replicated(app: Flask, origin: str, entries: list, limit: Optional[int] = None) -> int:
+        """
+        Description:
+            Applies replication log entries shipped from another node, and records the last
+            applied sequence number in the same transaction, so a follower that stops at any
+            point resumes exactly after the last entry it stored. Entries are inserted under
+            their idempotency key, so a client retry that reached both nodes is stored once.
+            Entries without one get a key in the replicated namespace, derived from the
+            origin, sequence number and timestamp, so an entry applied twice is stored once
+            while the entries of a peer whose log restarted after a reset are not mistaken
+            for the old ones.
+
+        Args:
+            app (Flask): The Flask application instance.
+            origin (str): Node id of the node the entries were written on.
+            entries (list): Entries from ReplicationLogModel.read_entries, in sequence order.
+            limit (int): Number of messages to keep, max_message_count by default.
+
+        Returns:
+            int: Sequence number of the last applied entry.
+        """
+        messages = [{'user_id': entry['user_id'], 'message': entry['message'], 'encrypted': entry['encrypted'],
+                     'timestamp': datetime.fromisoformat(entry['timestamp']),
+                     'idempotency_key': entry['idempotency_key'] or ChatModel._replicated_key(origin, entry)}
+                    for entry in entries]
+        last_seq = entries[-1]['seq']
+        progress = (sqlite_insert(ReplicationPeerModel).values(origin=origin, last_seq=last_seq)
+                    .on_conflict_do_update(index_elements=['origin'], set_={'last_seq': last_seq}))
+        now = datetime.utcnow()
+        for attempt in range(2):
+            with app.app_context():
+                try:
+                    ChatModel._insert_batch(messages, now, limit)
+                    db.session.execute(progress)
+                    db.session.commit()
+                    return last_seq
+                except IntegrityError:
+                    # A local write committed one of the idempotency keys first, the retry finds it
+                    db.session.rollback()
+                    if attempt:
+                        raise
+                except Exception:
+                    db.session.rollback()
+                    raise
+
+    @staticmethod
+    def _replicated_key(origin: str, entry: dict) -> str:
+        digest = hashlib.sha256(f"{origin}\0{entry['seq']}\0{entry['timestamp']}".encode('utf-8')).hexdigest()
+        return ChatModel.REPLICATED_KEY_PREFIX + digest[:32]
+
+    @staticmethod
+    def create_search_index(app: Flask) -> NoReturn:
+        """
+        Description:
+            Creates the SQLite FTS5 full-text index over the chat table along with the
+            triggers that keep it in sync on insert, update and delete. Only unencrypted
+            messages are indexed. Existing unencrypted messages are indexed the first
+            time the index is created. Does nothing on non-SQLite databases.
+
+        Args:
+            app (Flask): The Flask application instance.
+
+        Returns:
+            NoReturn
+        """
+        with app.app_context():
+            if db.engine.dialect.name != 'sqlite':
+                return
+
+            index_exists = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': ChatModel.SEARCH_TABLE_NAME}).first() is not None
+
+            # External content table, the message text itself is only stored in 'chat'
+            db.session.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5("
+                "message, content='chat', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"))
+
+            # Encrypted rows are never added, so they must never be removed either
+            db.session.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS chat_fts_insert AFTER INSERT ON chat "
+                "WHEN new.encrypted = 0 BEGIN "
+                "INSERT INTO chat_fts(rowid, message) VALUES (new.id, new.message); "
+                "END"))
+            db.session.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS chat_fts_delete AFTER DELETE ON chat "
+                "WHEN old.encrypted = 0 BEGIN "
+                "INSERT INTO chat_fts(chat_fts, rowid, message) VALUES ('delete', old.id, old.message); "
+                "END"))
+            db.session.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS chat_fts_update AFTER UPDATE OF message, encrypted ON chat BEGIN "
+                "INSERT INTO chat_fts(chat_fts, rowid, message) "
+                "SELECT 'delete', old.id, old.message WHERE old.encrypted = 0; "
+                "INSERT INTO chat_fts(rowid, message) SELECT new.id, new.message WHERE new.encrypted = 0; "
+                "END"))
+
+            if not index_exists:
+                db.session.execute(text(
+                    "INSERT INTO chat_fts(rowid, message) SELECT id, message FROM chat WHERE encrypted = 0"))
             db.session.commit()
 
+    @staticmethod
+    def _build_match_expression(query: str) -> str:
+        """
+        Description:
+            Converts free text from the user into an FTS5 MATCH expression. Every term is
+            quoted so FTS5 operators in the input are treated as plain text, and all terms
+            must be present in a matching message.
+
+        Args:
+            query (str): The raw search text.
+
+        Returns:
+            str: The MATCH expression, empty if the query has no terms.
+        """
+        terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+        return ' '.join(terms)
+
+    @staticmethod
+    def search_messages(app: Flask, query: str, page: int = 1, per_page: int = 20) -> tuple:
+        """
+        Description:
+            Searches the unencrypted chat messages using the FTS5 index. Results are
+            ranked by bm25 relevance, best match first.
+
+        Args:
+            app (Flask): The Flask application instance.
+            query (str): The raw search text.
+            page (int): 1-based page number.
+            per_page (int): Number of results per page.
+
+        Returns:
+            tuple: (list of result dictionaries, bool indicating whether more pages exist)
+        """
+        match_expression = ChatModel._build_match_expression(query)
+        if not match_expression:
+            return [], False
+
+        # Rank and paginate inside the FTS table first, then join only the page of hits
+        statement = text(
+            "SELECT chat.id, chat.user_id, chat.message, chat.timestamp, hits.rank "
+            "FROM (SELECT rowid, rank FROM chat_fts WHERE chat_fts MATCH :match "
+            "      ORDER BY rank LIMIT :limit OFFSET :offset) AS hits "
+            "JOIN chat ON chat.id = hits.rowid "
+            "ORDER BY hits.rank")
+
+        with app.app_context():
+            rows = db.session.execute(statement, {'match': match_expression,
+                                                  'limit': per_page + 1,
+                                                  'offset': (page - 1) * per_page}).all()
+
+        results = []
+        for row in rows[:per_page]:
+            # Raw SQL returns the stored timestamp string rather than a datetime
+            timestamp = row.timestamp
+            if isinstance(timestamp, str):
+                timestamp = datetime.fromisoformat(timestamp)
+            results.append({'id': row.id, 'user_id': row.user_id, 'message': row.message,
+                            'timestamp': timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+                            'rank': row.rank})
+        return results, len(rows) > per_page
+
+
+@trace_static_methods
+class AttachmentModel(db.Model):
+    """
+    SQLAlchemy model for files shared in the chat. The content lives on disk under its
+    SHA-256 digest (see database/attachment_store.py), so identical uploads share one file.
+    """
+    __tablename__ = "attachments"
+    MAX_FILENAME_LENGTH = 255
+    id = db.Column(db.Integer, primary_key=True)
+    digest = db.Column(db.String(64), nullable=False, index=True)
+    filename = db.Column(db.String(MAX_FILENAME_LENGTH), nullable=False)
+    content_type = db.Column(db.String(127), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.String(ServerConfig.max_username_length()), nullable=False)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def add_attachment(app: Flask, digest: str, filename: str, content_type: str, size: int, user_id: str) -> int:
+        """
+        Description:
+            Static method to record an uploaded attachment.
+
+        Args:
+            app (Flask): The Flask application instance.
+            digest (str): SHA-256 hex digest of the content.
+            filename (str): Name of the file as uploaded.
+            content_type (str): Media type of the file.
+            size (int): Size in bytes.
+            user_id (str): Username of the uploader.
+
+        Returns:
+            int: The attachment id.
+        """
+        with app.app_context():
+            result = db.session.execute(insert(AttachmentModel).values(
+                digest=digest, filename=filename[:AttachmentModel.MAX_FILENAME_LENGTH], content_type=content_type,
+                size=size, user_id=user_id, created=datetime.utcnow()))
+            db.session.commit()
+        return result.inserted_primary_key[0]
+
+    @staticmethod
+    def get_attachment(app: Flask, attachment_id: int) -> Optional[AttachmentRecord]:
+        """
+        Description:
+            Static method to look up an attachment's metadata.
+
+        Args:
+            app (Flask): The Flask application instance.
+            attachment_id (int): The attachment id.
+
+        Returns:
+            AttachmentRecord or None: The attachment, None if there is none with this id.
+        """
+        statement = select(AttachmentModel.id, AttachmentModel.digest, AttachmentModel.filename,
+                           AttachmentModel.content_type, AttachmentModel.size).where(AttachmentModel.id == attachment_id)
+        with app.app_context():
+            row = db.session.execute(statement).first()
+        return AttachmentRecord(*row) if row is not None else None
+
+    @staticmethod
+    def remove_unreferenced(app: Flask, created_before: datetime) -> set:
+        """
+        Description:
+            Static method to delete the attachments no chat message refers to any more, for
+            example because retention removed their message. Attachments created after
+            created_before are kept, their message may not be stored yet.
+
+        Args:
+            app (Flask): The Flask application instance.
+            created_before (datetime): Only attachments created before this time are removed.
+
+        Returns:
+            set: Digests that no attachment refers to any more, their files can be deleted.
+        """
+        referenced = select(ChatModel.attachment_id).where(ChatModel.attachment_id.is_not(None))
+        unreferenced = (AttachmentModel.created < created_before) & AttachmentModel.id.not_in(referenced)
+        with app.app_context():
+            digests = set(db.session.execute(select(AttachmentModel.digest).where(unreferenced)).scalars())
+            db.session.execute(delete(AttachmentModel).where(unreferenced))
+            digests -= set(db.session.execute(select(AttachmentModel.digest)
+                                              .where(AttachmentModel.digest.in_(digests))).scalars())
+            db.session.commit()
+        return digests
+
+
+@trace_static_methods
+class SSHKeyModel(db.Model):
+    """
+    SQLAlchemy model for users' SSH public keys, looked up by their unique fingerprint.
+    """
+    __tablename__ = "ssh_keys"
+    MAX_COMMENT_LENGTH = 255
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(ServerConfig.max_username_length()), nullable=False, index=True)
+    key_type = db.Column(db.String(32), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    public_key = db.Column(db.Text, nullable=False)
+    comment = db.Column(db.String(MAX_COMMENT_LENGTH), nullable=False, default='')
+    # Set once the user has signed a challenge with the matching private key
+    verified = db.Column(db.Boolean, nullable=False, default=False)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def add_key(app: Flask, username: str, key_type: str, fingerprint: str, public_key: str, comment: str) -> bool:
+        """
+        Description:
+            Static method to store an uploaded public key, not yet verified.
+
+        Args:
+            app (Flask): The Flask application instance.
+            username (str): Owner of the key.
+            key_type (str): The key type, such as 'ssh-ed25519'.
+            fingerprint (str): The SHA-256 fingerprint.
+            public_key (str): The key as 'key-type base64-key'.
+            comment (str): The key comment.
+
+        Returns:
+            bool: False if a key with this fingerprint is already stored.
+        """
+        with app.app_context():
+            try:
+                db.session.execute(insert(SSHKeyModel).values(
+                    user_id=username, key_type=key_type, fingerprint=fingerprint, public_key=public_key,
+                    comment=comment[:SSHKeyModel.MAX_COMMENT_LENGTH], verified=False, created=datetime.utcnow()))
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                return False
+        return True
+
+    @staticmethod
+    def get_key(app: Flask, fingerprint: str) -> Optional[tuple]:
+        """
+        Description:
+            Static method to look a key up by fingerprint.
+
+        Args:
+            app (Flask): The Flask application instance.
+            fingerprint (str): The SHA-256 fingerprint.
+
+        Returns:
+            tuple or None: (username, public key text), None if no key has this fingerprint.
+        """
+        with app.app_context():
+            row = db.session.execute(select(SSHKeyModel.user_id, SSHKeyModel.public_key)
+                                     .where(SSHKeyModel.fingerprint == fingerprint)).first()
+        return tuple(row) if row is not None else None
+
+    @staticmethod
+    def get_user_keys(app: Flask, username: str) -> list:
+        """
+        Description:
+            Static method to list a user's keys.
+
+        Args:
+            app (Flask): The Flask application instance.
+            username (str): The owner.
+
+        Returns:
+            list: SSHKeyRecord for each key, oldest first.
+        """
+        with app.app_context():
+            rows = db.session.execute(select(SSHKeyModel.fingerprint, SSHKeyModel.key_type, SSHKeyModel.comment,
+                                             SSHKeyModel.verified, SSHKeyModel.created)
+                                      .where(SSHKeyModel.user_id == username).order_by(SSHKeyModel.id)).all()
+        return [SSHKeyRecord(row[0], row[1], row[2], bool(row[3]), row[4]) for row in rows]
+
+    @staticmethod
+    def set_verified(app: Flask, username: str, fingerprint: str) -> NoReturn:
+        """
+        Description:
+            Static method to mark a key as verified, which also marks its owner as having
+            set up SSH.
+
+        Args:
+            app (Flask): The Flask application instance.
+            username (str): The owner.
+            fingerprint (str): The SHA-256 fingerprint.
+
+        Returns:
+            NoReturn
+        """
+        with app.app_context():
+            db.session.execute(update(SSHKeyModel).where(SSHKeyModel.fingerprint == fingerprint,
+                                                         SSHKeyModel.user_id == username).values(verified=True))
+            db.session.execute(update(UsersModel).where(UsersModel.username == username).values(ssh_key_setup=True))
+            db.session.commit()
+
+    @staticmethod
+    def remove_key(app: Flask, username: str, fingerprint: str) -> bool:
+        """
+        Description:
+            Static method to delete one of a user's keys. The user is no longer marked as
+            having set up SSH once no verified key is left.
+
+        Args:
+            app (Flask): The Flask application instance.
+            username (str): The owner.
+            fingerprint (str): The SHA-256 fingerprint.
+
+        Returns:
+            bool: True if the key was deleted.
+        """
+        with app.app_context():
+            result = db.session.execute(delete(SSHKeyModel).where(SSHKeyModel.fingerprint == fingerprint,
+                                                                  SSHKeyModel.user_id == username))
+            verified_left = db.session.execute(select(SSHKeyModel.id).where(SSHKeyModel.user_id == username,
+                                                                            SSHKeyModel.verified == True)).first()
+            if verified_left is None:
+                db.session.execute(update(UsersModel).where(UsersModel.username == username)
+                                   .values(ssh_key_setup=False))
+            db.session.commit()
+        return result.rowcount > 0
+
+
+@trace_static_methods
+class ReplicationLogModel(db.Model):
+    """
+    SQLAlchemy model for the replication log: every chat message written on this node, in
+    commit order under an increasing sequence number, for peers to copy.
+    """
+    __tablename__ = "replication_log"
+    seq = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(ServerConfig.max_username_length()), nullable=False)
+    message = db.Column(db.String(ServerConfig.max_message_length()), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    encrypted = db.Column(db.Boolean, nullable=False)
+    idempotency_key = db.Column(db.String(ChatModel.MAX_IDEMPOTENCY_KEY_LENGTH), nullable=True)
+
+    @staticmethod
+    def append_entries(rows: list, limit: Optional[int] = None) -> NoReturn:
+        """
+        Description:
+            Appends newly inserted chat rows to the log inside the caller's transaction, and
+            drops entries beyond the newest limit. Older entries describe messages retention
+            has removed already, a peer that far behind only misses those.
+
+        Args:
+            rows (list): Row dictionaries as inserted into ChatModel.
+            limit (int): Number of entries to keep, max_message_count by default.
+
+        Returns:
+            NoReturn
+        """
+        db.session.execute(insert(ReplicationLogModel), [
+            {'user_id': row['user_id'], 'message': row['message'], 'timestamp': row['timestamp'],
+             'encrypted': row['encrypted'], 'idempotency_key': row['idempotency_key']} for row in rows])
+        head = db.session.execute(select(func.max(ReplicationLogModel.seq))).scalar()
+        keep = ServerConfig.max_message_count() if limit is None else limit
+        db.session.execute(delete(ReplicationLogModel).where(ReplicationLogModel.seq <= head - keep))
+
+    @staticmethod
+    def read_entries(app: Flask, after: int, limit: int) -> tuple:
+        """
+        Description:
+            Static method to read log entries after a sequence number.
+
+        Args:
+            app (Flask): The Flask application instance.
+            after (int): Sequence number of the last entry the reader has.
+            limit (int): Largest number of entries returned.
+
+        Returns:
+            tuple: (list of entry dictionaries with ISO 8601 timestamps, sequence number of
+                    the newest entry or 0)
+        """
+        statement = (select(ReplicationLogModel.seq, ReplicationLogModel.user_id, ReplicationLogModel.message,
+                            ReplicationLogModel.timestamp, ReplicationLogModel.encrypted,
+                            ReplicationLogModel.idempotency_key)
+                     .where(ReplicationLogModel.seq > after).order_by(ReplicationLogModel.seq).limit(limit))
+        with app.app_context():
+            rows = db.session.execute(statement).all()
+            head = db.session.execute(select(func.max(ReplicationLogModel.seq))).scalar() or 0
+        entries = [{'seq': row.seq, 'user_id': row.user_id, 'message': row.message,
+                    'timestamp': row.timestamp.isoformat(), 'encrypted': bool(row.encrypted),
+                    'idempotency_key': row.idempotency_key} for row in rows]
+        return entries, head
+
+
+class ReplicationPeerModel(db.Model):
+    """
+    SQLAlchemy model for replication progress: the last sequence number applied from each
+    origin node.
+    """
+    __tablename__ = "replication_peers"
+    origin = db.Column(db.String(64), primary_key=True)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def get_last_seq(app: Flask, origin: str) -> int:
+        """
+        Description:
+            Static method to get the replication progress for an origin node.
+
+        Args:
+            app (Flask): The Flask application instance.
+            origin (str): The origin node id.
+
+        Returns:
+            int: Sequence number of the last applied entry, 0 if none was applied.
+        """
+        with app.app_context():
+            last_seq = db.session.execute(select(ReplicationPeerModel.last_seq)
+                                          .where(ReplicationPeerModel.origin == origin)).scalar()
+        return last_seq or 0
+
+
+def _rebuild_table(connection, inspector, table) -> NoReturn:
+    """
+    Description:
+        Recreates an SQLite table from its model definition and copies the rows over with
+        their ids, since SQLite cannot change a primary key in place. Triggers on the old
+        table are dropped with it; create_search_index recreates the search triggers.
+        With AUTOINCREMENT the id sequence starts after the highest copied id.
+
+    Args:
+        connection (Connection): Connection inside the upgrade transaction.
+        inspector (Inspector): Inspector for the connection.
+        table (Table): The model's table.
+
+    Returns:
+        NoReturn
+    """
+    old_name = f'{table.name}_rebuild'
+    for index in inspector.get_indexes(table.name):
+        connection.execute(text(f'DROP INDEX {index["name"]}'))
+    connection.execute(text(f'ALTER TABLE {table.name} RENAME TO {old_name}'))
+    table.create(connection)
+    columns = ', '.join(column.name for column in table.columns)
+    connection.execute(text(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old_name}'))
+    connection.execute(text(f'DROP TABLE {old_name}'))
+
+
+def upgrade_schema(app: Flask) -> NoReturn:
+    """
+    Description:
+        Brings an existing database up to date with the models. db.create_all() only creates
+        missing tables, so columns and indexes added to a model after its table was created
+        are added here. New columns must be nullable. SQLite tables that must never reuse
+        ids but were created without AUTOINCREMENT are rebuilt with it, keeping their rows.
+
+    Args:
+        app (Flask): The Flask application instance.
+
+    Returns:
+        NoReturn
+    """
+    with app.app_context():
+        with db.engine.begin() as connection:
+            inspector = inspect(connection)
+            for table in db.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+
+                existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing_columns:
+                        column_type = column.type.compile(dialect=connection.dialect)
+                        connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+                if connection.dialect.name == 'sqlite' and table.dialect_options['sqlite']['autoincrement']:
+                    create_statement = connection.execute(
+                        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                        {'name': table.name}).scalar()
+                    if 'AUTOINCREMENT' not in create_statement.upper():
+                        _rebuild_table(connection, inspector, table)
+                        continue
+
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+
 
 if __name__ == '__main__':
     # Example usage for ServerConfig class
@@ -412,6 +1384,12 @@ if __name__ == '__main__':
             print(f"Is Encrypted: {message.encrypted}")
             print()
 
+    # Full-text search over the unencrypted messages
+    ChatModel.create_search_index(app)
+    ChatModel.add_new_message(app, user_id, "Searchable hello", False)
+    results, has_more = ChatModel.search_messages(app, "hello")
+    print(f"Search for 'hello' returned {len(results)} result(s): {results}")
+
     # Show message count control
     exceed_value = 20
     for i in range(ServerConfig.max_message_count() + exceed_value):
@@ -0,0 +1,350 @@
+"""
+Author: Eric Thomas
+Project: Secure Chat Server
+Group: A
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Chat Message Replication
+
+This module replicates chat messages between Secure Chat Server nodes by log shipping.
+Every node with a CHAT_REPLICATION_NODE_ID:
+
+- appends the chat messages written on it to the replication_log table under an
+  increasing sequence number, in the same transaction as the messages themselves;
+- serves its log at GET /replication/log?after=<seq>&limit=<n>, guarded by the shared
+  CHAT_REPLICATION_TOKEN;
+- pulls the log of every node in CHAT_REPLICATION_PEERS ({node id: base URL}) from a
+  follower thread per peer, and applies the entries with ChatModel.apply_replicated.
+
+A follower resumes after the last sequence number it applied from that node, which is
+stored with the applied messages, so restarts and network failures neither lose nor
+duplicate messages. A peer whose log ends before that number had its database reset and
+is followed again from the start.
+
+The followers start on the first request a worker serves, so nodes run by a WSGI server
+from app:create_app() follow their peers as well. Only one process per node runs them:
+the worker that takes an exclusive lock on CHAT_REPLICATION_LOCK_FILE (by default
+database/replication-<node id>.lock). The others retry the lock every LOCK_RETRY_INTERVAL
+seconds and take over if that worker exits. Nodes only ship their own writes, so every node lists every other
+node as a peer. Message ids stay local to each node; clients polling a node see the
+replicated messages arrive like local ones. Only the 'sqlalchemy' message store
+replicates. Attachments are not replicated; on a peer the message shows the file name.
+
+Usage:
+    python database/replication.py      # two nodes on localhost replicating both ways
+=======================================================
+"""
+
+import fcntl
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+import urllib.request
+from flask import Flask, Response, abort, jsonify, request
+from typing import NoReturn, Optional
+
+# append system path when run as a script, the application already has the project root on it
+if __package__ in (None, ''):
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# autopep8: off
+from database.models import ChatModel, ReplicationLogModel, ReplicationPeerModel
+# autopep8: on
+
+TOKEN_HEADER = 'X-Chat-Replication-Token'
+
+
+class ReplicationFollower:
+    """
+    Pulls the replication log of one peer node from a background thread and applies it.
+    """
+
+    DEFAULT_BATCH_SIZE = 500
+    DEFAULT_INTERVAL = 1.0
+    MAX_BACKOFF = 30.0
+    TIMEOUT = 10.0
+
+    def __init__(self, app: Flask, origin: str, url: str, token: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                 interval: float = DEFAULT_INTERVAL) -> NoReturn:
+        """
+        Initialize the ReplicationFollower instance.
+
+        Args:
+            app (Flask): The Flask application instance the entries are applied to.
+            origin (str): Node id of the peer.
+            url (str): Base URL of the peer, such as 'http://10.0.0.2:5000'.
+            token (str): Shared replication token.
+            batch_size (int): Entries requested per pull.
+            interval (float): Seconds between pulls once caught up.
+
+        Returns:
+            NoReturn
+        """
+        self.app = app
+        self.origin = origin
+        self.url = url.rstrip('/')
+        self.token = token
+        self.batch_size = batch_size
+        self.interval = interval
+        self.last_seq = None
+        self.peer_head = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def fetch(self, after: int) -> dict:
+        """
+        Requests log entries from the peer.
+
+        Args:
+            after (int): Sequence number of the last applied entry.
+
+        Returns:
+            dict: The peer's response, with 'node', 'entries' and 'head'.
+
+        Raises:
+            OSError: If the peer cannot be reached or answers with an error.
+            ValueError: If the peer is not the configured node.
+        """
+        query = urllib.parse.urlencode({'after': after, 'limit': self.batch_size})
+        pull = urllib.request.Request(f"{self.url}/replication/log?{query}", headers={TOKEN_HEADER: self.token})
+        with urllib.request.urlopen(pull, timeout=self.TIMEOUT) as response:
+            body = json.load(response)
+        if body.get('node') != self.origin:
+            raise ValueError(f"{self.url} is node {body.get('node')!r}, expected {self.origin!r}")
+        return body
+
+    def pull_once(self) -> int:
+        """
+        Pulls and applies one batch.
+
+        Returns:
+            int: Number of entries applied.
+        """
+        if self.last_seq is None:
+            self.last_seq = ReplicationPeerModel.get_last_seq(self.app, self.origin)
+        body = self.fetch(self.last_seq)
+        if body['head'] < self.last_seq:
+            print(f"Replication from {self.origin}: its log ends at {body['head']}, before the "
+                  f"{self.last_seq} entries already applied. Its database was reset, following it from the start")
+            self.last_seq = 0
+            body = self.fetch(self.last_seq)
+        entries = body['entries']
+        self.peer_head = body['head']
+        if not entries:
+            return 0
+        if entries[0]['seq'] > self.last_seq + 1:
+            print(f"Replication from {self.origin}: entries {self.last_seq + 1}-{entries[0]['seq'] - 1} "
+                  f"are no longer logged, their messages are past retention")
+        store = self.app.extensions['chat_server'].message_store
+        self.last_seq = ChatModel.apply_replicated(self.app, self.origin, entries, store.max_messages)
+        return len(entries)
+
+    def _run(self) -> NoReturn:
+        delay = self.interval
+        while not self._stopped.is_set():
+            try:
+                applied = self.pull_once()
+                delay = 0 if applied >= self.batch_size else self.interval
+            except (OSError, ValueError) as e:
+                print(f"Replication from {self.origin} ({self.url}) failed: {e}")
+                delay = min(max(delay, self.interval) * 2, self.MAX_BACKOFF)
+            except Exception:
+                traceback.print_exc()
+                delay = self.MAX_BACKOFF
+            self._stopped.wait(delay)
+
+    def start(self) -> NoReturn:
+        """
+        Start pulling from the peer.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=f'chat-replication-{self.origin}', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> NoReturn:
+        """
+        Stop pulling from the peer.
+        """
+        self._stopped.set()
+
+
+class Replication:
+    """
+    Serves this node's replication log and follows its peers, see the module description.
+    """
+
+    MAX_BATCH_SIZE = 5000
+    DEFAULT_LOCK_DIR = os.path.dirname(os.path.abspath(__file__))
+    # Seconds between attempts of the other workers to take over following the peers
+    LOCK_RETRY_INTERVAL = 30.0
+
+    def __init__(self, app: Optional[Flask] = None) -> NoReturn:
+        """
+        Initialize the Replication instance.
+
+        Args:
+            app (Flask): Optional Flask application to initialize immediately.
+
+        Returns:
+            NoReturn
+        """
+        self.app = None
+        self.node_id = None
+        self.token = None
+        self.followers = []
+        self.lock_file = None
+        self._lock_handle = None
+        self._started = False
+        self._next_attempt = 0.0
+        self._start_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> NoReturn:
+        """
+        Register the replication log endpoint and create a follower per peer. Does nothing
+        unless CHAT_REPLICATION_NODE_ID is set. The followers start on the first request, in
+        the one worker holding the node's lock, or with start().
+
+        Args:
+            app (Flask): The Flask application instance.
+
+        Returns:
+            NoReturn
+        """
+        self.node_id = app.config.get('CHAT_REPLICATION_NODE_ID')
+        if not self.node_id:
+            return
+        self.app = app
+        self.token = app.config.get('CHAT_REPLICATION_TOKEN')
+        interval = app.config.get('CHAT_REPLICATION_INTERVAL', ReplicationFollower.DEFAULT_INTERVAL)
+        self.followers = [ReplicationFollower(app, origin, url, self.token, interval=interval)
+                          for origin, url in (app.config.get('CHAT_REPLICATION_PEERS') or {}).items()
+                          if origin != self.node_id]
+        self.lock_file = (app.config.get('CHAT_REPLICATION_LOCK_FILE') or
+                          os.path.join(self.DEFAULT_LOCK_DIR, f'replication-{self.node_id}.lock'))
+        app.add_url_rule('/replication/log', 'replication_log', self.log_view, methods=['GET'])
+        app.before_request(self.ensure_started)
+        app.extensions['chat_replication'] = self
+
+    def ensure_started(self) -> NoReturn:
+        """
+        Start following the peers unless this or another worker of the node already does.
+        Cheap once started; otherwise the lock is tried once per LOCK_RETRY_INTERVAL.
+        """
+        if self._started or time.monotonic() < self._next_attempt:
+            return
+        with self._start_lock:
+            if self._started or time.monotonic() < self._next_attempt:
+                return
+            self._next_attempt = time.monotonic() + self.LOCK_RETRY_INTERVAL
+            lock_handle = open(self.lock_file, 'a')
+            try:
+                fcntl.flock(lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another worker of this node follows the peers
+                lock_handle.close()
+                return
+            self._lock_handle = lock_handle
+            self._started = True
+            self.start()
+
+    def start(self) -> NoReturn:
+        """
+        Start following the peers. The schema must exist and the message store must
+        support replication.
+        """
+        if not self.app.extensions['chat_server'].message_store.supports_replication:
+            print("Replication needs the 'sqlalchemy' message store, not following peers")
+            return
+        if not self.token:
+            print("CHAT_REPLICATION_TOKEN is not set, not following peers")
+            return
+        for follower in self.followers:
+            follower.start()
+
+    def stop(self) -> NoReturn:
+        """
+        Stop following the peers, and let another worker take over.
+        """
+        for follower in self.followers:
+            follower.stop()
+        if self._lock_handle is not None:
+            self._lock_handle.close()
+            self._lock_handle = None
+
+    def log_view(self) -> Response:
+        """
+        Author:
+            Eric Thomas
+
+        Description:
+            Serves the entries of this node's replication log after the 'after' sequence
+            number, at most 'limit' of them, to a peer holding the replication token.
+
+        Returns:
+            jsonify: {"node": node id, "entries": [...], "head": newest sequence number},
+                     403 without the token, 501 if the message store does not replicate.
+        """
+        supplied = request.headers.get(TOKEN_HEADER)
+        if not self.token or supplied is None or not hmac.compare_digest(supplied, self.token):
+            abort(403)
+        if not self.app.extensions['chat_server'].message_store.supports_replication:
+            return jsonify({"error": "The configured message store does not replicate"}), 501
+
+        after = max(request.args.get('after', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', ReplicationFollower.DEFAULT_BATCH_SIZE, type=int), 1),
+                    self.MAX_BATCH_SIZE)
+        entries, head = ReplicationLogModel.read_entries(self.app, after, limit)
+        return jsonify({"node": self.node_id, "entries": entries, "head": head})
+
+
+if __name__ == '__main__':
+    # Example usage: two nodes on localhost, each writing and each following the other
+    import logging
+    import tempfile
+    import time
+    from werkzeug.serving import make_server
+    from app import create_app, init_schema
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ports = {'node-a': 5101, 'node-b': 5102}
+        apps = {}
+        for node_id, port in ports.items():
+            apps[node_id] = create_app({
+                'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(temp_dir, node_id + '.db')}",
+                'SECRET_KEY': 'replication-demo', 'CHAT_SESSION_STORE': 'memory', 'CHAT_SNAPSHOT_FILE': None,
+                'CHAT_SERVER_CONFIG_FILE': os.path.join(temp_dir, 'config.json'),
+                'CHAT_REPLICATION_NODE_ID': node_id, 'CHAT_REPLICATION_TOKEN': 'demo-token',
+                'CHAT_REPLICATION_INTERVAL': 0.2,
+                'CHAT_REPLICATION_LOCK_FILE': os.path.join(temp_dir, node_id + '.lock'),
+                'CHAT_REPLICATION_PEERS': {peer: f"http://127.0.0.1:{peer_port}" for peer, peer_port in ports.items()},
+            })
+            init_schema(apps[node_id])
+            server = make_server('127.0.0.1', port, apps[node_id], threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        for node_id, node_app in apps.items():
+            store = node_app.extensions['chat_server'].message_store
+            store.append([{'user_id': 'alice' if node_id == 'node-a' else 'bob',
+                           'message': f'hello {i} from {node_id}', 'encrypted': False} for i in range(3)])
+        for node_app in apps.values():
+            node_app.extensions['chat_replication'].ensure_started()
+
+        time.sleep(1.5)
+        for node_id, node_app in apps.items():
+            messages = node_app.extensions['chat_server'].message_store.range_read()
+            print(f"{node_id}: {len(messages)} messages")
+            for message in messages:
+                print(f"    {message.id:3} {message.user_id:6} {message.message}")
+        for node_app in apps.values():
+            node_app.extensions['chat_replication'].stop()
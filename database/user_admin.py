@@ -0,0 +1,133 @@
+"""
+Author: Eric Thomas
+Project: Secure Chat Server
+Group: A
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+User Administration Commands
+
+This module adds a 'users' command group to the Flask CLI for bulk account administration.
+Every command runs one set-based statement through UsersModel, so provisioning or
+resetting tens of thousands of accounts takes a single round trip.
+
+Usage:
+    flask --app app users import users.csv      # create users from a CSV or JSON file
+    flask --app app users export users.json     # write every user to a CSV or JSON file
+    flask --app app users delete users.csv      # delete the users listed in a file
+    flask --app app users logout [users.csv]    # log out the listed users, or everyone
+    flask --app app users set-password alice    # give a user their own password
+    flask --app app users set-password alice --reset   # back to the server password
+
+CSV files need a 'username' column. JSON files hold either a list of usernames or a list
+of objects with a 'username' key, which is the format written by 'export'.
+=======================================================
+"""
+
+import csv
+import json
+import os
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from config.server_config import ServerConfig
+from database.models import UsersModel
+from utils.encryption_tools import hash_password
+
+
+@click.group('users', cls=AppGroup)
+@with_appcontext
+def users_cli():
+    """Bulk user administration."""
+    # Imported here, the application module registers this group when it is imported
+    from app import init_schema
+    init_schema(current_app)
+
+
+def load_usernames(path: str) -> list:
+    """
+    Reads usernames from a CSV or JSON file, chosen by the file extension.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        list: The usernames, in file order.
+
+    Raises:
+        click.BadParameter: If the file format or a username is invalid.
+    """
+    with open(path, 'r', newline='') as user_file:
+        if os.path.splitext(path)[1].lower() == '.json':
+            entries = json.load(user_file)
+            usernames = [entry['username'] if isinstance(entry, dict) else entry for entry in entries]
+        else:
+            reader = csv.DictReader(user_file)
+            if 'username' not in (reader.fieldnames or []):
+                raise click.BadParameter("CSV file needs a 'username' column.")
+            usernames = [row['username'] for row in reader]
+
+    max_length = ServerConfig.max_username_length()
+    for username in usernames:
+        if not isinstance(username, str) or not username.strip() or len(username) > max_length:
+            raise click.BadParameter(f"Invalid username {username!r}, usernames must be 1 to "
+                                     f"{max_length} characters.")
+    return [username.strip() for username in usernames]
+
+
+@users_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_users(path: str):
+    """Create the users listed in a CSV or JSON file. Existing users are skipped."""
+    usernames = load_usernames(path)
+    created = UsersModel.add_users(current_app, usernames)
+    click.echo(f"Created {created} of {len(usernames)} users.")
+
+
+@users_cli.command('export')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+def export_users(path: str):
+    """Write every user to a CSV or JSON file."""
+    users = UsersModel.export_users(current_app)
+    with open(path, 'w', newline='') as user_file:
+        if os.path.splitext(path)[1].lower() == '.json':
+            json.dump(users, user_file, indent=4)
+        else:
+            writer = csv.DictWriter(user_file, fieldnames=['username', 'logged_in', 'ssh_key_setup'])
+            writer.writeheader()
+            writer.writerows(users)
+    click.echo(f"Exported {len(users)} users.")
+
+
+@users_cli.command('delete')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def delete_users(path: str):
+    """Delete the users listed in a CSV or JSON file."""
+    deleted = UsersModel.remove_users(current_app, load_usernames(path))
+    click.echo(f"Deleted {deleted} users.")
+
+
+@users_cli.command('logout')
+@click.argument('path', required=False, type=click.Path(exists=True, dir_okay=False))
+def logout_users(path: str):
+    """Log out the users listed in a CSV or JSON file, or every user without a file."""
+    if path is None:
+        UsersModel.set_all_users_logged_out(current_app)
+        click.echo("Logged out every user.")
+    else:
+        updated = UsersModel.set_users_logged_in(current_app, load_usernames(path), False)
+        click.echo(f"Logged out {updated} users.")
+
+
+@users_cli.command('set-password')
+@click.argument('username')
+@click.option('--reset', is_flag=True, help='Remove the password, the user logs in with the server password again.')
+def set_password(username: str, reset: bool):
+    """Set a user's own password, prompting for it."""
+    password_record = None if reset else hash_password(click.prompt('Password', hide_input=True,
+                                                                    confirmation_prompt=True))
+    if not UsersModel.set_password_record(current_app, username, password_record):
+        raise click.ClickException(f"Username {username} does not have an account.")
+    click.echo(f"Password {'reset' if reset else 'set'} for {username}.")
@@ -0,0 +1,137 @@
+"""
+Author: Eric Thomas
+Project: Secure Chat Server
+Group: A
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Group-Commit Write Pipeline
+
+This module defines an optional write-behind queue for chat messages. Request threads hand
+their message to the queue and wait. A single background writer thread collects messages
+arriving within a short window and appends them to the message store as one batch, which
+for the SQLAlchemy store is one executemany, one retention trim and one commit. Each
+waiting request is then acknowledged with its stored message, or with the error that
+failed the batch.
+
+Under bursty posting the commit cost is shared by the whole batch instead of being paid per
+message, which is where SQLite write throughput is spent.
+=======================================================
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import NoReturn, Optional
+from database.message_store import MessageStore
+
+
+class MessageWriteQueue:
+    """
+    Write-behind queue that batches chat message inserts into group commits.
+    """
+
+    DEFAULT_BATCH_WINDOW = 0.005
+    DEFAULT_MAX_BATCH_SIZE = 256
+    DEFAULT_ACK_TIMEOUT = 10.0
+
+    def __init__(self, store: MessageStore, batch_window: float = DEFAULT_BATCH_WINDOW,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE) -> NoReturn:
+        """
+        Initialize the MessageWriteQueue instance. The writer thread starts on first use, in
+        whichever process submits, so the queue can be created before workers fork.
+
+        Args:
+            store (MessageStore): The store the batches are appended to.
+            batch_window (float): Seconds to keep collecting after the first message of a batch.
+            max_batch_size (int): Maximum number of messages per batch.
+
+        Returns:
+            NoReturn
+        """
+        self.store = store
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._owner_pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_writer(self) -> NoReturn:
+        """
+        Start the writer thread if it is not running in this process.
+        """
+        if self._thread is not None and self._owner_pid == os.getpid():
+            return
+
+        with self._start_lock:
+            if self._thread is None or self._owner_pid != os.getpid():
+                # A forked child inherits the queue object but not the parent's thread
+                self._queue = queue.Queue()
+                self._owner_pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='chat-message-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, user_id: str, message_content: str, encrypted_flag: bool,
+               idempotency_key: Optional[str] = None, timeout: float = DEFAULT_ACK_TIMEOUT) -> tuple:
+        """
+        Queue a message and block until the batch containing it has committed.
+
+        Args:
+            user_id (str): The ID of the user sending the message.
+            message_content (str): The content of the message being sent.
+            encrypted_flag (bool): Indicates whether the message is encrypted.
+            idempotency_key (str): Optional client key that prevents duplicate rows on retries.
+            timeout (float): Seconds to wait for the acknowledgement.
+
+        Returns:
+            tuple: (MessageRecord of the stored message, id of the newest message after the commit)
+
+        Raises:
+            Exception: The error that failed the batch, or TimeoutError.
+        """
+        self._ensure_writer()
+        future = Future()
+        self._queue.put(({'user_id': user_id, 'message': message_content, 'encrypted': encrypted_flag,
+                          'idempotency_key': idempotency_key}, future))
+        return future.result(timeout=timeout)
+
+    def _collect_batch(self) -> list:
+        """
+        Wait for a message, then gather any others that arrive within the batch window.
+
+        Returns:
+            list: (message, future) pairs.
+        """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self) -> NoReturn:
+        """
+        Writer thread loop: insert each batch in one transaction and acknowledge its requests.
+        """
+        while True:
+            batch = self._collect_batch()
+            try:
+                records, head = self.store.append([message for message, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), record in zip(batch, records):
+                    future.set_result((record, head))
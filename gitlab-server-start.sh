@@ -71,6 +71,13 @@ fi
             exit 1
         fi
         
+        echo -e "\e[1m\e[94mBuilding Static Assets\e[0m" # Light blue and bold
+        python utils/static_assets.py --fetch-vendor
+        if [ $? -ne 0 ]; then
+            echo "Error: Failed to build static assets."
+            exit 1
+        fi
+
         echo -e "\e[1m\e[94mStarting Server\e[0m" # Light blue and bold
         nohup python app.py --ip $IP --port $PORT > /dev/null 2>&1 &
         if [ $? -ne 0 ]; then
@@ -57,6 +57,46 @@ function decryptMessage(encryptedMessage) {
     return bytes.toString(CryptoJS.enc.Utf8);
 }
 
+// Retries for a message send that fails on the network or with a server error
+const SEND_MAX_ATTEMPTS = 3;
+const SEND_RETRY_DELAY_MS = 500;
+
+// Random key sent with a message so retries of the same send never create duplicate rows
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    var bytes = new Uint8Array(16);
+    crypto.getRandomValues(bytes);
+    return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+}
+
+// POST a message, retrying with the same idempotency key
+function postMessage(body, idempotencyKey, attempt) {
+    return fetch('/submit_message', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Idempotency-Key': idempotencyKey
+        },
+        body: body
+    })
+        .then(response => {
+            if (response.status >= 500) {
+                throw new Error(`Server error ${response.status}`);
+            }
+            // Get the response from flask if available
+            return response.json();
+        })
+        .catch(error => {
+            if (attempt >= SEND_MAX_ATTEMPTS) {
+                throw error;
+            }
+            return new Promise(resolve => setTimeout(resolve, SEND_RETRY_DELAY_MS * attempt))
+                .then(() => postMessage(body, idempotencyKey, attempt + 1));
+        });
+}
+
 function sendMessage() {
     var messageContent = document.getElementById("messageInput").value;
 
@@ -66,84 +106,383 @@ function sendMessage() {
     }
 
     // Send the message content to the server
-    fetch('/submit_message', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({ user_id: username, message_content: messageContent, message_encrypted: encryptionEnabled })
-    })
-        // Get the response from flask if available
-        .then(response => response.json())
+    var body = JSON.stringify({ user_id: username, message_content: messageContent, message_encrypted: encryptionEnabled });
+    postMessage(body, newIdempotencyKey(), 1)
 
-        // If successful print to console and reset input box, else error to console
+        // If successful show the stored message and reset input box, else error to console
         .then(data => {
             if (data.success) {
                 console.log("Message sent successfully");
                 document.getElementById("messageInput").value = '';
-                refreshChat();
+                headCursor = Math.max(headCursor, data.head);
+                // An active conversation, poll at the server's pace again
+                idlePolls = 0;
+                schedulePoll();
+                return appendMessages([data.message]);
             }
+            console.error('Error:', data.error);
         })
         .catch((error) => {
             console.error('Error:', error);
         });
 }
 
-function refreshChat() {
-    fetch('/get_messages')
+// Upload the chosen file as an attachment, the server adds a message linking to it
+const attachmentsUrl = document.body.dataset.attachmentsUrl;
+
+function sendAttachment() {
+    var fileInput = document.getElementById("attachmentInput");
+    var file = fileInput.files[0];
+    if (!file) {
+        return;
+    }
+
+    // The body is the raw file, streamed by the browser without building a multipart form
+    fetch(`${attachmentsUrl}?filename=${encodeURIComponent(file.name)}`, {
+        method: 'POST',
+        headers: { 'Content-Type': file.type || 'application/octet-stream' },
+        body: file
+    })
         .then(response => response.json())
-        .then(messages => {
-            // Display the messages
-            var messageContainer = document.getElementById("messageContainer");
-            // Clear existing messages from container
-            messageContainer.innerHTML = '';
-
-            messages.forEach((msg, index) => {
-                var messageText = msg.message;
-                var messageEnc = msg.encrypted === true
-
-                // If the database message attribute states it has an encrypted message and the decryption key is available
-                if (messageEnc) {
-                    try {
-                        messageText = decryptMessage(messageText);
-                    } catch (error) {
-                        console.error('Error decrypting message:', error);
-                        messageText = "Error decrypting message";
+        .then(data => {
+            if (data.success) {
+                fileInput.value = '';
+                headCursor = Math.max(headCursor, data.head);
+                return appendMessages([data.message]);
+            }
+            console.error('Error:', data.error);
+        })
+        .catch((error) => {
+            console.error('Error:', error);
+        });
+}
+
+// Compact columnar encoding for the message list (see utils/wire_format.py)
+const COLUMNAR_MIMETYPE = 'application/vnd.securechat.columnar+json';
+
+// Format epoch seconds (UTC) the same way the server formats timestamps: YYYY-MM-DD HH:MM:SS
+function formatTimestamp(epochSeconds) {
+    return new Date(epochSeconds * 1000).toISOString().slice(0, 19).replace('T', ' ');
+}
+
+// Expand a columnar message list back into one object per message
+function decodeColumnar(doc) {
+    var messages = [];
+    for (var i = 0; i < doc.m.length; i++) {
+        var msg = {
+            id: doc.i[i],
+            user_id: doc.users[doc.u[i]],
+            message: doc.m[i],
+            timestamp: formatTimestamp(doc.t[i]),
+            encrypted: doc.e[i] === 1
+        };
+        // The attachment column is only sent when some message shares a file
+        if (doc.a && doc.a[i] !== null) {
+            msg.attachment_id = doc.a[i];
+        }
+        messages.push(msg);
+    }
+    return messages;
+}
+
+// Decode the message list based on the encoding the server chose
+function decodeMessages(response) {
+    var contentType = response.headers.get('Content-Type') || '';
+    return response.json().then(body => contentType.startsWith(COLUMNAR_MIMETYPE) ? decodeColumnar(body) : body);
+}
+
+// Message elements currently on the page, keyed by message id
+var renderedMessages = new Map();
+
+// Decrypted plaintext keyed by ciphertext, null if the message failed to decrypt
+var decryptCache = new Map();
+
+// Id of the newest message known to this page
+var headCursor = 0;
+
+// Number of messages rendered so far, used to alternate message styles
+var renderCount = 0;
+
+// Prevents overlapping refreshes when a fetch or decryption takes longer than the interval
+var refreshInFlight = false;
+var refreshQueued = false;
+
+// Web Worker for bulk decryption, falls back to the main thread if unavailable
+var decryptWorker = null;
+var decryptRequests = new Map();
+var nextDecryptRequestId = 0;
+var cryptoJsUrl = document.body.getAttribute("data-crypto-js-url");
+
+if (window.Worker) {
+    try {
+        decryptWorker = new Worker(document.body.getAttribute("data-decrypt-worker-url"));
+        decryptWorker.onmessage = event => {
+            var resolve = decryptRequests.get(event.data.requestId);
+            decryptRequests.delete(event.data.requestId);
+            resolve(event.data.plaintexts);
+        };
+        decryptWorker.onerror = error => {
+            console.error('Decrypt worker failed, decrypting on the main thread:', error);
+            decryptWorker = null;
+            // Fail any outstanding requests so their refresh can complete
+            decryptRequests.forEach(resolve => resolve(null));
+            decryptRequests.clear();
+        };
+    } catch (error) {
+        console.error('Unable to start decrypt worker:', error);
+        decryptWorker = null;
+    }
+}
+
+// Decrypt a list of ciphertexts on the main thread, null for each failure
+function decryptOnMainThread(ciphertexts) {
+    return ciphertexts.map(ciphertext => {
+        try {
+            return decryptMessage(ciphertext);
+        } catch (error) {
+            console.error('Error decrypting message:', error);
+            return null;
+        }
+    });
+}
+
+// Decrypt every ciphertext that is not cached yet and add the results to decryptCache
+function decryptUncached(ciphertexts) {
+    var pending = ciphertexts.filter(ciphertext => !decryptCache.has(ciphertext));
+    if (pending.length === 0) {
+        return Promise.resolve();
+    }
+
+    var decrypted;
+    if (decryptWorker) {
+        var requestId = nextDecryptRequestId++;
+        decrypted = new Promise(resolve => decryptRequests.set(requestId, resolve))
+            .then(plaintexts => plaintexts || decryptOnMainThread(pending));
+        decryptWorker.postMessage({ requestId: requestId, cryptoJsUrl: cryptoJsUrl, key: encryptionKey, ciphertexts: pending });
+    } else {
+        decrypted = Promise.resolve(decryptOnMainThread(pending));
+    }
+
+    return decrypted.then(plaintexts => {
+        pending.forEach((ciphertext, i) => decryptCache.set(ciphertext, plaintexts[i]));
+    });
+}
+
+// Build the element for one message
+function createMessageElement(msg) {
+    var messageText = msg.message;
+
+    // If the database message attribute states it has an encrypted message, use the decrypted text
+    if (msg.encrypted === true) {
+        messageText = decryptCache.get(msg.message);
+        if (messageText === null || messageText === undefined) {
+            messageText = "Error decrypting message";
+        }
+    }
+
+    // Create a message element with a class based on the user
+    var messageElement = document.createElement("div");
+    messageElement.classList.add("message", `user${renderCount % 3 + 1}`);
+    renderCount++;
+
+    // Create user info element (username and date)
+    var userInfoElement = document.createElement("div");
+    userInfoElement.classList.add("user-info");
+    userInfoElement.textContent = `${msg.user_id} (${msg.timestamp})`;
+
+    // Create message content element, a link to the file for a shared attachment
+    var messageContentElement = document.createElement("div");
+    if (msg.attachment_id !== undefined) {
+        var link = document.createElement("a");
+        link.href = `${attachmentsUrl}/${msg.attachment_id}`;
+        link.target = "_blank";
+        link.rel = "noopener";
+        link.textContent = messageText;
+        messageContentElement.appendChild(link);
+    } else {
+        messageContentElement.textContent = messageText;
+    }
+
+    // Append user info and message content to message element
+    messageElement.appendChild(userInfoElement);
+    messageElement.appendChild(messageContentElement);
+
+    return messageElement;
+}
+
+// Append messages that are not on the page yet, in order
+function appendMessages(messages) {
+    var messageContainer = document.getElementById("messageContainer");
+    var newMessages = messages.filter(msg => !renderedMessages.has(msg.id));
+    if (newMessages.length === 0) {
+        return Promise.resolve();
+    }
+
+    var ciphertexts = newMessages.filter(msg => msg.encrypted === true).map(msg => msg.message);
+
+    return decryptUncached(ciphertexts).then(() => {
+        var fragment = document.createDocumentFragment();
+        newMessages.forEach(msg => {
+            // A concurrent render may already have added it
+            if (renderedMessages.has(msg.id)) {
+                return;
+            }
+            var element = createMessageElement(msg);
+
+            // Older than a message already shown (one appended right after sending), keep id order
+            var before = null;
+            if (msg.id < headCursor) {
+                renderedMessages.forEach((entry, id) => {
+                    if (id > msg.id && (before === null || id < before.id)) {
+                        before = { id: id, element: entry.element };
                     }
-                }
-                else{
-                    console.log('Decrypting:', 'False');
-                }
-
-                // Create a message element with a class based on the user
-                var messageElement = document.createElement("div");
-                messageElement.classList.add("message", `user${index % 3 + 1}`);
-
-                // Create user info element (username and date)
-                var userInfoElement = document.createElement("div");
-                userInfoElement.classList.add("user-info");
-                userInfoElement.textContent = `${msg.user_id} (${msg.timestamp})`;
-
-                // Create message content element
-                var messageContentElement = document.createElement("div");
-                messageContentElement.textContent = messageText;
-
-                // Append user info and message content to message element
-                messageElement.appendChild(userInfoElement);
-                messageElement.appendChild(messageContentElement);
-
-                // Append message element to message container
-                messageContainer.appendChild(messageElement);
-            });
-
-            // Scroll to the bottom of the messages container
-            messageContainer.scrollTop = messageContainer.scrollHeight;
+                });
+            }
+
+            if (before) {
+                messageContainer.insertBefore(element, before.element);
+            } else {
+                fragment.appendChild(element);
+            }
+            renderedMessages.set(msg.id, { element: element, ciphertext: msg.encrypted === true ? msg.message : null });
+            headCursor = Math.max(headCursor, msg.id);
         });
+        messageContainer.appendChild(fragment);
+
+        // Scroll to the bottom of the messages container
+        messageContainer.scrollTop = messageContainer.scrollHeight;
+    });
 }
 
-// Refresh on page load
+// Update the page to match the server's message list, touching only changed messages
+function renderMessages(messages) {
+    var currentIds = new Set(messages.map(msg => msg.id));
+    var newestId = messages.length ? messages[messages.length - 1].id : 0;
+
+    // Remove messages the server no longer holds (oldest messages are trimmed). Messages newer
+    // than this list, such as one just sent, were added after the list was read and are kept.
+    renderedMessages.forEach((entry, id) => {
+        if (!currentIds.has(id) && id < newestId) {
+            entry.element.remove();
+            decryptCache.delete(entry.ciphertext);
+            renderedMessages.delete(id);
+        }
+    });
+
+    return appendMessages(messages);
+}
+
+// Adaptive polling: the server's X-Poll-Interval hint (seconds) is the base interval. It
+// doubles for every poll that brings nothing new and stretches further while the tab is
+// hidden. New messages, sending one, or showing the tab again poll at the hint right away.
+const POLL_MAX_VISIBLE_S = 15;
+const POLL_MAX_HIDDEN_S = 60;
+const POLL_HIDDEN_FACTOR = 4;
+const POLL_MAX_DOUBLINGS = 4;
+// While the push stream is connected, polling only reconciles trimmed messages
+const PUSH_RECONCILE_S = 30;
+
+var pollHint = 3;
+var idlePolls = 0;
+var pollTimer = null;
+
+function nextPollDelay() {
+    if (pushConnected) {
+        return PUSH_RECONCILE_S;
+    }
+    var delay = pollHint * Math.pow(2, Math.min(idlePolls, POLL_MAX_DOUBLINGS));
+    if (document.hidden) {
+        return Math.min(delay * POLL_HIDDEN_FACTOR, POLL_MAX_HIDDEN_S);
+    }
+    return Math.min(delay, POLL_MAX_VISIBLE_S);
+}
+
+function schedulePoll(delaySeconds) {
+    clearTimeout(pollTimer);
+    pollTimer = setTimeout(refreshChat, (delaySeconds === undefined ? nextPollDelay() : delaySeconds) * 1000);
+}
+
+function refreshChat() {
+    // Run once more after the current refresh instead of overlapping it
+    if (refreshInFlight) {
+        refreshQueued = true;
+        return;
+    }
+    refreshInFlight = true;
+    var previousHead = headCursor;
+
+    fetch('/get_messages', { headers: { 'Accept': COLUMNAR_MIMETYPE + ', application/json;q=0.5' } })
+        .then(response => {
+            pollHint = Number(response.headers.get('X-Poll-Interval')) || pollHint;
+            return decodeMessages(response);
+        })
+        .then(renderMessages)
+        .then(() => {
+            idlePolls = headCursor > previousHead ? 0 : idlePolls + 1;
+        })
+        .catch((error) => {
+            console.error('Error refreshing chat:', error);
+        })
+        .finally(() => {
+            refreshInFlight = false;
+            if (refreshQueued) {
+                refreshQueued = false;
+                refreshChat();
+            } else {
+                schedulePoll();
+            }
+        });
+}
+
+// Keep this user's seat in the chat room while the page is open
+function sendHeartbeat() {
+    fetch('/presence', { method: 'POST' })
+        .catch((error) => {
+            console.error('Error sending heartbeat:', error);
+        });
+}
+
+// New messages are pushed over server-sent events while the stream is connected
+var pushConnected = false;
+
+// Empty when the server cannot hold push streams, the page then polls
+const eventsUrl = document.body.dataset.eventsUrl;
+
+function connectPush() {
+    if (!window.EventSource || !eventsUrl) {
+        return;
+    }
+    var source = new EventSource(eventsUrl);
+    source.onopen = () => {
+        pushConnected = true;
+        schedulePoll();
+    };
+    source.addEventListener('messages', event => appendMessages(JSON.parse(event.data)));
+    // Fell behind, or messages arrived through another worker: reload the list once
+    source.addEventListener('resync', () => refreshChat());
+    // The browser reconnects on its own; a refused stream (503) stays closed and polling takes over
+    source.onerror = () => {
+        pushConnected = false;
+        schedulePoll(pollHint);
+    };
+}
+
+// Refresh on page load, every refresh schedules the next one
 refreshChat();
+connectPush();
 
-// Refresh chat messages every 3 seconds
-setInterval(refreshChat, 3000);
+// Back off while hidden, catch up as soon as the tab is shown again
+document.addEventListener('visibilitychange', () => {
+    if (document.hidden) {
+        schedulePoll();
+    } else {
+        idlePolls = 0;
+        refreshChat();
+    }
+});
 
+// Send a presence heartbeat on the server's interval
+const heartbeatInterval = Number(document.body.dataset.heartbeatInterval);
+if (heartbeatInterval > 0) {
+    setInterval(sendHeartbeat, heartbeatInterval * 1000);
+}
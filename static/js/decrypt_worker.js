@@ -0,0 +1,35 @@
+/*
+    Course Name: CMSC495 7384
+    Author: Eric Thomas
+    Group: A
+    Date: Nov 23'
+    Project: CMSC495 Secure Chat Server
+    Platform: Debian Linux
+
+    Description:
+    Web Worker used by the chat page to decrypt batches of messages off the main thread.
+    The page posts { requestId, cryptoJsUrl, key, ciphertexts } and the worker replies with
+    { requestId, plaintexts }, where a plaintext is null if its message failed to decrypt.
+*/
+
+var cryptoJsLoaded = false;
+
+self.onmessage = function (event) {
+    var request = event.data;
+
+    // Load crypto-js the first time it is needed
+    if (!cryptoJsLoaded) {
+        importScripts(request.cryptoJsUrl);
+        cryptoJsLoaded = true;
+    }
+
+    var plaintexts = request.ciphertexts.map(ciphertext => {
+        try {
+            return CryptoJS.AES.decrypt(ciphertext, request.key).toString(CryptoJS.enc.Utf8);
+        } catch (error) {
+            return null;
+        }
+    });
+
+    self.postMessage({ requestId: request.requestId, plaintexts: plaintexts });
+};
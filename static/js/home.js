@@ -9,7 +9,8 @@
     Description:
     This JavaScript file contains client-side code for the Secure Chat Server home page.
     It handles interactions with the SSH and encryption switches, shows confirmation dialogs,
-    and sends requests to the server to update the switches.
+    and sends requests to the server to update the switches. While the user is logged in it
+    also sends presence heartbeats, which keep their seat in the chat room.
 */
 
 // Function to update the SSH switch state
@@ -40,6 +41,18 @@ function updateEncryption() {
     });
 }
 
+// Function to send a presence heartbeat and show the current number of active users
+function sendHeartbeat() {
+    fetch('/presence', { method: 'POST' })
+        .then((response) => response.json())
+        .then((data) => {
+            document.getElementById('active-user-count').textContent = data.active_user_count;
+        })
+        .catch((error) => {
+            console.error('Error sending heartbeat:', error);
+        });
+}
+
 // Event listener to execute updateSSH and updateEncryption when the DOM is loaded
 document.addEventListener('DOMContentLoaded', () => {
     const sshSwitch = document.getElementById('ssh-switch');
@@ -47,5 +60,11 @@ document.addEventListener('DOMContentLoaded', () => {
 
     const encryptionSwitch = document.getElementById('encryption-switch');
     encryptionSwitch.addEventListener('change', updateEncryption);
+
+    // Heartbeats are only rendered for logged in users
+    const heartbeatInterval = Number(document.body.dataset.heartbeatInterval);
+    if (heartbeatInterval > 0) {
+        setInterval(sendHeartbeat, heartbeatInterval * 1000);
+    }
 });
 
@@ -0,0 +1,274 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Push Broadcaster Module
+
+This module fans new chat messages out to the clients connected to the push stream
+(/events) without letting a slow client hold the others back or pin memory:
+
+- Every subscriber has a bounded outbound queue of at most queue_size batches.
+  publish() only appends to the queues under a short lock and never waits for a
+  client, so broadcast latency depends on the subscriber count alone.
+- A subscriber whose queue is full has its backlog dropped and replaced by a single
+  resync marker; further batches are coalesced into it until the subscriber catches up.
+  On a resync the client reloads the message window once instead of receiving every
+  missed update.
+- A subscriber that stays behind for evict_after seconds is evicted: it is closed and
+  its stream ends, and the client reconnects or falls back to polling.
+- At most max_subscribers are connected at once, further subscriptions are refused with
+  TooManySubscribers, which the application answers with 503.
+
+The broadcaster lives in one process. Writes made by other workers or replicated from
+other nodes are found by the stream itself, which compares the store head with the last
+message it sent whenever it wakes up.
+=======================================================
+"""
+
+import threading
+import time
+from collections import deque
+from typing import NoReturn, Optional
+
+# Returned by Subscriber.get when the backlog was coalesced
+RESYNC = 'resync'
+
+
+class TooManySubscribers(Exception):
+    """
+    Raised when the subscriber cap is reached.
+    """
+
+
+class SubscriberClosed(Exception):
+    """
+    Raised by Subscriber.get once the subscriber was evicted or unsubscribed.
+    """
+
+
+class Subscriber:
+    """
+    One push client, with its bounded outbound queue.
+    """
+
+    def __init__(self, name: str, queue_size: int) -> NoReturn:
+        """
+        Initialize the Subscriber instance.
+
+        Args:
+            name (str): Label for logs, such as the username.
+            queue_size (int): Batches queued before the backlog is coalesced.
+
+        Returns:
+            NoReturn
+        """
+        self.name = name
+        self.queue_size = queue_size
+        self.queue = deque()
+        self.resync = False
+        self.closed = False
+        # time.monotonic() when the subscriber fell behind, None while it keeps up
+        self.behind_since = None
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+
+    def get(self, timeout: float) -> Optional[list]:
+        """
+        Waits for the next updates.
+
+        Args:
+            timeout (float): Seconds to wait.
+
+        Returns:
+            list or str or None: The queued batches, RESYNC if the backlog was coalesced,
+                                 None if nothing arrived within the timeout.
+
+        Raises:
+            SubscriberClosed: If the subscriber was evicted or unsubscribed.
+        """
+        self.ready.wait(timeout)
+        with self.lock:
+            if self.closed:
+                raise SubscriberClosed()
+            self.ready.clear()
+            self.behind_since = None
+            if self.resync:
+                self.resync = False
+                self.queue.clear()
+                return RESYNC
+            if not self.queue:
+                return None
+            batches = list(self.queue)
+            self.queue.clear()
+            return batches
+
+    def close(self) -> NoReturn:
+        """
+        Close the subscriber and wake its reader.
+        """
+        with self.lock:
+            self.closed = True
+            self.queue.clear()
+        self.ready.set()
+
+
+class Broadcaster:
+    """
+    Publishes batches of new messages to the push subscribers, see the module description.
+    """
+
+    DEFAULT_MAX_SUBSCRIBERS = 256
+    DEFAULT_QUEUE_SIZE = 64
+    DEFAULT_EVICT_AFTER = 30.0
+
+    def __init__(self, max_subscribers: int = DEFAULT_MAX_SUBSCRIBERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 evict_after: float = DEFAULT_EVICT_AFTER) -> NoReturn:
+        """
+        Initialize the Broadcaster instance.
+
+        Args:
+            max_subscribers (int): Subscribers connected at once.
+            queue_size (int): Batches queued per subscriber before its backlog is coalesced.
+            evict_after (float): Seconds a subscriber may stay behind before it is evicted.
+
+        Returns:
+            NoReturn
+        """
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.evict_after = evict_after
+        self.resyncs = 0
+        self.evictions = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, name: str = '') -> Subscriber:
+        """
+        Connect a subscriber. Subscribers that stayed behind too long are evicted first.
+
+        Args:
+            name (str): Label for logs, such as the username.
+
+        Returns:
+            Subscriber: The subscriber, to read with get() and pass to unsubscribe().
+
+        Raises:
+            TooManySubscribers: If max_subscribers are connected.
+        """
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                self._evict_stale_locked(time.monotonic())
+            if len(self._subscribers) >= self.max_subscribers:
+                raise TooManySubscribers()
+            subscriber = Subscriber(name, self.queue_size)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> NoReturn:
+        """
+        Disconnect a subscriber.
+
+        Args:
+            subscriber (Subscriber): The subscriber.
+
+        Returns:
+            NoReturn
+        """
+        with self._lock:
+            self._subscribers.discard(subscriber)
+        subscriber.close()
+
+    def count(self) -> int:
+        """
+        Get the number of connected subscribers.
+
+        Returns:
+            int: The count.
+        """
+        return len(self._subscribers)
+
+    def _evict_locked(self, subscriber: Subscriber) -> NoReturn:
+        self._subscribers.discard(subscriber)
+        subscriber.close()
+        self.evictions += 1
+        print(f"Evicted push subscriber {subscriber.name or '?'}: behind for over {self.evict_after:g} s")
+
+    def _evict_stale_locked(self, now: float) -> NoReturn:
+        for subscriber in list(self._subscribers):
+            behind_since = subscriber.behind_since
+            if behind_since is not None and now - behind_since > self.evict_after:
+                self._evict_locked(subscriber)
+
+    def publish(self, batch: list) -> NoReturn:
+        """
+        Queue a batch of new messages for every subscriber. Never blocks on a subscriber.
+
+        Args:
+            batch (list): The new MessageRecord tuples.
+
+        Returns:
+            NoReturn
+        """
+        if not batch:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for subscriber in list(self._subscribers):
+                with subscriber.lock:
+                    if subscriber.resync:
+                        # Already coalesced, the resync will pick this batch up
+                        pass
+                    elif len(subscriber.queue) < subscriber.queue_size:
+                        subscriber.queue.append(batch)
+                    else:
+                        subscriber.queue.clear()
+                        subscriber.resync = True
+                        subscriber.behind_since = subscriber.behind_since or now
+                        self.resyncs += 1
+                    if subscriber.behind_since is None and len(subscriber.queue) > subscriber.queue_size // 2:
+                        subscriber.behind_since = now
+                    behind_since = subscriber.behind_since
+                if behind_since is not None and now - behind_since > self.evict_after:
+                    self._evict_locked(subscriber)
+                    continue
+                subscriber.ready.set()
+
+
+if __name__ == '__main__':
+    # Example usage: one fast and one stalled subscriber under a burst of messages
+    broadcaster = Broadcaster(queue_size=8, evict_after=0.5)
+    fast = broadcaster.subscribe('fast')
+    stalled = broadcaster.subscribe('stalled')
+    received = []
+
+    def read_fast() -> NoReturn:
+        try:
+            while True:
+                updates = fast.get(1.0)
+                if isinstance(updates, list):
+                    received.extend(message for batch in updates for message in batch)
+        except SubscriberClosed:
+            pass
+
+    reader = threading.Thread(target=read_fast)
+    reader.start()
+    worst = 0.0
+    for i in range(2000):
+        start = time.perf_counter()
+        broadcaster.publish([i])
+        worst = max(worst, time.perf_counter() - start)
+        time.sleep(0.0005)
+    time.sleep(0.1)
+    broadcaster.unsubscribe(fast)
+    reader.join()
+
+    print(f"fast subscriber received {len(received)} of 2000 messages")
+    print(f"stalled subscriber: queued {len(stalled.queue)}, resync pending {stalled.resync}, "
+          f"evicted {stalled.closed}")
+    print(f"resyncs {broadcaster.resyncs}, evictions {broadcaster.evictions}, worst publish {worst * 1e6:.0f} us")
@@ -12,7 +12,9 @@ Encryption Tools Module
 
 This module provides functions for encrypting and decrypting data using a Fernet cipher
 derived from a user-provided password. It also includes a function for generating
-a SHA-256 hash from a password.
+a SHA-256 hash from a password, salted PBKDF2 password records for user accounts, and
+the CryptoJS-compatible AES functions matching CryptoJS.AES.encrypt(message, passphrase)
+in the browser client (static/js/chat.js).
 =======================================================
 Reference(s):
 Function development referenced Python Cryptography documentation: 
@@ -21,11 +23,15 @@ https://cryptography.io/en/latest/fernet/
 """
 
 import hashlib
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+import hmac
 import traceback
 import base64
+import secrets
+from typing import TYPE_CHECKING
+
+# cryptography is imported on first use so importing get_password_hash stays cheap
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet
 
 
 def encrypt_data_with_password(data: bytes, password: str) -> bytes:
@@ -60,7 +66,7 @@ def decrypt_data_with_password(encrypted_data: bytes, password: str) -> bytes:
     return decrypted_data
 
 
-def _fernet_cipher_from_password(password: str) -> Fernet:
+def _fernet_cipher_from_password(password: str) -> 'Fernet':
     """
     Internal function to derive a Fernet cipher from a password.
 
@@ -70,6 +76,10 @@ def _fernet_cipher_from_password(password: str) -> Fernet:
     Returns:
         Fernet: The derived Fernet cipher.
     """
+    from cryptography.fernet import Fernet
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
     cipher = None
 
     try:
@@ -105,6 +115,130 @@ def get_password_hash(password: str) -> str:
     return hashlib.sha256(password.encode('utf-8')).hexdigest()
 
 
+# Password records are 'pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>'
+PASSWORD_RECORD_SCHEME = 'pbkdf2_sha256'
+PASSWORD_ITERATIONS = 600000
+PASSWORD_SALT_LENGTH = 16
+
+
+def hash_password(password: str, iterations: int = PASSWORD_ITERATIONS) -> str:
+    """
+    Creates a salted PBKDF2-HMAC-SHA256 password record. Deliberately slow, hashlib
+    releases the GIL while deriving so other threads keep running.
+
+    Args:
+        password (str): The password.
+        iterations (int): PBKDF2 iterations.
+
+    Returns:
+        str: The password record.
+    """
+    salt = secrets.token_bytes(PASSWORD_SALT_LENGTH)
+    derived = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f"{PASSWORD_RECORD_SCHEME}${iterations}${salt.hex()}${derived.hex()}"
+
+
+def verify_password(password: str, record: str) -> bool:
+    """
+    Checks a password against a record created by hash_password, in constant time.
+
+    Args:
+        password (str): The password.
+        record (str): The password record.
+
+    Returns:
+        bool: True if the password matches.
+    """
+    try:
+        scheme, iterations, salt, expected = record.split('$')
+        salt = bytes.fromhex(salt)
+        iterations = int(iterations)
+    except ValueError:
+        return False
+    if scheme != PASSWORD_RECORD_SCHEME:
+        return False
+    derived = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return hmac.compare_digest(derived.hex(), expected)
+
+
+# Prefix of the OpenSSL salted format produced by CryptoJS for passphrase keys
+CRYPTOJS_SALT_PREFIX = b'Salted__'
+
+
+def _evp_bytes_to_key(passphrase: bytes, salt: bytes, key_length: int = 32, iv_length: int = 16) -> tuple:
+    """
+    Internal function deriving the AES key and IV from a passphrase the way CryptoJS and
+    OpenSSL's EVP_BytesToKey do (one MD5 iteration).
+
+    Args:
+        passphrase (bytes): The passphrase.
+        salt (bytes): The 8 byte salt.
+        key_length (int): Key length in bytes.
+        iv_length (int): IV length in bytes.
+
+    Returns:
+        tuple: (key, iv)
+    """
+    derived = b''
+    block = b''
+    while len(derived) < key_length + iv_length:
+        block = hashlib.md5(block + passphrase + salt).digest()
+        derived += block
+    return derived[:key_length], derived[key_length:key_length + iv_length]
+
+
+def cryptojs_encrypt(plaintext: str, passphrase: str) -> str:
+    """
+    Encrypts text like CryptoJS.AES.encrypt(plaintext, passphrase).toString(), using
+    AES-256-CBC with a random salt.
+
+    Args:
+        plaintext (str): The text to be encrypted.
+        passphrase (str): The passphrase used to derive the key.
+
+    Returns:
+        str: Base64 of the salted OpenSSL format, as sent by the browser client.
+    """
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    salt = secrets.token_bytes(8)
+    key, iv = _evp_bytes_to_key(passphrase.encode('utf-8'), salt)
+    padder = padding.PKCS7(algorithms.AES.block_size).padder()
+    padded = padder.update(plaintext.encode('utf-8')) + padder.finalize()
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    ciphertext = encryptor.update(padded) + encryptor.finalize()
+    return base64.b64encode(CRYPTOJS_SALT_PREFIX + salt + ciphertext).decode('ascii')
+
+
+def cryptojs_decrypt(encrypted: str, passphrase: str) -> str:
+    """
+    Decrypts text produced by CryptoJS.AES.encrypt(plaintext, passphrase).toString().
+
+    Args:
+        encrypted (str): Base64 of the salted OpenSSL format.
+        passphrase (str): The passphrase used to derive the key.
+
+    Returns:
+        str: The decrypted text.
+
+    Raises:
+        ValueError: If the data is not in the salted format or the passphrase is wrong.
+    """
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    data = base64.b64decode(encrypted)
+    if not data.startswith(CRYPTOJS_SALT_PREFIX) or len(data) < 32 or len(data) % 16:
+        raise ValueError("Not CryptoJS salted AES data")
+    salt, ciphertext = data[8:16], data[16:]
+    key, iv = _evp_bytes_to_key(passphrase.encode('utf-8'), salt)
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    padded = decryptor.update(ciphertext) + decryptor.finalize()
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    return (unpadder.update(padded) + unpadder.finalize()).decode('utf-8')
+
+
 if __name__ == '__main__':
     # Example usage:
     try:
@@ -0,0 +1,166 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Password Verification Pool Module
+
+Salted password records (encryption_tools.hash_password) are deliberately slow to derive.
+PasswordVerifier runs the derivations on a small, bounded thread pool and admits only a
+limited number of logins at a time:
+
+- workers:      derivations running at once. hashlib releases the GIL while deriving, so
+                the pool uses at most this many cores and request threads serving chat
+                polls and posts keep running.
+- max pending:  logins waiting for or running a derivation. Further logins are refused
+                immediately with LoginBusy, which the application answers with HTTP 429,
+                so a login storm cannot tie up every request thread.
+
+Both limits are per process, and the request thread waits for its derivation to finish.
+They protect chat traffic only when a worker serves several requests on threads (the
+development server, gunicorn --threads). A worker serving one request at a time is held
+by a login either way and never has more than one pending, so nothing is refused.
+=======================================================
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NoReturn, Optional
+
+# append system path when run as a script, the application already has the project root on it
+if __package__ in (None, ''):
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# autopep8: off
+from utils.encryption_tools import hash_password, verify_password
+# autopep8: on
+
+
+class LoginBusy(Exception):
+    """
+    Raised when too many logins are already being verified.
+    """
+
+
+class PasswordVerifier:
+    """
+    Hashes and verifies password records on a bounded thread pool with a cap on the
+    number of logins in progress.
+    """
+
+    DEFAULT_WORKERS = 2
+    DEFAULT_MAX_PENDING = 8
+    # Seconds a refused client is asked to wait before retrying
+    RETRY_AFTER = 1
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_pending: int = DEFAULT_MAX_PENDING) -> NoReturn:
+        """
+        Initialize the PasswordVerifier instance.
+
+        Args:
+            workers (int): Threads deriving password hashes.
+            max_pending (int): Logins admitted at once, waiting or running.
+
+        Returns:
+            NoReturn
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        """
+        Get the thread pool, creating it on first use.
+
+        Returns:
+            ThreadPoolExecutor: The pool.
+        """
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='chat-password')
+        return self._pool
+
+    def run(self, func: Callable, *args):
+        """
+        Runs a function on the pool and waits for its result.
+
+        Args:
+            func (Callable): The function.
+            *args: Its arguments.
+
+        Returns:
+            The function's result.
+
+        Raises:
+            LoginBusy: If max_pending logins are already in progress.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise LoginBusy()
+        try:
+            return self.pool.submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def verify(self, password: str, password_record: str) -> bool:
+        """
+        Verifies a password against a password record on the pool.
+
+        Args:
+            password (str): The password.
+            password_record (str): The record.
+
+        Returns:
+            bool: True if the password matches.
+
+        Raises:
+            LoginBusy: If max_pending logins are already in progress.
+        """
+        return self.run(verify_password, password, password_record)
+
+    def hash(self, password: str) -> str:
+        """
+        Creates a password record on the pool.
+
+        Args:
+            password (str): The password.
+
+        Returns:
+            str: The password record.
+
+        Raises:
+            LoginBusy: If max_pending logins are already in progress.
+        """
+        return self.run(hash_password, password)
+
+
+if __name__ == '__main__':
+    # Example usage: a burst of logins against a verifier with two workers and four slots
+    verifier = PasswordVerifier(workers=2, max_pending=4)
+    record = verifier.hash('correct horse')
+    outcomes = []
+
+    def login(password: Optional[str]) -> NoReturn:
+        try:
+            outcomes.append(verifier.verify(password, record))
+        except LoginBusy:
+            outcomes.append('busy')
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=login, args=('correct horse' if i % 2 else 'wrong',)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"10 concurrent logins in {time.perf_counter() - start:.2f} s:")
+    print(f"    matched {outcomes.count(True)}, rejected {outcomes.count(False)}, refused {outcomes.count('busy')}")
@@ -0,0 +1,106 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Poll Interval Hints Module
+
+'/get_messages' tells clients when to poll next in the 'X-Poll-Interval' response header
+(seconds). The hint follows the conversation: an active room is polled every second so
+replies show up at once, a quiet room every few seconds, and a room with no message for
+minutes much less often. When the host is loaded beyond its CPU count the hint is
+stretched in proportion, so clients ease off while the server is busy.
+
+The client treats the hint as its base interval and backs off further on its own while
+polls return nothing new or the tab is hidden (see static/js/chat.js).
+=======================================================
+"""
+
+import os
+from datetime import datetime
+from typing import Optional
+
+POLL_INTERVAL_HEADER = 'X-Poll-Interval'
+
+MIN_POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 30.0
+
+# (seconds since the newest message, suggested interval), the first matching row applies
+_ACTIVITY_STEPS = ((15, 1.0), (60, 2.0), (300, 5.0), (1800, 10.0))
+_IDLE_INTERVAL = 10.0
+
+# Messages in the last minute that count as a busy room, polled at the minimum interval
+_BUSY_MESSAGES_PER_MINUTE = 6
+_LOAD_CAP = 4.0
+
+
+def server_load() -> float:
+    """
+    Get the one-minute load average per CPU.
+
+    Returns:
+        float: The load, 1.0 when every CPU is busy, 0.0 where unavailable.
+    """
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return 0.0
+
+
+def suggest_poll_interval(messages: list, now: Optional[datetime] = None, load: Optional[float] = None) -> float:
+    """
+    Suggests the next poll interval from the recent write rate and the server load.
+
+    Args:
+        messages (list): The message window, oldest first, as returned by the message store.
+        now (datetime): Current naive UTC time, now by default.
+        load (float): Load per CPU, measured by default.
+
+    Returns:
+        float: Seconds until the next poll, between MIN_POLL_INTERVAL and MAX_POLL_INTERVAL.
+    """
+    now = now or datetime.utcnow()
+    load = server_load() if load is None else load
+
+    interval = _IDLE_INTERVAL
+    if messages:
+        age = (now - messages[-1].timestamp).total_seconds()
+        interval = next((step for limit, step in _ACTIVITY_STEPS if age < limit), _IDLE_INTERVAL)
+
+        # Walk back from the newest message only as far as the last minute
+        recent = 0
+        for message in reversed(messages):
+            if (now - message.timestamp).total_seconds() >= 60 or recent >= _BUSY_MESSAGES_PER_MINUTE:
+                break
+            recent += 1
+        if recent >= _BUSY_MESSAGES_PER_MINUTE:
+            interval = MIN_POLL_INTERVAL
+
+    if load > 1.0:
+        interval *= min(load, _LOAD_CAP)
+    return round(min(max(interval, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL), 1)
+
+
+if __name__ == '__main__':
+    # Example usage: hints for a busy, a quiet and an idle room, with and without load
+    from datetime import timedelta
+    from typing import NamedTuple
+
+    class Message(NamedTuple):
+        timestamp: datetime
+
+    current = datetime.utcnow()
+    rooms = {
+        'busy (10 messages in 30 s)': [Message(current - timedelta(seconds=3 * i)) for i in range(10, 0, -1)],
+        'quiet (last message 2 min ago)': [Message(current - timedelta(minutes=2))],
+        'idle (last message 2 h ago)': [Message(current - timedelta(hours=2))],
+        'empty': [],
+    }
+    for room, window in rooms.items():
+        print(f"{room:<32} {suggest_poll_interval(window, current, 0.2):>5} s   "
+              f"under load 3.0: {suggest_poll_interval(window, current, 3.0):>5} s")
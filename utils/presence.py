@@ -0,0 +1,290 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Presence Tracker Module
+
+This module keeps track of which users are in the chat room. The 'logged_in' and
+'last_seen' columns of UsersModel are the record every worker shares; each worker reads
+them at most once per cache TTL, so checking a user's presence or the number of occupied
+seats is an in-memory lookup on most requests.
+
+- Logging in takes a seat if one is free: a single UPDATE checks the seat count and marks
+  the user logged in, so workers admitting users at the same time cannot overfill the room.
+  Logging out is written at once as well.
+- Open pages send a heartbeat every HEARTBEAT_INTERVAL seconds ('/presence'). A user whose
+  last heartbeat is older than the TTL no longer holds a seat, so closing the browser
+  without logging out no longer keeps a seat forever.
+- Heartbeats of present users are collected in memory and written at most once per flush
+  interval, as one executemany. The flush also logs out users whose heartbeat expired.
+
+Other workers see a login or logout within the cache TTL. The flush interval and cache
+TTL must stay well below the TTL minus the heartbeat interval, so a present user's
+heartbeat reaches every worker before it expires.
+=======================================================
+"""
+
+import os
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from flask import Flask
+from typing import Iterable, NoReturn
+
+# append system path when run as a script, the application already has the project root on it
+if __package__ in (None, ''):
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# autopep8: off
+from database.models import UsersModel
+# autopep8: on
+
+# Seconds between client heartbeats, well inside the TTL so one lost heartbeat is harmless
+HEARTBEAT_INTERVAL = 20
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class PresenceTracker:
+    """
+    Registry of present users shared through the database, with heartbeat expiry, a short
+    read cache and batched heartbeat writes.
+    """
+
+    DEFAULT_TTL = 60.0
+    DEFAULT_FLUSH_INTERVAL = 10.0
+    DEFAULT_CACHE_TTL = 2.0
+
+    def __init__(self, ttl: float = DEFAULT_TTL, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 cache_ttl: float = DEFAULT_CACHE_TTL) -> NoReturn:
+        """
+        Initialize the PresenceTracker instance.
+
+        Args:
+            ttl (float): Seconds without a heartbeat after which a user is expired.
+            flush_interval (float): Minimum seconds between heartbeat writes to the database.
+            cache_ttl (float): Seconds the present users read from the database are reused.
+
+        Returns:
+            NoReturn
+        """
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        # username -> last heartbeat (naive UTC) of the present users, as last read
+        self._present = {}
+        # username -> heartbeat not yet written to the database
+        self._heartbeats = {}
+        self._lock = threading.Lock()
+        self._cache_expires = 0.0
+        self._next_flush = time.monotonic() + flush_interval
+
+    def _cutoff(self, now: datetime) -> datetime:
+        return now - timedelta(seconds=self.ttl)
+
+    def _present_users(self, app: Flask) -> dict:
+        """
+        Get the present users, read from the database once the cache has expired, with the
+        heartbeats of this worker not yet written.
+
+        Args:
+            app (Flask): The Flask application instance.
+
+        Returns:
+            dict: Username to last heartbeat, naive UTC.
+        """
+        if time.monotonic() >= self._cache_expires:
+            present = UsersModel.get_present_users(app, self._cutoff(datetime.utcnow()))
+            with self._lock:
+                self._present = present
+                self._cache_expires = time.monotonic() + self.cache_ttl
+
+        cutoff = self._cutoff(datetime.utcnow())
+        with self._lock:
+            last_seen = {username: max(seen, self._heartbeats.get(username, seen))
+                         for username, seen in self._present.items()}
+        return {username: seen for username, seen in last_seen.items() if seen >= cutoff}
+
+    def join(self, app: Flask, username: str, capacity: int) -> bool:
+        """
+        Record a heartbeat for a present user, or give the user a seat if one is free.
+
+        Args:
+            app (Flask): The Flask application instance.
+            username (str): The username.
+            capacity (int): Maximum number of present users.
+
+        Returns:
+            bool: True if the user is present, False if the room is full.
+        """
+        now = datetime.utcnow()
+        if username in self._present_users(app):
+            with self._lock:
+                self._heartbeats[username] = now
+            return True
+
+        if not UsersModel.claim_seat(app, username, capacity, now, self._cutoff(now)):
+            return False
+        with self._lock:
+            self._present[username] = now
+            self._heartbeats.pop(username, None)
+        return True
+
+    def leave(self, app: Flask, username: str) -> NoReturn:
+        """
+        Mark a user absent and free their seat.
+
+        Args:
+            app (Flask): The Flask application instance.
+            username (str): The username.
+
+        Returns:
+            NoReturn
+        """
+        UsersModel.set_users_logged_in(app, [username], False)
+        with self._lock:
+            self._present.pop(username, None)
+            self._heartbeats.pop(username, None)
+
+    def is_present(self, app: Flask, username: str) -> bool:
+        """
+        Check whether a user is present.
+
+        Args:
+            app (Flask): The Flask application instance.
+            username (str): The username.
+
+        Returns:
+            bool: True if the user holds a seat and has not expired.
+        """
+        return username in self._present_users(app)
+
+    def count(self, app: Flask) -> int:
+        """
+        Number of present users.
+
+        Args:
+            app (Flask): The Flask application instance.
+
+        Returns:
+            int: The number of occupied seats.
+        """
+        return len(self._present_users(app))
+
+    def usernames(self, app: Flask) -> list:
+        """
+        Usernames of the present users.
+
+        Args:
+            app (Flask): The Flask application instance.
+
+        Returns:
+            list: The usernames, sorted.
+        """
+        return sorted(self._present_users(app))
+
+    def last_heartbeats(self, app: Flask) -> list:
+        """
+        Time of each present user's last heartbeat, for warm-restart snapshots.
+
+        Args:
+            app (Flask): The Flask application instance.
+
+        Returns:
+            list: (username, seconds since the epoch) pairs, oldest heartbeat first.
+        """
+        present = sorted(self._present_users(app).items(), key=lambda entry: entry[1])
+        return [(username, (seen - _EPOCH).total_seconds()) for username, seen in present]
+
+    def restore_last_heartbeats(self, app: Flask, entries: Iterable[tuple]) -> NoReturn:
+        """
+        Record heartbeats from a warm-restart snapshot, the inverse of last_heartbeats, and
+        write them. Heartbeats that expired during the downtime are skipped. Only users
+        still logged in are affected, and only if the snapshot holds a later heartbeat than
+        the database.
+
+        Args:
+            app (Flask): The Flask application instance.
+            entries (Iterable[tuple]): (username, seconds since the epoch) pairs.
+
+        Returns:
+            NoReturn
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            for username, last_heartbeat in entries:
+                seen = _EPOCH + timedelta(seconds=last_heartbeat)
+                if timedelta(0) <= now - seen < timedelta(seconds=self.ttl):
+                    self._heartbeats[username] = seen
+        self.flush(app)
+        self._cache_expires = 0.0
+
+    def flush(self, app: Flask) -> NoReturn:
+        """
+        Write pending heartbeats to the database and log out expired users.
+
+        Args:
+            app (Flask): The Flask application instance.
+
+        Returns:
+            NoReturn
+        """
+        with self._lock:
+            pending, self._heartbeats = self._heartbeats, {}
+
+        try:
+            if pending:
+                UsersModel.set_users_last_seen(app, pending)
+            UsersModel.expire_logged_in(app, self._cutoff(datetime.utcnow()))
+        except Exception:
+            traceback.print_exc()
+            # Keep the heartbeats for the next flush, newer ones take precedence
+            with self._lock:
+                self._heartbeats = {**pending, **self._heartbeats}
+
+    def maybe_flush(self, app: Flask) -> NoReturn:
+        """
+        Flush pending changes if the flush interval has passed.
+
+        Args:
+            app (Flask): The Flask application instance.
+
+        Returns:
+            NoReturn
+        """
+        now = time.monotonic()
+        if now < self._next_flush:
+            return
+        self._next_flush = now + self.flush_interval
+        self.flush(app)
+
+
+if __name__ == '__main__':
+    # Example usage: two workers sharing one database, with a two-seat room
+    import tempfile
+    from database.models import db
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(temp_dir, 'presence.db')}"
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+        UsersModel.add_users(app, ['alice', 'bob', 'carol'])
+
+        worker_a = PresenceTracker(ttl=0.5, cache_ttl=0.1)
+        worker_b = PresenceTracker(ttl=0.5, cache_ttl=0.1)
+        print(f"alice joined on worker A: {worker_a.join(app, 'alice', capacity=2)}")
+        print(f"bob joined on worker B: {worker_b.join(app, 'bob', capacity=2)}")
+        print(f"carol joined on worker A: {worker_a.join(app, 'carol', capacity=2)}")
+        print(f"Present on worker B: {worker_b.usernames(app)}")
+        time.sleep(0.6)
+        print(f"Present after the TTL: {worker_a.usernames(app)}")
+        print(f"carol joined on worker B: {worker_b.join(app, 'carol', capacity=2)}")
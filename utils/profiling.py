@@ -0,0 +1,303 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+On-Demand Profiling Module
+
+This module profiles a running server without restarting it. Nothing is registered unless
+CHAT_PROFILING is set, so a server that is not being profiled pays nothing. Once enabled:
+
+- POST /admin/profile?seconds=N&output=collapsed  samples the stacks of every thread for N
+  seconds and returns them in the collapsed (folded) format read by flamegraph.pl and
+  speedscope.
+- POST /admin/profile?seconds=N&output=pstats     runs cProfile on every request handled in
+  the next N seconds and returns the merged statistics, readable with pstats or snakeviz.
+- A request carrying 'X-Chat-Profile: <token>' is profiled on its own with cProfile. The
+  statistics are written to CHAT_PROFILE_DIR and named in the 'X-Chat-Profile-File'
+  response header.
+- install_signal_handler() profiles for CHAT_PROFILE_SECONDS when the process receives
+  the signal, writing both outputs to CHAT_PROFILE_DIR.
+
+The endpoint and the header require the CHAT_PROFILE_TOKEN secret ('X-Chat-Profile-Token'
+header for the endpoint); without it only the signal handler works.
+
+Usage:
+    CHAT_PROFILE_TOKEN=secret python3 app.py --profile
+    curl -X POST -H 'X-Chat-Profile-Token: secret' 'http://127.0.0.1:5000/admin/profile?seconds=10' > chat.folded
+    flamegraph.pl chat.folded > chat.svg
+    kill -USR2 <server pid>        # writes database/profiles/profile-<time>.folded and .pstats
+=======================================================
+"""
+
+import cProfile
+import hmac
+import marshal
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from flask import Flask, Response, abort, g, request
+from typing import NoReturn, Optional
+
+DEFAULT_PROFILE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'database', 'profiles'))
+
+PROFILE_HEADER = 'X-Chat-Profile'
+PROFILE_FILE_HEADER = 'X-Chat-Profile-File'
+TOKEN_HEADER = 'X-Chat-Profile-Token'
+
+COLLAPSED_MIMETYPE = 'text/plain'
+PSTATS_MIMETYPE = 'application/octet-stream'
+
+
+def collapse_stack(frame, thread_name: str) -> str:
+    """
+    Formats a stack as one line of the collapsed format, outermost frame first.
+
+    Args:
+        frame (frame): The innermost frame.
+        thread_name (str): Name of the thread, used as the root of the stack.
+
+    Returns:
+        str: The frames joined with ';'.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ';'.join(reversed(names))
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> Counter:
+    """
+    Samples the stacks of every other thread of the process.
+
+    Args:
+        seconds (float): How long to sample.
+        interval (float): Seconds between samples.
+
+    Returns:
+        Counter: Collapsed stack to the number of samples it was seen in.
+    """
+    counts = Counter()
+    own_thread = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != own_thread:
+                counts[collapse_stack(frame, thread_names.get(thread_id, str(thread_id)))] += 1
+        time.sleep(interval)
+    return counts
+
+
+def format_collapsed(counts: Counter) -> str:
+    """
+    Formats sampled stacks in the collapsed format, one 'stack count' line per stack.
+
+    Args:
+        counts (Counter): Collapsed stack to sample count.
+
+    Returns:
+        str: The collapsed stacks.
+    """
+    return ''.join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+
+class Profiler:
+    """
+    Profiles live traffic of an application on request, see the module description.
+    """
+
+    DEFAULT_SECONDS = 10
+    MAX_SECONDS = 120
+
+    def __init__(self, app: Optional[Flask] = None) -> NoReturn:
+        """
+        Initialize the Profiler instance.
+
+        Args:
+            app (Flask): Optional Flask application to initialize immediately.
+
+        Returns:
+            NoReturn
+        """
+        self.token = None
+        self.profile_dir = DEFAULT_PROFILE_DIR
+        self.seconds = self.DEFAULT_SECONDS
+        # Merged statistics of the requests profiled by the running session, None when idle
+        self._stats = None
+        self._session = threading.Lock()
+        self._merge = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> NoReturn:
+        """
+        Register the profiling endpoint and request hooks. Does nothing unless CHAT_PROFILING
+        is set.
+
+        Args:
+            app (Flask): The Flask application instance.
+
+        Returns:
+            NoReturn
+        """
+        if not app.config.get('CHAT_PROFILING'):
+            return
+        self.token = app.config.get('CHAT_PROFILE_TOKEN')
+        self.profile_dir = app.config.get('CHAT_PROFILE_DIR') or DEFAULT_PROFILE_DIR
+        self.seconds = app.config.get('CHAT_PROFILE_SECONDS', self.DEFAULT_SECONDS)
+
+        app.before_request(self._start_request)
+        app.teardown_request(self._end_request)
+        app.after_request(self._name_profile_file)
+        app.add_url_rule('/admin/profile', 'admin_profile', self.profile_view, methods=['POST'])
+        app.extensions['chat_profiler'] = self
+
+    def _authorized(self, supplied: Optional[str]) -> bool:
+        return bool(self.token) and supplied is not None and hmac.compare_digest(supplied, self.token)
+
+    def _start_request(self) -> NoReturn:
+        single = self._authorized(request.headers.get(PROFILE_HEADER))
+        if not single and self._stats is None:
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12 allows one active cProfile per process, skip this request
+            return
+        g.chat_profile = (profiler, single)
+
+    def _end_request(self, exception: Optional[BaseException] = None) -> NoReturn:
+        profiler, single = g.pop('chat_profile', (None, False))
+        if profiler is None:
+            return
+        profiler.disable()
+        if single:
+            return
+        with self._merge:
+            if self._stats is not None:
+                self._stats.add(profiler)
+
+    def _name_profile_file(self, response: Response) -> Response:
+        # The single-request profile stops here, before the response is sent
+        profiler, single = g.get('chat_profile', (None, False))
+        if not single:
+            return response
+        profiler.disable()
+        g.pop('chat_profile')
+        filename = f"request-{time.time_ns()}-{request.endpoint}.pstats"
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(self.profile_dir, filename))
+        response.headers[PROFILE_FILE_HEADER] = filename
+        return response
+
+    def profile(self, seconds: float, collapsed: bool = True, statistics: bool = True) -> Optional[tuple]:
+        """
+        Profiles the process for a number of seconds. Only one session runs at a time.
+
+        Args:
+            seconds (float): How long to profile.
+            collapsed (bool): Sample the stacks of every thread.
+            statistics (bool): Run cProfile on the requests handled meanwhile.
+
+        Returns:
+            tuple or None: (collapsed stacks or None, marshalled pstats or None), None if
+                           another session is running.
+        """
+        if not self._session.acquire(blocking=False):
+            return None
+        try:
+            if statistics:
+                self._stats = pstats.Stats()
+            if collapsed:
+                stacks = format_collapsed(sample_stacks(seconds))
+            else:
+                time.sleep(seconds)
+                stacks = None
+            with self._merge:
+                stats, self._stats = self._stats, None
+            return stacks, marshal.dumps(stats.stats) if stats is not None else None
+        finally:
+            self._session.release()
+
+    def profile_view(self) -> Response:
+        """
+        Author:
+            Eric Thomas
+
+        Description:
+            Profiles live traffic for the requested number of seconds.
+
+        Returns:
+            Response: Collapsed stacks or marshalled pstats, 409 if a profile is running.
+        """
+        if not self._authorized(request.headers.get(TOKEN_HEADER)):
+            abort(403)
+        seconds = min(request.args.get('seconds', self.seconds, type=float), self.MAX_SECONDS)
+        output = request.args.get('output', 'collapsed')
+        if output not in ('collapsed', 'pstats'):
+            abort(400)
+
+        result = self.profile(seconds, collapsed=output == 'collapsed', statistics=output == 'pstats')
+        if result is None:
+            return Response("A profile is already running\n", status=409, mimetype=COLLAPSED_MIMETYPE)
+        stacks, stats = result
+        if output == 'collapsed':
+            return Response(stacks, mimetype=COLLAPSED_MIMETYPE)
+        return Response(stats, mimetype=PSTATS_MIMETYPE,
+                        headers={'Content-Disposition': 'attachment; filename=chat.pstats'})
+
+    def _profile_to_files(self) -> NoReturn:
+        result = self.profile(self.seconds)
+        if result is None:
+            return
+        stacks, stats = result
+        base = os.path.join(self.profile_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}")
+        os.makedirs(self.profile_dir, exist_ok=True)
+        with open(base + '.folded', 'w') as stacks_file:
+            stacks_file.write(stacks)
+        with open(base + '.pstats', 'wb') as stats_file:
+            stats_file.write(stats)
+        print(f"Profile written to {base}.folded and {base}.pstats")
+
+    def install_signal_handler(self, signum: int = signal.SIGUSR2) -> NoReturn:
+        """
+        Profile for CHAT_PROFILE_SECONDS whenever the process receives a signal. Must be
+        called from the main thread.
+
+        Args:
+            signum (int): The signal, SIGUSR2 by default.
+
+        Returns:
+            NoReturn
+        """
+        signal.signal(signum, lambda number, frame: threading.Thread(target=self._profile_to_files,
+                                                                     name='chat-profiler', daemon=True).start())
+
+
+if __name__ == '__main__':
+    # Example usage: sample a busy thread and print its hottest stacks
+    def busy():
+        deadline = time.monotonic() + 0.5
+        while time.monotonic() < deadline:
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy, name='busy')
+    worker.start()
+    samples = sample_stacks(0.4)
+    worker.join()
+    for sampled_stack, sample_count in samples.most_common(3):
+        print(f"{sample_count:5} {sampled_stack}")
@@ -0,0 +1,441 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Server-Side Session Module
+
+This module replaces Flask's signed cookie sessions with sessions kept on the server, so
+every worker process and node shares them and they survive restarts.
+
+- The session cookie only carries a random session id, signed with a secret that is
+  generated once and persisted (see load_or_create_secret), so all workers agree on it.
+- Session data lives in a pluggable SessionStore: SQLiteSessionStore for deployments and
+  MemorySessionStore as a single-process stand-in.
+- ServerSideSessionInterface keeps an in-process read-through cache, so most requests are
+  answered without a store round trip. The store is written only when the session changes
+  or its expiry needs extending, and expired sessions are swept periodically.
+- Signing in issues a new session id (ServerSideSession.regenerate), so an id planted in a
+  browser before login is useless afterwards. Existing sessions are only ever updated in
+  place, never re-created, so a session deleted by another worker stays deleted.
+
+Sessions changed by another worker are seen here once the cached copy is older than the
+cache TTL (a few seconds by default).
+=======================================================
+"""
+
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from itsdangerous import BadSignature, Signer
+from typing import NoReturn, Optional
+
+SECRET_KEY_LENGTH = 32
+SESSION_ID_BYTES = 32
+SIGNER_SALT = 'securechat-session'
+
+
+def load_or_create_secret(path: str) -> bytes:
+    """
+    Reads the shared secret key from a file, creating it on first use. The file is written
+    to a temporary name and linked into place, so concurrent workers either create the
+    secret or read a complete one, never a partial file.
+
+    Args:
+        path (str): Path of the secret key file.
+
+    Returns:
+        bytes: The secret key.
+    """
+    try:
+        with open(path, 'rb') as secret_file:
+            return secret_file.read()
+    except FileNotFoundError:
+        pass
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(file_descriptor, 'wb') as secret_file:
+            secret_file.write(os.urandom(SECRET_KEY_LENGTH))
+            secret_file.flush()
+            os.fsync(secret_file.fileno())
+        os.chmod(temp_path, 0o600)
+        try:
+            # Fails if another worker created the secret first, theirs is kept
+            os.link(temp_path, path)
+        except FileExistsError:
+            pass
+    finally:
+        os.unlink(temp_path)
+
+    with open(path, 'rb') as secret_file:
+        return secret_file.read()
+
+
+class SessionStore(ABC):
+    """
+    Interface for session storage backends. Session data is stored as an opaque string
+    along with its expiry time (seconds since the epoch).
+    """
+
+    @abstractmethod
+    def get(self, sid: str) -> Optional[tuple]:
+        """
+        Fetch a session.
+
+        Args:
+            sid (str): The session id.
+
+        Returns:
+            tuple or None: (data, expires) if the session exists and has not expired.
+        """
+
+    @abstractmethod
+    def save(self, sid: str, data: str, expires: float) -> NoReturn:
+        """
+        Create or replace a session.
+
+        Args:
+            sid (str): The session id.
+            data (str): The serialized session data.
+            expires (float): Expiry time in seconds since the epoch.
+
+        Returns:
+            NoReturn
+        """
+
+    @abstractmethod
+    def update(self, sid: str, data: str, expires: float) -> bool:
+        """
+        Replace a session that still exists.
+
+        Args:
+            sid (str): The session id.
+            data (str): The serialized session data.
+            expires (float): Expiry time in seconds since the epoch.
+
+        Returns:
+            bool: False if the session was deleted or has expired, nothing is written then.
+        """
+
+    @abstractmethod
+    def delete(self, sid: str) -> NoReturn:
+        """
+        Delete a session if it exists.
+
+        Args:
+            sid (str): The session id.
+
+        Returns:
+            NoReturn
+        """
+
+    @abstractmethod
+    def sweep(self, now: float) -> int:
+        """
+        Delete every expired session.
+
+        Args:
+            now (float): Current time in seconds since the epoch.
+
+        Returns:
+            int: Number of sessions deleted.
+        """
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Process-local session store. Sessions are not shared between workers or kept across
+    restarts, so this is only a stand-in for development and tests.
+    """
+
+    def __init__(self) -> NoReturn:
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, sid: str) -> Optional[tuple]:
+        with self._lock:
+            entry = self._sessions.get(sid)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry
+
+    def save(self, sid: str, data: str, expires: float) -> NoReturn:
+        with self._lock:
+            self._sessions[sid] = (data, expires)
+
+    def update(self, sid: str, data: str, expires: float) -> bool:
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None or entry[1] <= time.time():
+                return False
+            self._sessions[sid] = (data, expires)
+        return True
+
+    def delete(self, sid: str) -> NoReturn:
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def sweep(self, now: float) -> int:
+        with self._lock:
+            expired = [sid for sid, (_, expires) in self._sessions.items() if expires <= now]
+            for sid in expired:
+                del self._sessions[sid]
+        return len(expired)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store backed by an SQLite database file shared by every worker on the host.
+    Each thread uses its own connection, and WAL mode lets readers proceed during writes.
+    """
+
+    def __init__(self, path: str) -> NoReturn:
+        """
+        Initialize the SQLiteSessionStore instance. The database is opened, and the table
+        created if needed, on first use.
+
+        Args:
+            path (str): Path of the SQLite database file.
+
+        Returns:
+            NoReturn
+        """
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get this thread's connection, opening it on first use.
+
+        Returns:
+            sqlite3.Connection: The connection.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS sessions "
+                                   "(sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)")
+                connection.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+            self._local.connection = connection
+        return connection
+
+    def get(self, sid: str) -> Optional[tuple]:
+        row = self._connection().execute("SELECT data, expires FROM sessions WHERE sid = ? AND expires > ?",
+                                          (sid, time.time())).fetchone()
+        return tuple(row) if row else None
+
+    def save(self, sid: str, data: str, expires: float) -> NoReturn:
+        connection = self._connection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)",
+                               (sid, data, expires))
+
+    def update(self, sid: str, data: str, expires: float) -> bool:
+        connection = self._connection()
+        with connection:
+            return connection.execute("UPDATE sessions SET data = ?, expires = ? WHERE sid = ? AND expires > ?",
+                                      (data, expires, sid, time.time())).rowcount == 1
+
+    def delete(self, sid: str) -> NoReturn:
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def sweep(self, now: float) -> int:
+        connection = self._connection()
+        with connection:
+            return connection.execute("DELETE FROM sessions WHERE expires <= ?", (now,)).rowcount
+
+
+class ServerSideSession(SecureCookieSession):
+    """
+    Session dictionary that remembers its id and the expiry time it was stored with.
+    """
+
+    def __init__(self, initial: Optional[dict] = None, sid: Optional[str] = None,
+                 expires: float = 0.0, new: bool = False) -> NoReturn:
+        super().__init__(initial)
+        self.sid = sid
+        self.expires = expires
+        self.new = new
+        self.previous_sid = None
+
+    def regenerate(self) -> NoReturn:
+        """
+        Move the session to a new id, called whenever it gains privileges (sign in). The
+        old id is deleted from the store when the session is saved.
+
+        Returns:
+            NoReturn
+        """
+        if not self.new and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(SESSION_ID_BYTES)
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Flask session interface that keeps session data in a SessionStore, fronted by an
+    in-process read-through cache.
+    """
+
+    DEFAULT_CACHE_TTL = 5.0
+    DEFAULT_SWEEP_INTERVAL = 300.0
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store: SessionStore, cache_ttl: float = DEFAULT_CACHE_TTL,
+                 sweep_interval: float = DEFAULT_SWEEP_INTERVAL) -> NoReturn:
+        """
+        Initialize the ServerSideSessionInterface instance.
+
+        Args:
+            store (SessionStore): The backing session store.
+            cache_ttl (float): Seconds a cached session is trusted before it is re-read.
+            sweep_interval (float): Seconds between sweeps of expired sessions.
+
+        Returns:
+            NoReturn
+        """
+        self.store = store
+        self.cache_ttl = cache_ttl
+        self.sweep_interval = sweep_interval
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def _signer(self, app) -> Signer:
+        return Signer(app.secret_key, salt=SIGNER_SALT)
+
+    def _lifetime(self, app) -> float:
+        return app.permanent_session_lifetime.total_seconds()
+
+    def _load(self, sid: str) -> Optional[tuple]:
+        """
+        Read a session through the cache.
+
+        Args:
+            sid (str): The session id.
+
+        Returns:
+            tuple or None: (data, expires) if the session exists and has not expired.
+        """
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._cache.get(sid)
+        if cached is not None and now - cached[2] < self.cache_ttl and cached[1] > time.time():
+            return cached[0], cached[1]
+
+        entry = self.store.get(sid)
+        with self._cache_lock:
+            if entry is None:
+                self._cache.pop(sid, None)
+            else:
+                self._cache[sid] = (entry[0], entry[1], now)
+        return entry
+
+    def _discard(self, sid: str) -> NoReturn:
+        """
+        Delete a session from the store and the cache.
+
+        Args:
+            sid (str): The session id.
+        """
+        self.store.delete(sid)
+        with self._cache_lock:
+            self._cache.pop(sid, None)
+
+    def _maybe_sweep(self) -> NoReturn:
+        """
+        Delete expired sessions from the store and cache if the sweep interval has passed.
+        """
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+
+        wall_now = time.time()
+        self.store.sweep(wall_now)
+        with self._cache_lock:
+            stale = [sid for sid, (_, expires, cached_at) in self._cache.items()
+                     if expires <= wall_now or now - cached_at >= self.cache_ttl]
+            for sid in stale:
+                del self._cache[sid]
+
+    def open_session(self, app, request) -> ServerSideSession:
+        self._maybe_sweep()
+
+        signed_sid = request.cookies.get(self.get_cookie_name(app))
+        if signed_sid:
+            try:
+                sid = self._signer(app).unsign(signed_sid).decode('utf-8')
+            except BadSignature:
+                sid = None
+
+            entry = self._load(sid) if sid else None
+            if entry is not None:
+                return ServerSideSession(self.serializer.loads(entry[0]), sid=sid, expires=entry[1])
+
+        return ServerSideSession(sid=secrets.token_urlsafe(SESSION_ID_BYTES), new=True)
+
+    def save_session(self, app, session: ServerSideSession, response) -> NoReturn:
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # The session moved to a new id, the old one must not be usable again
+        if session.previous_sid is not None:
+            self._discard(session.previous_sid)
+
+        # Emptied session, remove it everywhere
+        if not session:
+            if session.modified and not (session.new and session.previous_sid is None):
+                self._discard(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Only write when the data changed or the stored expiry is more than half used
+        now = time.time()
+        lifetime = self._lifetime(app)
+        if not session.modified and session.expires - now > lifetime / 2:
+            return
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        expires = now + lifetime
+        data = self.serializer.dumps(dict(session))
+        if session.new or session.previous_sid is not None:
+            self.store.save(session.sid, data, expires)
+        elif not self.store.update(session.sid, data, expires):
+            # Deleted by another worker (logout) since it was cached, keep it deleted
+            with self._cache_lock:
+                self._cache.pop(session.sid, None)
+            response.delete_cookie(name, domain=domain, path=path)
+            return
+        with self._cache_lock:
+            self._cache[session.sid] = (data, expires, time.monotonic())
+
+        response.set_cookie(name, self._signer(app).sign(session.sid).decode('utf-8'),
+                            expires=self.get_expiration_time(app, session), httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path, secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
@@ -0,0 +1,330 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Warm-Restart Snapshot Module
+
+This module saves the in-process state of the server to a compact binary file and loads
+it back on boot, so a restarted server serves from memory immediately instead of starting
+cold. A snapshot holds:
+
+- counters:       when it was taken and the id the next message gets
+- message window: the retained chat messages
+- presence:       the present users and the time of their last heartbeat
+
+File layout (little endian):
+
+    header   magic b'SCSN', version (H), flags (H), created (d), payload length (I), crc32 (I)
+    payload  next message id (Q), message count (I), presence count (I)
+             per message:  id (Q), timestamp (q), encrypted (B), user_id, message
+             per presence: last heartbeat (d), username
+    strings are a length (I) followed by UTF-8 bytes, message timestamps are microseconds
+    and other times seconds since the epoch
+
+Snapshots are written to a temporary file and renamed into place, so a crash mid-write
+leaves the previous snapshot intact. On boot the file is memory-mapped and parsed in
+place; a snapshot with a bad magic, version, length or checksum is ignored.
+
+Under a WSGI server every worker has a Snapshotter, and the one that takes an exclusive
+lock on '<snapshot file>.lock' restores and saves the snapshots. The others retry the lock
+every LOCK_RETRY_INTERVAL seconds and take over if that worker exits.
+=======================================================
+"""
+
+import atexit
+import fcntl
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import traceback
+import zlib
+from datetime import datetime, timedelta
+from typing import Callable, NamedTuple, NoReturn, Optional
+
+# append system path when run as a script, the application already has the project root on it
+if __package__ in (None, ''):
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# autopep8: off
+from database.models import MessageRecord
+# autopep8: on
+
+MAGIC = b'SCSN'
+VERSION = 2
+
+_HEADER = struct.Struct('<4sHHdII')
+_COUNTERS = struct.Struct('<QII')
+_MESSAGE = struct.Struct('<QqB')
+_PRESENCE = struct.Struct('<d')
+_STRING_LENGTH = struct.Struct('<I')
+
+
+class Snapshot(NamedTuple):
+    """
+    Contents of a warm-restart snapshot.
+    """
+    created: float
+    next_message_id: int
+    messages: list
+    presence: list  # (username, last heartbeat in seconds since the epoch) pairs
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _to_microseconds(timestamp: datetime) -> int:
+    # Stored timestamps are naive UTC
+    return (timestamp - _EPOCH) // timedelta(microseconds=1)
+
+
+def _from_microseconds(microseconds: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=microseconds)
+
+
+def _pack_string(parts: list, value: str) -> NoReturn:
+    data = value.encode('utf-8')
+    parts.append(_STRING_LENGTH.pack(len(data)))
+    parts.append(data)
+
+
+def encode_snapshot(snapshot: Snapshot) -> bytes:
+    """
+    Encodes a snapshot into the binary file format.
+
+    Args:
+        snapshot (Snapshot): The snapshot.
+
+    Returns:
+        bytes: The file content.
+    """
+    parts = [_COUNTERS.pack(snapshot.next_message_id, len(snapshot.messages), len(snapshot.presence))]
+    for record in snapshot.messages:
+        parts.append(_MESSAGE.pack(record.id, _to_microseconds(record.timestamp), bool(record.encrypted)))
+        _pack_string(parts, record.user_id)
+        _pack_string(parts, record.message)
+    for username, last_heartbeat in snapshot.presence:
+        parts.append(_PRESENCE.pack(last_heartbeat))
+        _pack_string(parts, username)
+
+    payload = b''.join(parts)
+    header = _HEADER.pack(MAGIC, VERSION, 0, snapshot.created, len(payload), zlib.crc32(payload))
+    return header + payload
+
+
+def decode_snapshot(buffer) -> Optional[Snapshot]:
+    """
+    Validates and decodes a snapshot from a buffer, without copying the payload.
+
+    Args:
+        buffer: bytes, or a memory-mapped snapshot file.
+
+    Returns:
+        Snapshot or None: The snapshot, None if the buffer is not a valid snapshot.
+    """
+    if len(buffer) < _HEADER.size:
+        return None
+    magic, version, _, created, length, checksum = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION or len(buffer) != _HEADER.size + length:
+        return None
+
+    view = memoryview(buffer)
+    try:
+        if zlib.crc32(view[_HEADER.size:]) != checksum:
+            return None
+
+        offset = _HEADER.size
+
+        def read_string() -> str:
+            nonlocal offset
+            (size,) = _STRING_LENGTH.unpack_from(buffer, offset)
+            offset += _STRING_LENGTH.size
+            value = str(view[offset:offset + size], 'utf-8')
+            offset += size
+            return value
+
+        next_message_id, message_count, presence_count = _COUNTERS.unpack_from(buffer, offset)
+        offset += _COUNTERS.size
+
+        messages = []
+        for _ in range(message_count):
+            message_id, timestamp, encrypted = _MESSAGE.unpack_from(buffer, offset)
+            offset += _MESSAGE.size
+            user_id = read_string()
+            messages.append(MessageRecord(message_id, user_id, read_string(), _from_microseconds(timestamp),
+                                          bool(encrypted)))
+
+        presence = []
+        for _ in range(presence_count):
+            (last_heartbeat,) = _PRESENCE.unpack_from(buffer, offset)
+            offset += _PRESENCE.size
+            presence.append((read_string(), last_heartbeat))
+    except (struct.error, UnicodeDecodeError):
+        return None
+    finally:
+        view.release()
+
+    return Snapshot(created, next_message_id, messages, presence)
+
+
+def write_snapshot(path: str, snapshot: Snapshot) -> int:
+    """
+    Writes a snapshot file atomically.
+
+    Args:
+        path (str): Path of the snapshot file.
+        snapshot (Snapshot): The snapshot.
+
+    Returns:
+        int: Size of the snapshot in bytes.
+    """
+    data = encode_snapshot(snapshot)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as snapshot_file:
+        snapshot_file.write(data)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temp_path, path)
+    return len(data)
+
+
+def read_snapshot(path: str) -> Optional[Snapshot]:
+    """
+    Memory-maps and validates a snapshot file.
+
+    Args:
+        path (str): Path of the snapshot file.
+
+    Returns:
+        Snapshot or None: The snapshot, None if the file is missing or invalid.
+    """
+    try:
+        with open(path, 'rb') as snapshot_file:
+            if os.fstat(snapshot_file.fileno()).st_size == 0:
+                return None
+            with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return decode_snapshot(mapped)
+    except FileNotFoundError:
+        return None
+
+
+class Snapshotter:
+    """
+    Saves snapshots periodically from a background thread and once more at shutdown.
+    """
+
+    DEFAULT_INTERVAL = 10.0
+    LOCK_RETRY_INTERVAL = 30.0
+
+    def __init__(self, save: Callable[[], NoReturn], interval: float = DEFAULT_INTERVAL,
+                 lock_file: Optional[str] = None, restore: Optional[Callable[[], NoReturn]] = None) -> NoReturn:
+        """
+        Initialize the Snapshotter instance.
+
+        Args:
+            save (Callable): Takes and writes one snapshot.
+            interval (float): Seconds between periodic snapshots.
+            lock_file (str): File locked by the one process that snapshots, see ensure_started.
+            restore (Callable): Loads the last snapshot, called by ensure_started before the
+                                first periodic snapshot.
+
+        Returns:
+            NoReturn
+        """
+        self.save = save
+        self.interval = interval
+        self.lock_file = lock_file
+        self.restore = restore
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock_handle = None
+        self._start_lock = threading.Lock()
+        self._next_attempt = 0.0
+
+    def _save_logged(self) -> NoReturn:
+        try:
+            self.save()
+        except Exception:
+            traceback.print_exc()
+
+    def _run(self) -> NoReturn:
+        while not self._stopped.wait(self.interval):
+            self._save_logged()
+
+    def ensure_started(self) -> NoReturn:
+        """
+        Restore the last snapshot and start the periodic snapshots, unless this or another
+        process holding the lock file already does. Cheap once started; otherwise the lock
+        is tried once per LOCK_RETRY_INTERVAL.
+        """
+        if self._thread is not None or time.monotonic() < self._next_attempt:
+            return
+        with self._start_lock:
+            if self._thread is not None or time.monotonic() < self._next_attempt:
+                return
+            self._next_attempt = time.monotonic() + self.LOCK_RETRY_INTERVAL
+            if self.lock_file:
+                os.makedirs(os.path.dirname(os.path.abspath(self.lock_file)), exist_ok=True)
+                lock_handle = open(self.lock_file, 'a')
+                try:
+                    fcntl.flock(lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # Another process snapshots
+                    lock_handle.close()
+                    return
+                self._lock_handle = lock_handle
+            if self.restore is not None:
+                try:
+                    self.restore()
+                except Exception:
+                    traceback.print_exc()
+            self.start()
+
+    def start(self) -> NoReturn:
+        """
+        Start the periodic snapshots and register the shutdown snapshot.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='chat-snapshotter', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> NoReturn:
+        """
+        Stop the periodic snapshots and take a final one.
+        """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._save_logged()
+        if self._lock_handle is not None:
+            self._lock_handle.close()
+            self._lock_handle = None
+
+
+if __name__ == '__main__':
+    # Example usage: round trip a snapshot with a full message window
+    import tempfile
+
+    window = [MessageRecord(i, f'user{i % 3}', f'message {i}', datetime.utcnow(), i % 2 == 0)
+              for i in range(1, 101)]
+    example = Snapshot(time.time(), 101, window, [('user1', time.time() - 5)])
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        example_path = os.path.join(temp_dir, 'state.snapshot')
+        size = write_snapshot(example_path, example)
+        start = time.perf_counter()
+        loaded = read_snapshot(example_path)
+        elapsed = time.perf_counter() - start
+
+    print(f"Snapshot of {len(window)} messages: {size} bytes, loaded in {elapsed * 1000:.2f} ms")
+    print(f"Round trip intact: {loaded == example}")
@@ -0,0 +1,348 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+SSH Public Key Module
+
+This module validates the OpenSSH public keys users upload, verifies the signatures they
+make with the matching private key, and keeps the keys in memory:
+
+- parse_public_key() checks an authorized_keys style line ('ssh-ed25519 AAAA... comment')
+  and returns the key with its SHA-256 fingerprint, formatted like ssh-keygen -l.
+- verify_signature() checks an SSHSIG signature, the armored output of
+  'ssh-keygen -Y sign -n secure-chat', over a challenge issued by the server. A user proves
+  they hold the private key once, afterwards their session only carries the fingerprint.
+- SSHKeyIndex maps fingerprints to their owner with a dictionary lookup, so permission
+  checks never parse a key or query the database for a key they have seen recently. Parsed
+  key objects are cached alongside for the next signature check. Entries expire after a
+  TTL so a key removed through another worker stops working there too.
+=======================================================
+"""
+
+import base64
+import hashlib
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple, NoReturn, Optional
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+
+SIGNATURE_NAMESPACE = 'secure-chat'
+
+SUPPORTED_KEY_TYPES = ('ssh-ed25519', 'ecdsa-sha2-nistp256', 'ecdsa-sha2-nistp384', 'ecdsa-sha2-nistp521', 'ssh-rsa')
+MIN_RSA_BITS = 2048
+MAX_KEY_LENGTH = 16 * 1024
+
+_SSHSIG_MAGIC = b'SSHSIG'
+_SSHSIG_VERSION = 1
+_SSHSIG_ARMOR_BEGIN = '-----BEGIN SSH SIGNATURE-----'
+_SSHSIG_ARMOR_END = '-----END SSH SIGNATURE-----'
+_SSHSIG_HASHES = {'sha256': hashlib.sha256, 'sha512': hashlib.sha512}
+_ECDSA_HASHES = {'ecdsa-sha2-nistp256': hashes.SHA256, 'ecdsa-sha2-nistp384': hashes.SHA384,
+                 'ecdsa-sha2-nistp521': hashes.SHA512}
+_RSA_HASHES = {'rsa-sha2-256': hashes.SHA256, 'rsa-sha2-512': hashes.SHA512}
+
+
+class SSHKeyError(ValueError):
+    """
+    Raised for a public key or signature that is malformed, unsupported or does not verify.
+    """
+
+
+class ParsedKey(NamedTuple):
+    """
+    A validated OpenSSH public key.
+    """
+    key_type: str
+    fingerprint: str
+    public_key: str
+    comment: str
+    key: object
+
+
+def _read_string(data: bytes, offset: int) -> tuple:
+    if offset + 4 > len(data):
+        raise SSHKeyError("Truncated SSH data")
+    length, = struct.unpack('>I', data[offset:offset + 4])
+    end = offset + 4 + length
+    if end > len(data):
+        raise SSHKeyError("Truncated SSH data")
+    return data[offset + 4:end], end
+
+
+def _string(value: bytes) -> bytes:
+    return struct.pack('>I', len(value)) + value
+
+
+def fingerprint(key_blob: bytes) -> str:
+    """
+    Computes the SHA-256 fingerprint of a public key, as printed by 'ssh-keygen -l'.
+
+    Args:
+        key_blob (bytes): The key in SSH wire format (the base64-decoded key field).
+
+    Returns:
+        str: 'SHA256:' followed by the unpadded base64 digest.
+    """
+    return 'SHA256:' + base64.b64encode(hashlib.sha256(key_blob).digest()).decode('ascii').rstrip('=')
+
+
+def parse_public_key(line: str) -> ParsedKey:
+    """
+    Validates an OpenSSH public key line.
+
+    Args:
+        line (str): 'key-type base64-key [comment]', as found in a .pub file.
+
+    Returns:
+        ParsedKey: The key, its fingerprint and the normalized 'key-type base64-key' text.
+
+    Raises:
+        SSHKeyError: If the key is malformed, of an unsupported type or too weak.
+    """
+    if len(line) > MAX_KEY_LENGTH:
+        raise SSHKeyError("Public key is too long")
+    fields = line.strip().split(None, 2)
+    if len(fields) < 2:
+        raise SSHKeyError("Expected 'key-type base64-key [comment]'")
+    key_type, encoded = fields[0], fields[1]
+    if key_type not in SUPPORTED_KEY_TYPES:
+        raise SSHKeyError(f"Unsupported key type {key_type}, use one of {', '.join(SUPPORTED_KEY_TYPES)}")
+    try:
+        key_blob = base64.b64decode(encoded, validate=True)
+    except ValueError:
+        raise SSHKeyError("Public key is not valid base64")
+    if _read_string(key_blob, 0)[0] != key_type.encode('ascii'):
+        raise SSHKeyError("Key type does not match the key data")
+    try:
+        key = serialization.load_ssh_public_key(f"{key_type} {encoded}".encode('ascii'))
+    except (ValueError, TypeError, struct.error) as e:
+        raise SSHKeyError(f"Invalid public key: {e}")
+    if isinstance(key, rsa.RSAPublicKey) and key.key_size < MIN_RSA_BITS:
+        raise SSHKeyError(f"RSA keys must have at least {MIN_RSA_BITS} bits")
+
+    comment = fields[2].strip() if len(fields) > 2 else ''
+    return ParsedKey(key_type, fingerprint(key_blob), f"{key_type} {encoded}", comment, key)
+
+
+def _decode_armor(armored: str) -> bytes:
+    text = armored.strip()
+    if not text.startswith(_SSHSIG_ARMOR_BEGIN) or not text.endswith(_SSHSIG_ARMOR_END):
+        raise SSHKeyError("Expected the output of 'ssh-keygen -Y sign'")
+    body = ''.join(text[len(_SSHSIG_ARMOR_BEGIN):-len(_SSHSIG_ARMOR_END)].split())
+    try:
+        return base64.b64decode(body, validate=True)
+    except ValueError:
+        raise SSHKeyError("Signature is not valid base64")
+
+
+def _verify_raw(key, key_type: str, signature_type: str, signature: bytes, signed_data: bytes) -> NoReturn:
+    if isinstance(key, ed25519.Ed25519PublicKey) and signature_type == 'ssh-ed25519':
+        key.verify(signature, signed_data)
+    elif isinstance(key, ec.EllipticCurvePublicKey) and signature_type == key_type:
+        r, offset = _read_string(signature, 0)
+        s, _ = _read_string(signature, offset)
+        key.verify(encode_dss_signature(int.from_bytes(r, 'big'), int.from_bytes(s, 'big')), signed_data,
+                   ec.ECDSA(_ECDSA_HASHES[key_type]()))
+    elif isinstance(key, rsa.RSAPublicKey) and signature_type in _RSA_HASHES:
+        # SSHSIG forbids SHA-1 'ssh-rsa' signatures
+        key.verify(signature, signed_data, padding.PKCS1v15(), _RSA_HASHES[signature_type]())
+    else:
+        raise SSHKeyError(f"Unsupported signature type {signature_type}")
+
+
+def verify_signature(parsed_key: ParsedKey, armored: str, message: bytes,
+                     namespace: str = SIGNATURE_NAMESPACE) -> NoReturn:
+    """
+    Verifies an SSHSIG signature over a message.
+
+    Args:
+        parsed_key (ParsedKey): The key expected to have made the signature.
+        armored (str): The armored signature from 'ssh-keygen -Y sign -n <namespace>'.
+        message (bytes): The signed message.
+        namespace (str): The namespace the signature must have been made for.
+
+    Returns:
+        NoReturn
+
+    Raises:
+        SSHKeyError: If the signature is malformed, by another key, for another namespace or
+                     does not verify.
+    """
+    blob = _decode_armor(armored)
+    if not blob.startswith(_SSHSIG_MAGIC) or len(blob) < len(_SSHSIG_MAGIC) + 4:
+        raise SSHKeyError("Not an SSH signature")
+    offset = len(_SSHSIG_MAGIC)
+    version, = struct.unpack('>I', blob[offset:offset + 4])
+    if version != _SSHSIG_VERSION:
+        raise SSHKeyError(f"Unsupported SSH signature version {version}")
+    key_blob, offset = _read_string(blob, offset + 4)
+    signed_namespace, offset = _read_string(blob, offset)
+    reserved, offset = _read_string(blob, offset)
+    hash_algorithm, offset = _read_string(blob, offset)
+    signature, _ = _read_string(blob, offset)
+
+    if fingerprint(key_blob) != parsed_key.fingerprint:
+        raise SSHKeyError("Signature was made with a different key")
+    if signed_namespace != namespace.encode('utf-8'):
+        raise SSHKeyError(f"Signature is not for the '{namespace}' namespace")
+    hash_function = _SSHSIG_HASHES.get(hash_algorithm.decode('ascii', 'replace'))
+    if hash_function is None:
+        raise SSHKeyError("Unsupported signature hash algorithm")
+
+    signature_type, offset = _read_string(signature, 0)
+    raw_signature, _ = _read_string(signature, offset)
+    signed_data = (_SSHSIG_MAGIC + _string(signed_namespace) + _string(reserved) + _string(hash_algorithm)
+                   + _string(hash_function(message).digest()))
+    try:
+        _verify_raw(parsed_key.key, parsed_key.key_type, signature_type.decode('ascii', 'replace'), raw_signature,
+                    signed_data)
+    except InvalidSignature:
+        raise SSHKeyError("Signature does not verify")
+
+
+class SSHKeyIndex:
+    """
+    In-memory index of uploaded keys by fingerprint, filled from the database on a miss.
+    """
+
+    DEFAULT_TTL = 60
+    DEFAULT_MAX_ENTRIES = 10000
+
+    def __init__(self, loader: Callable[[str], Optional[tuple]], ttl: float = DEFAULT_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES) -> NoReturn:
+        """
+        Initialize the SSHKeyIndex instance.
+
+        Args:
+            loader (Callable): Looks a fingerprint up in the database, returning
+                               (username, public key text) or None.
+            ttl (float): Seconds an entry is trusted before it is loaded again.
+            max_entries (int): Entries kept, the least recently used are dropped beyond it.
+
+        Returns:
+            NoReturn
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # fingerprint -> [username, public key text, parsed key or None, expiry]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, fingerprint_text: str) -> Optional[list]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(fingerprint_text)
+            if entry is not None and entry[3] > now:
+                self._entries.move_to_end(fingerprint_text)
+                return entry
+
+        found = self.loader(fingerprint_text)
+        with self._lock:
+            if found is None:
+                self._entries.pop(fingerprint_text, None)
+                return None
+            username, public_key = found
+            if entry is None or entry[1] != public_key:
+                entry = [username, public_key, None, 0]
+            entry[0], entry[3] = username, now + self.ttl
+            self._entries[fingerprint_text] = entry
+            self._entries.move_to_end(fingerprint_text)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry
+
+    def owner(self, fingerprint_text: Optional[str]) -> Optional[str]:
+        """
+        Get the user a key belongs to.
+
+        Args:
+            fingerprint_text (str): The key fingerprint, or None.
+
+        Returns:
+            str or None: The username, None if no such key is stored.
+        """
+        if not fingerprint_text:
+            return None
+        entry = self._entry(fingerprint_text)
+        return entry[0] if entry is not None else None
+
+    def key(self, fingerprint_text: str) -> Optional[ParsedKey]:
+        """
+        Get a stored key, parsing it only the first time.
+
+        Args:
+            fingerprint_text (str): The key fingerprint.
+
+        Returns:
+            ParsedKey or None: The key, None if no such key is stored.
+        """
+        entry = self._entry(fingerprint_text)
+        if entry is None:
+            return None
+        if entry[2] is None:
+            entry[2] = parse_public_key(entry[1])
+        return entry[2]
+
+    def discard(self, fingerprint_text: str) -> NoReturn:
+        """
+        Forget a key, after it was removed from the database.
+
+        Args:
+            fingerprint_text (str): The key fingerprint.
+
+        Returns:
+            NoReturn
+        """
+        with self._lock:
+            self._entries.pop(fingerprint_text, None)
+
+    def clear(self) -> NoReturn:
+        """
+        Forget every key.
+
+        Returns:
+            NoReturn
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+if __name__ == '__main__':
+    # Example usage: sign a challenge with a fresh key and check it like the server does
+    import os
+    import subprocess
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        key_path = os.path.join(temp_dir, 'id_ed25519')
+        subprocess.run(['ssh-keygen', '-q', '-t', 'ed25519', '-N', '', '-C', 'demo', '-f', key_path], check=True)
+        with open(key_path + '.pub') as public_file:
+            demo_key = parse_public_key(public_file.read())
+        print(f"Parsed {demo_key.key_type} key {demo_key.fingerprint} ({demo_key.comment})")
+
+        challenge = base64.urlsafe_b64encode(os.urandom(24))
+        demo_signature = subprocess.run(['ssh-keygen', '-Y', 'sign', '-n', SIGNATURE_NAMESPACE, '-f', key_path],
+                                        input=challenge, capture_output=True, check=True).stdout.decode()
+        verify_signature(demo_key, demo_signature, challenge)
+        print("Signature over the challenge verified")
+        try:
+            verify_signature(demo_key, demo_signature, challenge + b'x')
+        except SSHKeyError as e:
+            print(f"Tampered challenge rejected: {e}")
+
+    index = SSHKeyIndex(lambda fp: ('alice', demo_key.public_key) if fp == demo_key.fingerprint else None)
+    print(f"Owner: {index.owner(demo_key.fingerprint)}, cached key parsed once: "
+          f"{index.key(demo_key.fingerprint) is index.key(demo_key.fingerprint)}")
@@ -0,0 +1,337 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Static Asset Pipeline Module
+
+This module builds and serves fingerprinted, precompressed static assets.
+
+Build step (run before starting the server, see gitlab-server-start.sh):
+    python utils/static_assets.py                  # fingerprint and compress assets
+    python utils/static_assets.py --fetch-vendor   # also download missing vendored libraries
+
+Each asset is copied to 'static/dist' with a content hash in its name (chat.js ->
+dist/js/chat.3f2a9c81d0e4.js), along with '.gz' and '.br' siblings. A manifest maps logical names to fingerprinted
+names. At runtime `StaticAssets` rewrites url_for('static', ...) through the manifest and
+serves fingerprinted files with immutable, long-lived cache headers, picking a
+precompressed sibling based on the request's 'Accept-Encoding'.
+
+Vendored third-party libraries (crypto-js) live under 'static/vendor' so the server works
+without internet access. They are fetched once with --fetch-vendor, checked against their
+pinned digest and committed. The build fails while one is missing or does not match its
+digest, so a deployment
+never ends up loading it from the CDN. Only an unbuilt development checkout falls back to
+the pinned CDN URL, with a warning.
+=======================================================
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+import urllib.request
+import warnings
+from flask import request, send_from_directory, url_for
+from typing import NoReturn
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'static'))
+DIST_DIRNAME = 'dist'
+MANIFEST_FILENAME = 'manifest.json'
+
+# Pinned third-party libraries, vendored path -> (upstream URL, subresource integrity digest).
+# The digest is the one cdnjs publishes for the file, every fetched or vendored copy must match it.
+VENDOR_ASSETS = {
+    'vendor/crypto-js/4.0.0/crypto-js.min.js': (
+        'https://cdnjs.cloudflare.com/ajax/libs/crypto-js/4.0.0/crypto-js.min.js',
+        'sha512-nOQuvD9nKirvxDdvQ9OMqe2dgapbPB7vYAMrzJihw5m+aNcf0dX53m6YxM4LgA9u8e9eg9QX+/+mPu8kCNpV2A==',
+    ),
+}
+
+# Assets to fingerprint, relative to the static directory
+ASSETS = [
+    'chat.css',
+    'home.css',
+    'js/chat.js',
+    'js/home.js',
+    'js/decrypt_worker.js',
+] + list(VENDOR_ASSETS)
+
+FINGERPRINT_LENGTH = 12
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Preferred order when the client accepts several encodings
+PRECOMPRESSED_ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def check_integrity(path: str, content: bytes) -> NoReturn:
+    """
+    Checks a vendored library against its pinned integrity digest.
+
+    Args:
+        path (str): Vendored path relative to the static directory.
+        content (bytes): The library content.
+
+    Returns:
+        NoReturn
+
+    Raises:
+        ValueError: If the content does not match the pinned digest.
+    """
+    integrity = VENDOR_ASSETS[path][1]
+    algorithm, expected = integrity.split('-', 1)
+    actual = base64.b64encode(hashlib.new(algorithm, content).digest()).decode('ascii')
+    if actual != expected:
+        raise ValueError(f"{path} does not match its pinned digest (expected {integrity}, "
+                         f"got {algorithm}-{actual})")
+
+
+def fetch_vendor_assets(static_dir: str = STATIC_DIR) -> NoReturn:
+    """
+    Downloads any vendored library that is not present yet. A download is only written
+    once it matches the pinned digest.
+
+    Args:
+        static_dir (str): The static directory.
+
+    Returns:
+        NoReturn
+
+    Raises:
+        ValueError: If a download does not match its pinned digest.
+    """
+    for path, (url, _) in VENDOR_ASSETS.items():
+        destination = os.path.join(static_dir, path)
+        if os.path.exists(destination):
+            continue
+        print(f"Fetching {url}")
+        with urllib.request.urlopen(url, timeout=30) as response:
+            content = response.read()
+        check_integrity(path, content)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with open(destination + '.tmp', 'wb') as vendor_file:
+            vendor_file.write(content)
+        os.replace(destination + '.tmp', destination)
+
+
+def _fingerprinted_name(path: str, content: bytes) -> str:
+    """
+    Builds the fingerprinted name for an asset inside the dist directory.
+
+    Args:
+        path (str): Asset path relative to the static directory.
+        content (bytes): Asset content.
+
+    Returns:
+        str: Fingerprinted path relative to the static directory.
+    """
+    digest = hashlib.sha256(content).hexdigest()[:FINGERPRINT_LENGTH]
+    base, extension = os.path.splitext(path)
+    return f"{DIST_DIRNAME}/{base}.{digest}{extension}"
+
+
+def build_assets(static_dir: str = STATIC_DIR) -> dict:
+    """
+    Fingerprints and precompresses every asset and writes the manifest. Previously built
+    versions are kept so pages rendered before a deploy can still load their assets.
+
+    Args:
+        static_dir (str): The static directory.
+
+    Returns:
+        dict: The manifest mapping logical asset paths to fingerprinted paths.
+
+    Raises:
+        FileNotFoundError: If a vendored library has not been fetched.
+        ValueError: If a vendored library does not match its pinned digest.
+    """
+    missing_vendor = [path for path in VENDOR_ASSETS if not os.path.exists(os.path.join(static_dir, path))]
+    if missing_vendor:
+        raise FileNotFoundError(f"Vendored libraries missing: {', '.join(missing_vendor)}. Run "
+                                f"'python utils/static_assets.py --fetch-vendor' on a machine with internet "
+                                f"access and commit static/vendor")
+
+    for path in VENDOR_ASSETS:
+        with open(os.path.join(static_dir, path), 'rb') as vendor_file:
+            check_integrity(path, vendor_file.read())
+
+    manifest = {}
+
+    for path in ASSETS:
+        source = os.path.join(static_dir, path)
+        if not os.path.exists(source):
+            print(f"Skipping missing asset: {path}")
+            continue
+
+        with open(source, 'rb') as asset_file:
+            content = asset_file.read()
+
+        fingerprinted = _fingerprinted_name(path, content)
+        destination = os.path.join(static_dir, fingerprinted)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+        with open(destination, 'wb') as output_file:
+            output_file.write(content)
+
+        # mtime=0 keeps the gzip output identical between builds
+        with open(destination + '.gz', 'wb') as output_file:
+            output_file.write(gzip.compress(content, compresslevel=9, mtime=0))
+
+        if brotli is not None:
+            with open(destination + '.br', 'wb') as output_file:
+                output_file.write(brotli.compress(content, quality=11))
+
+        manifest[path] = fingerprinted
+
+    if brotli is None:
+        print("The 'brotli' package is not installed, only gzip variants were built.")
+
+    manifest_path = os.path.join(static_dir, DIST_DIRNAME, MANIFEST_FILENAME)
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+
+    return manifest
+
+
+class StaticAssets:
+    """
+    Serves the fingerprinted assets produced by build_assets. Without a manifest the
+    application falls back to Flask's plain static file handling.
+    """
+
+    def __init__(self, app=None) -> NoReturn:
+        """
+        Initialize the StaticAssets instance.
+
+        Args:
+            app (Flask): Optional Flask application to initialize immediately.
+
+        Returns:
+            NoReturn
+        """
+        self.manifest = {}
+        self.fingerprinted = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> NoReturn:
+        """
+        Load the manifest and hook url_for and the static endpoint of the application.
+
+        Args:
+            app (Flask): The Flask application instance.
+
+        Returns:
+            NoReturn
+        """
+        self.static_folder = app.static_folder
+        manifest_path = os.path.join(self.static_folder, DIST_DIRNAME, MANIFEST_FILENAME)
+        try:
+            with open(manifest_path, 'r') as manifest_file:
+                self.manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            self.manifest = {}
+        self.fingerprinted = set(self.manifest.values())
+        for path in VENDOR_ASSETS:
+            if path not in self.manifest and not os.path.exists(os.path.join(self.static_folder, path)):
+                # Shown once per process, not for every application created
+                warnings.warn(f"{path} is not vendored, pages load it from {VENDOR_ASSETS[path][0]}", stacklevel=2)
+
+        app.url_defaults(self._rewrite_static_url)
+        app.view_functions['static'] = self.send_static_file
+        app.jinja_env.globals['vendor_url'] = self.vendor_url
+
+    def _rewrite_static_url(self, endpoint: str, values: dict) -> NoReturn:
+        """
+        url_defaults callback that swaps logical static filenames for fingerprinted ones.
+
+        Args:
+            endpoint (str): The endpoint being built.
+            values (dict): The URL values, updated in place.
+
+        Returns:
+            NoReturn
+        """
+        if endpoint == 'static':
+            fingerprinted = self.manifest.get(values.get('filename'))
+            if fingerprinted:
+                values['filename'] = fingerprinted
+
+    def vendor_url(self, path: str) -> str:
+        """
+        URL for a vendored library. Uses the local copy when it has been vendored and the
+        pinned upstream URL otherwise, which only an unbuilt checkout can lack (see
+        build_assets).
+
+        Args:
+            path (str): Vendored path relative to the static directory.
+
+        Returns:
+            str: The URL to load the library from.
+        """
+        if path in self.manifest or os.path.exists(os.path.join(self.static_folder, path)):
+            return url_for('static', filename=path)
+        return VENDOR_ASSETS[path][0]
+
+    def send_static_file(self, filename: str):
+        """
+        Static endpoint view. Fingerprinted files are served precompressed when the client
+        accepts it and are cached by clients for a year without revalidation.
+
+        Args:
+            filename (str): The requested path relative to the static directory.
+
+        Returns:
+            Response: The file response.
+        """
+        if filename not in self.fingerprinted:
+            return send_from_directory(self.static_folder, filename)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = None
+        for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+            if encoding in request.accept_encodings and \
+                    os.path.exists(os.path.join(self.static_folder, filename + suffix)):
+                response = send_from_directory(self.static_folder, filename + suffix, mimetype=mimetype)
+                response.content_encoding = encoding
+                break
+
+        if response is None:
+            response = send_from_directory(self.static_folder, filename, mimetype=mimetype)
+
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress static assets.")
+    parser.add_argument('--fetch-vendor', action='store_true',
+                        help='Download vendored libraries that are missing (requires internet access).')
+    args = parser.parse_args()
+
+    try:
+        if args.fetch_vendor:
+            fetch_vendor_assets()
+        built = build_assets()
+    except Exception as e:
+        print(f"Error: Failed to build static assets: {e}")
+        sys.exit(1)
+
+    for logical, fingerprinted in sorted(built.items()):
+        print(f"{logical} -> {fingerprinted}")
@@ -0,0 +1,353 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Request Tracing Module
+
+This module records lightweight timing spans for a sampled fraction of requests and
+writes them to rotating JSON-lines files, so a slow request can be broken down into
+request hooks, the view, model queries, encryption, serialization and template rendering.
+
+- RequestTracer hooks an application: it samples requests at CHAT_TRACE_SAMPLE_RATE,
+  wraps every view, times render_template through Flask's template signals, and writes
+  the spans of each sampled request to CHAT_TRACE_FILE.<pid>. Every worker process writes
+  and rotates its own file, so workers never interleave or lose each other's spans.
+- traced() and trace_static_methods() add spans to functions and model classes, and
+  span() to a block of code, such as a call into a leaf utility that stays untraced
+  itself. Outside a sampled request they cost one context variable lookup. Flask is only
+  imported by RequestTracer, so importing this module stays cheap.
+
+Every line of the trace file is one span:
+
+    {"trace": "9f0c...", "span": 2, "parent": 1, "name": "UsersModel.user_exists",
+     "endpoint": "home", "offset_ms": 0.41, "ms": 0.87}
+
+Summarize the trace files of every process, and their rotated backups, into per-span
+latency tables:
+    python utils/tracing.py [database/trace.jsonl] [--endpoint get_messages] [--sort p95]
+=======================================================
+"""
+
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Callable, Iterator, NoReturn, Optional
+
+# flask and logging are imported by RequestTracer so importing traced() stays cheap
+if TYPE_CHECKING:
+    import logging
+    from flask import Flask
+
+DEFAULT_TRACE_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'database', 'trace.jsonl'))
+
+# Trace of the sampled request being handled in the current context, None otherwise
+_active = ContextVar('chat_trace', default=None)
+
+
+class _Trace:
+    """
+    Spans of one sampled request. Spans are kept as [name, parent, start, duration] lists
+    and nest through a stack of the open spans.
+    """
+
+    __slots__ = ('trace_id', 'endpoint', 'started', 'spans', 'stack')
+
+    def __init__(self, endpoint: Optional[str]) -> NoReturn:
+        self.trace_id = os.urandom(8).hex()
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.spans = []
+        self.stack = []
+
+    def open(self, name: str) -> int:
+        index = len(self.spans)
+        self.spans.append([name, self.stack[-1] if self.stack else None, time.perf_counter(), None])
+        self.stack.append(index)
+        return index
+
+    def close(self, index: int) -> NoReturn:
+        # Spans left open by an exception inside this one end with it
+        now = time.perf_counter()
+        while self.stack:
+            open_index = self.stack.pop()
+            self.spans[open_index][3] = now - self.spans[open_index][2]
+            if open_index == index:
+                break
+
+    def lines(self) -> list:
+        return [json.dumps({'trace': self.trace_id, 'span': index, 'parent': parent, 'name': name,
+                            'endpoint': self.endpoint, 'offset_ms': round((start - self.started) * 1000, 3),
+                            'ms': round(duration * 1000, 3)})
+                for index, (name, parent, start, duration) in enumerate(self.spans)]
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """
+    Decorator that records a span around each call made during a sampled request.
+
+    Args:
+        name (str): Span name, the function's qualified name by default.
+
+    Returns:
+        function: The decorator.
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _active.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            index = trace.open(span_name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                trace.close(index)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Context manager that records a span around its block during a sampled request.
+
+    Args:
+        name (str): Span name.
+
+    Returns:
+        Iterator[None]: The context manager.
+    """
+    trace = _active.get()
+    if trace is None:
+        yield
+        return
+    index = trace.open(name)
+    try:
+        yield
+    finally:
+        trace.close(index)
+
+
+def trace_static_methods(cls: type) -> type:
+    """
+    Class decorator that traces every static method of a class, as 'Class.method' spans.
+
+    Args:
+        cls (type): The class.
+
+    Returns:
+        type: The same class.
+    """
+    for attribute, value in list(vars(cls).items()):
+        if isinstance(value, staticmethod):
+            setattr(cls, attribute, staticmethod(traced(f"{cls.__name__}.{attribute}")(value.__func__)))
+    return cls
+
+
+class RequestTracer:
+    """
+    Samples requests of an application and writes their spans to a rotating file per process.
+    """
+
+    DEFAULT_SAMPLE_RATE = 0.01
+    DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+    DEFAULT_BACKUP_COUNT = 5
+
+    def __init__(self, app: Optional['Flask'] = None) -> NoReturn:
+        """
+        Initialize the RequestTracer instance.
+
+        Args:
+            app (Flask): Optional Flask application to initialize immediately.
+
+        Returns:
+            NoReturn
+        """
+        self.sample_rate = 0.0
+        self.path = None
+        self.max_bytes = self.DEFAULT_MAX_BYTES
+        self.backup_count = self.DEFAULT_BACKUP_COUNT
+        # Logger of the process that opened it, a forked worker opens its own
+        self._logger = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: 'Flask') -> NoReturn:
+        """
+        Open the trace file and hook the requests, views and templates of the application.
+        Call it once every route is registered. Does nothing when CHAT_TRACE_FILE is unset.
+
+        Args:
+            app (Flask): The Flask application instance.
+
+        Returns:
+            NoReturn
+        """
+        path = app.config.get('CHAT_TRACE_FILE')
+        if not path:
+            return
+        from flask import before_render_template, template_rendered
+
+        self.sample_rate = app.config.get('CHAT_TRACE_SAMPLE_RATE', self.DEFAULT_SAMPLE_RATE)
+        self.path = path
+        self.max_bytes = app.config.get('CHAT_TRACE_MAX_BYTES', self.DEFAULT_MAX_BYTES)
+        self.backup_count = app.config.get('CHAT_TRACE_BACKUP_COUNT', self.DEFAULT_BACKUP_COUNT)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # Registered first so the request span also covers the other hooks
+        app.before_request_funcs.setdefault(None, []).insert(0, self._start_request)
+        app.teardown_request(self._end_request)
+        for endpoint, view_func in list(app.view_functions.items()):
+            app.view_functions[endpoint] = traced(f"view {endpoint}")(view_func)
+        before_render_template.connect(self._start_render, app)
+        template_rendered.connect(self._end_render, app)
+        app.extensions['chat_tracing'] = self
+
+    @property
+    def logger(self) -> 'logging.Logger':
+        """
+        Get the logger writing this process's trace file, opening it on first use. Workers
+        forked after init_app, such as preloaded WSGI workers, each open their own.
+
+        Returns:
+            logging.Logger: The logger.
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    import logging
+                    from logging.handlers import RotatingFileHandler
+
+                    handler = RotatingFileHandler(f"{self.path}.{pid}", maxBytes=self.max_bytes,
+                                                  backupCount=self.backup_count, delay=True)
+                    handler.setFormatter(logging.Formatter('%(message)s'))
+                    # A private logger, so the spans never reach the application's log handlers
+                    logger = logging.Logger('chat.tracing')
+                    logger.addHandler(handler)
+                    self._logger, self._pid = logger, pid
+        return self._logger
+
+    def _start_request(self) -> NoReturn:
+        from flask import g, request
+
+        if random.random() >= self.sample_rate:
+            return
+        # Requests that matched no route have no endpoint
+        endpoint = request.endpoint or 'unmatched'
+        trace = _Trace(endpoint)
+        g.chat_trace_token = _active.set(trace)
+        trace.open(f"request {endpoint}")
+
+    def _end_request(self, exception: Optional[BaseException] = None) -> NoReturn:
+        from flask import g
+
+        token = g.pop('chat_trace_token', None)
+        if token is None:
+            return
+        trace = _active.get()
+        _active.reset(token)
+        trace.close(0)
+        self.logger.info('\n'.join(trace.lines()))
+
+    def _start_render(self, sender: 'Flask', template, context: dict, **extra) -> NoReturn:
+        trace = _active.get()
+        if trace is not None:
+            trace.open(f"render {template.name}")
+
+    def _end_render(self, sender: 'Flask', template, context: dict, **extra) -> NoReturn:
+        trace = _active.get()
+        if trace is not None and trace.stack:
+            trace.close(trace.stack[-1])
+
+
+def read_spans(paths: list, endpoint: Optional[str] = None) -> dict:
+    """
+    Reads span durations from trace files.
+
+    Args:
+        paths (list): Trace files.
+        endpoint (str): Only read the spans of requests to this endpoint.
+
+    Returns:
+        dict: Span name to a list of durations in milliseconds.
+    """
+    durations = {}
+    for path in paths:
+        with open(path, 'r') as trace_file:
+            for line in trace_file:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                if endpoint is None or span['endpoint'] == endpoint:
+                    durations.setdefault(span['name'], []).append(span['ms'])
+    return durations
+
+
+def summarize(durations: dict, sort: str = 'total') -> list:
+    """
+    Builds per-span latency rows from span durations.
+
+    Args:
+        durations (dict): Span name to a list of durations in milliseconds.
+        sort (str): Column to sort by, largest first.
+
+    Returns:
+        list: One dict per span name, with count, total, mean, p50, p95, p99 and max.
+    """
+    import statistics
+
+    rows = []
+    for name, values in durations.items():
+        values = sorted(values)
+
+        def percentile(fraction: float) -> float:
+            return values[min(int(fraction * len(values)), len(values) - 1)]
+
+        rows.append({'span': name, 'count': len(values), 'total': sum(values), 'mean': statistics.fmean(values),
+                     'p50': percentile(0.50), 'p95': percentile(0.95), 'p99': percentile(0.99), 'max': values[-1]})
+    return sorted(rows, key=lambda row: row[sort], reverse=True)
+
+
+if __name__ == '__main__':
+    import argparse
+    import glob
+
+    parser = argparse.ArgumentParser(description="Summarize request traces into per-span latency tables.")
+    parser.add_argument('path', nargs='?', help='Trace file, the files of every process and their rotated '
+                                                'backups are included.',
+                        default=DEFAULT_TRACE_FILE)
+    parser.add_argument('--endpoint', help='Only include requests to this endpoint.')
+    parser.add_argument('--sort', choices=['total', 'count', 'mean', 'p50', 'p95', 'p99', 'max'], default='total',
+                        help='Column to sort by.')
+    args = parser.parse_args()
+
+    trace_paths = sorted(glob.glob(glob.escape(args.path) + '.*')) + [args.path]
+    trace_paths = [path for path in trace_paths if os.path.isfile(path)]
+    if not trace_paths:
+        print(f"No trace file at {args.path}")
+        raise SystemExit(1)
+
+    summary = summarize(read_spans(trace_paths, args.endpoint), args.sort)
+    width = max([len(row['span']) for row in summary] + [4])
+    columns = ['count', 'total', 'mean', 'p50', 'p95', 'p99', 'max']
+    print(f"{'span':<{width}}" + ''.join(f"{column + ('' if column == 'count' else ' ms'):>12}" for column in columns))
+    for row in summary:
+        print(f"{row['span']:<{width}}{row['count']:>12}" +
+              ''.join(f"{row[column]:>12.3f}" for column in columns[1:]))
@@ -0,0 +1,240 @@
+"""
+Course Name: CMSC495 7384
+Project: CMSC495 Secure Chat Server
+Group: A
+Author: Eric Thomas
+Date: Nov 23'
+Platform: Debian Linux
+Dependency: Python 3.10 +
+=======================================================
+Description:
+Wire Format Module
+
+This module serializes chat message lists for the '/get_messages' endpoint. Two encodings
+are supported and selected through the request 'Accept' header:
+
+- application/json: the default, a list with one object per message.
+- application/vnd.securechat.columnar+json: a compact columnar layout. Usernames are
+  dictionary-encoded, timestamps are sent as integer seconds since the epoch (UTC), and
+  key names appear once per response instead of once per row:
+
+      {"v": 1, "users": ["alice", "bob"], "i": [7, 8, 9], "u": [0, 1, 0], "m": ["hi", "hey", "ok"],
+       "t": [1700000000, 1700000003, 1700000007], "e": [0, 0, 1]}
+
+Both encodings carry each message's database id, which is stable for the life of the message
+and increases with insertion order, so clients can render incrementally.
+
+History exports ('/export') stream NDJSON or CSV, one message per line, in chunks built
+from a row iterator, optionally gzip-compressed on the fly, so memory use does not grow
+with the number of messages.
+=======================================================
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+import zlib
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator
+
+# append system path when run as a script, the application already has the project root on it
+if __package__ in (None, ''):
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# autopep8: off
+from utils.tracing import traced
+# autopep8: on
+
+JSON_MIMETYPE = 'application/json'
+COLUMNAR_MIMETYPE = 'application/vnd.securechat.columnar+json'
+COLUMNAR_VERSION = 1
+NDJSON_MIMETYPE = 'application/x-ndjson'
+CSV_MIMETYPE = 'text/csv'
+GZIP_MIMETYPE = 'application/gzip'
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+CSV_COLUMNS = ['id', 'user_id', 'message', 'timestamp', 'encrypted']
+
+# Messages encoded per chunk of a streamed export
+EXPORT_CHUNK_ROWS = 500
+
+# Stored timestamps are naive UTC datetimes
+_EPOCH = datetime(1970, 1, 1)
+_ONE_SECOND = timedelta(seconds=1)
+
+
+def wants_columnar(accept_mimetypes) -> bool:
+    """
+    Determines whether the client prefers the columnar encoding. Plain JSON wins ties
+    so browsers sending '*/*' keep receiving the default format.
+
+    Args:
+        accept_mimetypes: The request's parsed 'Accept' header (request.accept_mimetypes).
+
+    Returns:
+        bool: True if the columnar encoding should be used.
+    """
+    return accept_mimetypes.best_match([JSON_MIMETYPE, COLUMNAR_MIMETYPE]) == COLUMNAR_MIMETYPE
+
+
+def message_to_dict(message) -> dict:
+    """
+    Converts one chat message to its default object representation.
+
+    Args:
+        message: Chat message row exposing id, user_id, message, timestamp and encrypted
+                 attributes, and optionally attachment_id.
+
+    Returns:
+        dict: The message dictionary, with 'attachment_id' only for messages sharing a file.
+    """
+    result = {'id': message.id, 'user_id': message.user_id, 'message': message.message,
+              'timestamp': message.timestamp.strftime(TIMESTAMP_FORMAT),
+              'encrypted': message.encrypted}
+    attachment_id = getattr(message, 'attachment_id', None)
+    if attachment_id is not None:
+        result['attachment_id'] = attachment_id
+    return result
+
+
+@traced()
+def messages_to_list(messages) -> list:
+    """
+    Converts chat messages to the default list-of-objects representation.
+
+    Args:
+        messages: Iterable of chat message rows exposing id, user_id, message, timestamp
+                  and encrypted attributes.
+
+    Returns:
+        list: A list of dictionaries, one per message.
+    """
+    return [message_to_dict(message) for message in messages]
+
+
+@traced()
+def encode_columnar(messages) -> str:
+    """
+    Encodes chat messages in the compact columnar layout.
+
+    Args:
+        messages: Iterable of chat message rows exposing id, user_id, message, timestamp
+                  and encrypted attributes.
+
+    Returns:
+        str: The encoded JSON document. The 'a' column of attachment ids (null for plain
+             messages) is only present when at least one message shares a file.
+    """
+    user_index = {}
+    users, id_column, user_column, message_column, time_column, encrypted_column = [], [], [], [], [], []
+    attachment_column, has_attachments = [], False
+
+    for message in messages:
+        index = user_index.get(message.user_id)
+        if index is None:
+            index = user_index[message.user_id] = len(users)
+            users.append(message.user_id)
+        id_column.append(message.id)
+        user_column.append(index)
+        message_column.append(message.message)
+        time_column.append((message.timestamp - _EPOCH) // _ONE_SECOND)
+        encrypted_column.append(1 if message.encrypted else 0)
+        attachment_id = getattr(message, 'attachment_id', None)
+        attachment_column.append(attachment_id)
+        has_attachments = has_attachments or attachment_id is not None
+
+    document = {'v': COLUMNAR_VERSION, 'users': users, 'i': id_column, 'u': user_column,
+                'm': message_column, 't': time_column, 'e': encrypted_column}
+    if has_attachments:
+        document['a'] = attachment_column
+    return json.dumps(document, separators=(',', ':'), ensure_ascii=False)
+
+
+def _chunked(messages: Iterable, chunk_rows: int) -> Iterator[list]:
+    chunk = []
+    for message in messages:
+        chunk.append(message)
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_ndjson(messages: Iterable, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """
+    Streams chat messages as newline-delimited JSON, one message object per line.
+
+    Args:
+        messages: Iterable of chat message rows exposing id, user_id, message, timestamp
+                  and encrypted attributes.
+        chunk_rows (int): Messages per yielded chunk.
+
+    Returns:
+        Iterator[bytes]: The encoded chunks.
+    """
+    for chunk in _chunked(messages, chunk_rows):
+        yield ''.join(json.dumps(message_to_dict(message), ensure_ascii=False) + '\n'
+                      for message in chunk).encode('utf-8')
+
+
+def iter_csv(messages: Iterable, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """
+    Streams chat messages as CSV with a header row.
+
+    Args:
+        messages: Iterable of chat message rows exposing id, user_id, message, timestamp
+                  and encrypted attributes.
+        chunk_rows (int): Messages per yielded chunk.
+
+    Returns:
+        Iterator[bytes]: The encoded chunks.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for chunk in _chunked(messages, chunk_rows):
+        writer.writerows((message.id, message.user_id, message.message,
+                          message.timestamp.strftime(TIMESTAMP_FORMAT), int(bool(message.encrypted)))
+                         for message in chunk)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty history
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_gzip(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """
+    Gzip-compresses a stream of chunks on the fly.
+
+    Args:
+        chunks (Iterable[bytes]): The uncompressed chunks.
+        level (int): Compression level.
+
+    Returns:
+        Iterator[bytes]: The gzip stream.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+if __name__ == '__main__':
+    # Example usage:
+    from collections import namedtuple
+
+    Message = namedtuple('Message', ['id', 'user_id', 'message', 'timestamp', 'encrypted'])
+    sample = [Message(i + 1, f"user{i % 3}", f"message number {i}", datetime(2023, 11, 23, 12, 0, i % 60), i % 2 == 0)
+              for i in range(100)]
+
+    default_payload = json.dumps(messages_to_list(sample))
+    columnar_payload = encode_columnar(sample)
+
+    print(f"Default encoding:  {len(default_payload)} bytes")
+    print(f"Columnar encoding: {len(columnar_payload)} bytes")
+    print(f"First 120 characters of columnar payload:\n{columnar_payload[:120]}")